@@ -0,0 +1,184 @@
+"""
+Офлайн-бенчмарк полного обхода: MetalParser.parse_all против локального
+стенда (standin_site.py), запущенного в отдельном процессе, с записью во
+временную БД. Сеть не нужна.
+
+Первый проход - холодный (все страницы разбираются), последующие (--runs)
+идут с HTTP-кэшем и неизменившимися категориями. Для каждого прохода:
+страниц/сек, строк/сек, CPU разбора, время записи в БД (полное, с fsync
+и ожиданием блокировок, и отдельно CPU) и пиковый RSS.
+
+    python benchmarks/bench_crawl.py --categories 200 --rows 100 --latency 0.02 [--runs 2]
+    python benchmarks/bench_crawl.py --json before.json          # сохранить результат
+    python benchmarks/bench_crawl.py --baseline before.json      # сравнить, код 1 при регрессии
+    python benchmarks/bench_crawl.py --metrics metrics.json      # снимок метрик (гистограммы, span)
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('MANAGER_CHANNEL_ID', '0')
+
+import database  # noqa: E402
+import metrics  # noqa: E402
+from config import config  # noqa: E402
+from parser import MetalParser  # noqa: E402
+from standin_site import add_site_arguments  # noqa: E402
+
+# Метрики, для которых больше - лучше; для остальных лучше меньше
+HIGHER_IS_BETTER = {'pages_per_sec', 'rows_per_sec'}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_site(args, port: int) -> subprocess.Popen:
+    """Запускает стенд в отдельном процессе, чтобы он не делил цикл событий с парсером."""
+    command = [sys.executable, str(BENCH_DIR / 'standin_site.py'), '--port', str(port)]
+    for name in ('categories', 'rows', 'latency', 'jitter', 'error_rate', 'retry_after', 'max_rps', 'seed'):
+        command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    if args.no_etag:
+        command.append('--no-etag')
+    if args.fixtures:
+        command += ['--fixtures', args.fixtures]
+    site = subprocess.Popen(command)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return site
+        except OSError:
+            time.sleep(0.05)
+    site.kill()
+    raise RuntimeError("Stand-in site did not start")
+
+
+def peak_rss_mb() -> float:
+    # На Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def crawl_once(concurrency: int) -> dict:
+    parser = MetalParser(max_concurrent_requests=concurrency)
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        saved = await parser.parse_all()
+    finally:
+        await parser.close_session()
+    elapsed = time.perf_counter() - started
+    stats = parser.stats
+    rows = database.execute_query("SELECT COUNT(*) FROM prices", fetch='one')[0]
+    return {
+        'categories': saved,
+        'pages': stats.requests,
+        'rows': rows,
+        'elapsed': elapsed,
+        'pages_per_sec': stats.requests / elapsed,
+        'rows_per_sec': rows / elapsed,
+        'cpu_time': time.process_time() - cpu_started,
+        'parse_cpu': stats.parse_cpu_time,
+        'db_time': stats.db_write_time + stats.publish_time,
+        'db_cpu': stats.db_write_cpu_time + stats.publish_cpu_time,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def compare(results: list, baseline_file: str, tolerance: float) -> bool:
+    """Печатает изменения относительно сохраненного результата. Возвращает False при регрессии."""
+    baseline = json.loads(Path(baseline_file).read_text())['runs']
+    ok = True
+    print(f"\nvs {baseline_file} (tolerance {tolerance:.0%}):")
+    for run, (before, after) in enumerate(zip(baseline, results), 1):
+        for metric in ('pages_per_sec', 'rows_per_sec', 'parse_cpu', 'db_time', 'peak_rss_mb'):
+            # В старых результатах db_write был CPU записи - с полным временем его не сравниваем
+            if not before.get(metric):
+                continue
+            change = (after[metric] - before[metric]) / before[metric]
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ''
+            if worse > tolerance:
+                flag = '  REGRESSION'
+                ok = False
+            print(f"  run {run} {metric:<14} {before[metric]:>10.2f} -> {after[metric]:>10.2f} ({change:+.1%}){flag}")
+    return ok
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_site_arguments(arg_parser)
+    arg_parser.add_argument('--runs', type=int, default=2, help='crawls over the same database')
+    arg_parser.add_argument('--concurrency', type=int, default=10)
+    arg_parser.add_argument('--engine', choices=('bs4', 'lxml'), help='PARSER_ENGINE for this run')
+    arg_parser.add_argument('--wal', action='store_true')
+    arg_parser.add_argument('--no-cache', action='store_true', help='disable the HTTP response cache')
+    arg_parser.add_argument('--json', help='write results to this file')
+    arg_parser.add_argument('--baseline', help='compare with results saved by --json')
+    arg_parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown vs baseline')
+    arg_parser.add_argument('--metrics', help='dump collected metrics (JSON) to this file')
+    args = arg_parser.parse_args()
+
+    port = free_port()
+    site = start_site(args, port)
+    with tempfile.TemporaryDirectory() as tmp:
+        # MetalParser читает настройки при создании, поэтому их можно подменить здесь
+        config.BASE_URL = f"http://127.0.0.1:{port}"
+        config.HTTP_CACHE_ENABLED = not args.no_cache
+        config.HTTP_CACHE_FILE = os.path.join(tmp, 'http_cache.db')
+        config.PROXIES = []
+        if args.engine:
+            config.PARSER_ENGINE = args.engine
+        database.DB_FILE = os.path.join(tmp, 'bench.db')
+        database.init_db(wal=args.wal)
+
+        results = []
+        try:
+            print(
+                f"{'run':>3} {'pages':>6} {'rows':>7} {'time s':>7} {'pages/s':>8} {'rows/s':>9} "
+                f"{'CPU s':>6} {'parse s':>7} {'DB s':>6} {'DB CPU':>6} {'RSS MB':>7}"
+            )
+            for run in range(1, args.runs + 1):
+                result = asyncio.run(crawl_once(args.concurrency))
+                results.append(result)
+                print(
+                    f"{run:>3} {result['pages']:>6} {result['rows']:>7} {result['elapsed']:>7.2f} "
+                    f"{result['pages_per_sec']:>8.1f} {result['rows_per_sec']:>9.0f} "
+                    f"{result['cpu_time']:>6.2f} {result['parse_cpu']:>7.2f} "
+                    f"{result['db_time']:>6.2f} {result['db_cpu']:>6.2f} {result['peak_rss_mb']:>7.1f}"
+                )
+            with urllib.request.urlopen(f"{config.BASE_URL}/_stats") as response:
+                site_stats = json.load(response)
+            print(
+                f"stand-in: {site_stats['requests']} requests, {site_stats['errors']} errors injected, "
+                f"{site_stats['throttled']} over capacity, "
+                f"{site_stats['not_modified']} not modified"
+            )
+        finally:
+            site.terminate()
+            site.wait()
+
+    if args.metrics:
+        metrics.registry.dump_json(args.metrics)
+    if args.json:
+        Path(args.json).write_text(json.dumps({'args': vars(args), 'runs': results}, indent=2))
+    if args.baseline and not compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
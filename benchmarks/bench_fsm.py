@@ -0,0 +1,115 @@
+"""
+Накладные расходы хранилища состояний FSM на одно обновление:
+MemoryStorage против SQLiteStorage (fsm_storage.py) с отложенной записью
+и с записью при каждом изменении (--flush-interval 0).
+
+Обновления идут от многих пользователей одновременно, как в боте: на каждое
+обновление middleware aiogram читает состояние, а часть обновлений проходит
+диалог расчета заказа (выбор товара -> метры -> срок -> clear).
+
+    python benchmarks/bench_fsm.py --users 2000 --updates 50000 [--dialog-share 0.2]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('MANAGER_CHANNEL_ID', '0')
+
+from aiogram.fsm.context import FSMContext  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+
+from bench_handlers import percentile  # noqa: E402
+from fsm_storage import SQLiteStorage  # noqa: E402
+from handlers import CalculationStates  # noqa: E402
+
+
+async def handle_update(storage, user_id: int, dialog: bool):
+    """Работа с хранилищем за одно обновление пользователя."""
+    context = FSMContext(storage, StorageKey(bot_id=1, chat_id=user_id, user_id=user_id))
+    state = await context.get_state()
+    if not dialog:
+        return
+    if state is None:
+        await context.set_state(CalculationStates.waiting_for_meters)
+        await context.update_data(category_id=random.randint(1, 500))
+    elif state == CalculationStates.waiting_for_meters.state:
+        await context.update_data(meters=random.randint(1, 1000))
+        await context.set_state(CalculationStates.waiting_for_date)
+    else:
+        await context.update_data(delivery_date='в течение недели')
+        await context.get_data()
+        await context.clear()
+
+
+async def run(storage, args) -> dict:
+    latencies = []
+    in_flight = set()
+    started = time.perf_counter()
+    for _ in range(args.updates):
+        user_id = random.randint(1, args.users)
+        dialog = random.random() < args.dialog_share
+
+        async def one(user_id=user_id, dialog=dialog):
+            update_started = time.perf_counter()
+            await handle_update(storage, user_id, dialog)
+            latencies.append(time.perf_counter() - update_started)
+
+        task = asyncio.create_task(one())
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+        if len(in_flight) >= args.concurrency:
+            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+    await asyncio.gather(*in_flight)
+    elapsed = time.perf_counter() - started
+    closed = time.perf_counter()
+    await storage.close()
+    return {
+        'updates_per_sec': args.updates / elapsed,
+        'mean_us': statistics.fmean(latencies) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'close_ms': (time.perf_counter() - closed) * 1000,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--users', type=int, default=2000)
+    arg_parser.add_argument('--updates', type=int, default=50000)
+    arg_parser.add_argument('--dialog-share', type=float, default=0.2, help='share of updates inside the calculator dialog')
+    arg_parser.add_argument('--concurrency', type=int, default=100, help='updates processed at once')
+    arg_parser.add_argument('--flush-interval', type=float, default=0.05, help='SQLiteStorage batching interval, seconds')
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storages = [
+            ('memory', lambda: MemoryStorage()),
+            (f'sqlite batched ({args.flush_interval * 1000:.0f} ms)',
+             lambda: SQLiteStorage(os.path.join(tmp, 'batched.db'), flush_interval=args.flush_interval)),
+            ('sqlite per write', lambda: SQLiteStorage(os.path.join(tmp, 'direct.db'), flush_interval=0)),
+        ]
+        print(f"{'storage':<24} {'updates/s':>10} {'mean us':>9} {'p99 us':>9} {'close ms':>9}")
+        for name, factory in storages:
+            random.seed(0)
+
+            async def measure():
+                # Хранилище создается внутри цикла событий, как в боте
+                return await run(factory(), args)
+
+            result = asyncio.run(measure())
+            print(
+                f"{name:<24} {result['updates_per_sec']:>10.0f} {result['mean_us']:>9.1f} "
+                f"{result['p99_us']:>9.1f} {result['close_ms']:>9.1f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Нагрузочный тест пути данных обработчиков бота: задержка колбэков при
+одновременных пользователях с синхронным доступом к SQLite в цикле событий
+и через асинхронный шлюз (db_gateway).
+
+Колбэки приходят с постоянной частотой (открытая модель нагрузки), половина
+из них читает детали категории из БД, половина - нет (как «Главное меню»).
+Синхронные запросы задерживают и те колбэки, которым БД не нужна.
+
+    python benchmarks/bench_handlers.py --rate 2000 --duration 5 [--readers 2]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('MANAGER_CHANNEL_ID', '0')
+
+import database  # noqa: E402
+from bench_save import make_catalog  # noqa: E402
+from db_gateway import DatabaseGateway  # noqa: E402
+
+
+def percentile(values: list, share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+async def run_load(mode: str, category_ids: list, args) -> dict:
+    gateway = DatabaseGateway(readers=args.readers) if mode == 'gateway' else None
+    latencies = {'db': [], 'menu': []}
+
+    async def callback(kind: str, received: float):
+        if kind == 'db':
+            category_id = random.choice(category_ids)
+            if gateway:
+                await gateway.get_category_details(category_id)
+            else:
+                database.get_category_details(category_id)
+        else:
+            await asyncio.sleep(0)
+        latencies[kind].append(time.perf_counter() - received)
+
+    tasks = []
+    interval = 1 / args.rate
+    started = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - started < args.duration:
+        # Догоняем расписание: сколько колбэков должно было прийти к этому моменту
+        due = int((time.perf_counter() - started) / interval)
+        for _ in range(due - sent):
+            kind = 'db' if random.random() < 0.5 else 'menu'
+            tasks.append(asyncio.create_task(callback(kind, time.perf_counter())))
+        sent = max(sent, due)
+        await asyncio.sleep(interval)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    if gateway:
+        await gateway.close()
+
+    return {
+        'mode': mode,
+        'throughput': len(tasks) / elapsed,
+        **{
+            f"{kind}_{name}": percentile(values, share) * 1000
+            for kind, values in latencies.items() if values
+            for name, share in (('p50', 0.5), ('p99', 0.99))
+        },
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--categories', type=int, default=200)
+    arg_parser.add_argument('--rows', type=int, default=200)
+    arg_parser.add_argument('--rate', type=float, default=2000, help='callbacks per second from all users')
+    arg_parser.add_argument('--duration', type=float, default=5)
+    arg_parser.add_argument('--readers', type=int, default=2, help='gateway reader threads')
+    arg_parser.add_argument('--wal', action='store_true')
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, 'bench.db')
+        database.init_db(wal=args.wal)
+        database.save_parsed_data(make_catalog(args.categories, args.rows))
+        category_ids = [category_id for category_id, _ in database.get_all_categories()]
+
+        print(f"{'mode':<8} {'cb/s':>8} {'db p50':>9} {'db p99':>9} {'menu p50':>9} {'menu p99':>9}  (ms)")
+        for mode in ('direct', 'gateway'):
+            result = asyncio.run(run_load(mode, category_ids, args))
+            print(
+                f"{result['mode']:<8} {result['throughput']:>8.0f} "
+                f"{result['db_p50']:>9.2f} {result['db_p99']:>9.2f} "
+                f"{result['menu_p50']:>9.2f} {result['menu_p99']:>9.2f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
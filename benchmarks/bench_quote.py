@@ -0,0 +1,83 @@
+"""
+Расчет стоимости заказа (pricing): время quote() по всем предложениям
+категории для разного числа строк, в сравнении с тем же расчетом циклом
+Python, и стоимость вычисления массы при загрузке (на строку).
+
+    python benchmarks/bench_quote.py --rows 100 1000 5000 20000
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pricing  # noqa: E402
+
+SIZES = [('57', '3,5'), ('76', '4'), ('89', '4'), ('108', '4,5'), ('159', '5'), ('219', '6')]
+
+
+def make_rows(count: int) -> list:
+    """Строки цен трубной категории в формате парсера."""
+    rng = random.Random(count)
+    rows = []
+    for i in range(count):
+        diameter, wall = rng.choice(SIZES)
+        rows.append({
+            'position': f"Труба электросварная {diameter}x{wall}",
+            'spec': 'ст3сп',
+            'dimensions': f"{diameter}x{wall}",
+            'ton_price': 45000.0 + rng.randrange(0, 40000, 10),
+            'supplier': f"Поставщик {i % 40}",
+            'city': ('Москва', 'Казань', 'Екатеринбург')[i % 3],
+        })
+    return rows
+
+
+def python_quote(rows: list, quantity: float) -> dict:
+    """Тот же расчет построчно, без NumPy."""
+    costs = sorted(
+        (quantity * weight / 1000 * ton_price, i) for i, (ton_price, weight, *_) in enumerate(rows)
+    )
+    return {'min_cost': costs[0][0], 'median_cost': statistics.median(cost for cost, _ in costs), 'best': costs[0][1]}
+
+
+def timed(func, repeat: int) -> float:
+    """Среднее время вызова, мкс."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 5000, 20000])
+    arg_parser.add_argument('--repeat', type=int, default=200)
+    args = arg_parser.parse_args()
+
+    print(f"{'rows':>6} {'weights us/row':>15} {'table ms':>9} {'quote us':>9} {'python us':>10}")
+    for count in args.rows:
+        rows = make_rows(count)
+        started = time.perf_counter()
+        profiles = pricing.category_profiles(rows, 'Трубы')
+        ingest = (time.perf_counter() - started) / count * 1e6
+
+        quote_rows = [
+            (row['ton_price'], weight, unit, row['position'], row['dimensions'], row['supplier'], row['city'])
+            for row, (weight, unit, _) in zip(rows, profiles)
+        ]
+        started = time.perf_counter()
+        table = pricing.QuoteTable(quote_rows)
+        build = (time.perf_counter() - started) * 1000
+
+        quote_us = timed(lambda: table.quote(120), args.repeat)
+        python_us = timed(lambda: python_quote(quote_rows, 120), max(1, args.repeat // 10))
+        assert abs(table.quote(120)['min_cost'] - python_quote(quote_rows, 120)['min_cost']) < 1e-6
+        print(f"{count:>6} {ingest:>15.1f} {build:>9.2f} {quote_us:>9.1f} {python_us:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
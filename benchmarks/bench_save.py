@@ -0,0 +1,105 @@
+"""
+Бенчмарк записи каталога в БД: построчная запись (как было раньше)
+против пакетной записи одной транзакцией.
+
+    python benchmarks/bench_save.py --categories 50 --rows 400 [--wal]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import ujson
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+
+
+def make_catalog(categories: int, rows: int) -> list:
+    """Синтетический каталог в формате MetalParser.parse_category_page."""
+    return [
+        {
+            'category_name': f"Категория {c}",
+            'url': f"/price/cat{c}",
+            'filters': {'Диаметр': [str(d) for d in range(20, 120, 5)]},
+            'prices': [
+                {
+                    'position': f"Труба {c}-{r}",
+                    'spec': 'ст3сп',
+                    'dimensions': f"{57 + r % 50}x3.5",
+                    'price_per_ton': f"{50000 + r * 10}",
+                    'price_per_item': '',
+                    'supplier': f"Поставщик {r % 40}",
+                    'phone': f"+7 900 000-{r:04d}",
+                    'city': ('Москва', 'Казань', 'Екатеринбург')[r % 3],
+                }
+                for r in range(rows)
+            ],
+        }
+        for c in range(categories)
+    ]
+
+
+def legacy_save(data: list):
+    """Прежняя реализация: отдельное соединение и коммит на каждую строку."""
+    def query(sql, params=(), fetch=None):
+        with sqlite3.connect(database.DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            conn.commit()
+            return cursor.fetchone() if fetch else None
+
+    for table in ('prices', 'filters', 'categories'):
+        query(f"DELETE FROM {table}")
+    for category_data in data:
+        query("INSERT INTO categories (name, url) VALUES (?, ?)",
+              (category_data['category_name'], category_data['url']))
+        category_id = query("SELECT id FROM categories WHERE name = ?",
+                            (category_data['category_name'],), fetch='one')[0]
+        for group, sizes in category_data['filters'].items():
+            query("INSERT INTO filters (category_id, filter_group, sizes) VALUES (?, ?, ?)",
+                  (category_id, group, ujson.dumps(sizes)))
+        for p in category_data['prices']:
+            query(
+                """
+                INSERT INTO prices (
+                    category_id, position, spec, dimensions, price_per_ton,
+                    price_per_item, supplier, phone, city
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (category_id, p['position'], p['spec'], p['dimensions'], p['price_per_ton'],
+                 p['price_per_item'], p['supplier'], p['phone'], p['city'])
+            )
+
+
+def run(name: str, save, data: list, wal: bool) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, 'bench.db')
+        database.init_db(wal=wal)
+        started = time.perf_counter()
+        save(data)
+        elapsed = time.perf_counter() - started
+    rows = sum(len(c['prices']) + len(c['filters']) + 1 for c in data)
+    print(f"{name:<10} {rows:>8} rows in {elapsed:8.3f}s -> {rows / elapsed:12,.0f} rows/sec")
+    return elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--categories', type=int, default=50)
+    arg_parser.add_argument('--rows', type=int, default=400, help='price rows per category')
+    arg_parser.add_argument('--wal', action='store_true', help='enable WAL and synchronous=NORMAL')
+    args = arg_parser.parse_args()
+
+    data = make_catalog(args.categories, args.rows)
+    before = run('before', legacy_save, data, args.wal)
+    after = run('after', database.save_parsed_data, data, args.wal)
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Лучшие предложения и рейтинг поставщиков: время get_offer_comparison по спискам,
+посчитанным при публикации (top_offers, supplier_ranking), в сравнении с теми же
+выборками на лету (сортировка строк категории и GROUP BY поставщика), для разного
+числа строк в категории, а также стоимость пересчета списков при публикации.
+
+    python benchmarks/bench_top_offers.py --rows 1000 10000 50000 --suppliers 200
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('MANAGER_CHANNEL_ID', '0')
+
+import database  # noqa: E402
+
+CITIES = ['Москва', 'Санкт-Петербург', 'Екатеринбург', 'Казань', 'Челябинск', 'Новосибирск']
+SIZES = [57, 76, 89, 108, 133, 159, 219]
+
+
+def make_category(rows: int, suppliers: int) -> list:
+    """Одна трубная категория в формате MetalParser.parse_category_page."""
+    return [{
+        'category_name': 'Трубы электросварные',
+        'url': '/price/cat0',
+        'filters': {},
+        'prices': [
+            {
+                'position': f"Труба электросварная {SIZES[r % len(SIZES)]}x4",
+                'spec': 'ст3сп',
+                'dimensions': f"{SIZES[r % len(SIZES)]}x4",
+                'price_per_ton': f"{50000 + (r * 7919) % 30000}",
+                'supplier': f"Поставщик {r % suppliers}",
+                'city': CITIES[r % len(CITIES)],
+            }
+            for r in range(rows)
+        ],
+    }]
+
+
+def on_the_fly(conn: sqlite3.Connection, category_id: int, city: str, size: str, limit: int):
+    """Те же лучшие предложения и поставщики без посчитанных заранее списков."""
+    conn.execute(
+        f"""
+        SELECT id FROM prices WHERE category_id = ? AND ton_price IS NOT NULL
+            AND (? = '' OR city = ?) AND (? = '' OR size = ?)
+        ORDER BY {database.PRICE_SORT_KEY}, id LIMIT ?
+        """,
+        (category_id, city, city, size, size, limit)
+    ).fetchall()
+    conn.execute(
+        """
+        SELECT supplier, MIN(ton_price) AS best, COUNT(*) FROM prices
+        WHERE category_id = ? AND ton_price IS NOT NULL GROUP BY supplier ORDER BY best LIMIT ?
+        """,
+        (category_id, limit)
+    ).fetchall()
+
+
+def timed(func, repeat: int) -> float:
+    """Среднее время вызова, мкс."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000])
+    arg_parser.add_argument('--suppliers', type=int, default=200)
+    arg_parser.add_argument('--limit', type=int, default=5)
+    arg_parser.add_argument('--repeat', type=int, default=200)
+    args = arg_parser.parse_args()
+
+    print(f"{'rows':>6} {'scope':>10} {'precomputed us':>15} {'on the fly us':>14} {'rankings ms':>12}")
+    files = {}
+    for rows in args.rows:
+        database.DB_FILE = files[rows] = os.path.join(tempfile.mkdtemp(), 'bench_top_offers.db')
+        database.init_db()
+        database.save_parsed_data(make_category(rows, args.suppliers))
+
+    for rows in args.rows:
+        database.DB_FILE = files[rows]
+        # Как в потоках db_gateway: постоянное read-only соединение
+        database.close_reader_connections()
+        database.open_reader_connection()
+        with sqlite3.connect(database.DB_FILE) as conn:
+            category_id = conn.execute("SELECT id FROM categories").fetchone()[0]
+            city_id = conn.execute("SELECT id FROM cities WHERE name = ?", (CITIES[1],)).fetchone()[0]
+            started = time.perf_counter()
+            database._refresh_rankings(conn.cursor(), [category_id])
+            rankings = (time.perf_counter() - started) * 1000
+
+            for scope, city, size in (('all', '', ''), ('city', CITIES[1], ''), ('size', '', '108'),
+                                      ('city+size', CITIES[1], '108')):
+                scope_city_id = city_id if city else 0
+                precomputed = timed(
+                    lambda: database.get_offer_comparison(category_id, scope_city_id, size, args.limit), args.repeat
+                )
+                fly = timed(lambda: on_the_fly(conn, category_id, city, size, args.limit), max(1, args.repeat // 10))
+                print(f"{rows:>6} {scope:>10} {precomputed:>15.0f} {fly:>14.0f} {rankings:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Нагрузочный тест приема обновлений по вебхуку (webhook.UpdateIngress).
+
+Бот с настоящими обработчиками и временной БД запускается в отдельном
+процессе; вызовы Bot API подменены заглушкой с задержкой --api-latency
+(время ответа Telegram). Генератор шлет синтетические обновления
+(/start, списки категорий, детали категории, поиск) от разных пользователей
+с постоянной частотой и измеряет:
+
+- обновлений/сек и задержку подтверждения (HTTP-ответа) вебхука;
+- время от приема до завершения обработчика (на стороне бота);
+- сколько обновлений обрабатывалось одновременно.
+
+    python benchmarks/bench_webhook.py --rate 500 --duration 5 --api-latency 0.05 [--max-in-flight 100]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+os.environ.setdefault('BOT_TOKEN', '123456:benchmark')
+os.environ.setdefault('MANAGER_CHANNEL_ID', '0')
+
+from bench_crawl import free_port  # noqa: E402
+from bench_handlers import percentile  # noqa: E402
+
+PATH = '/webhook'
+SEARCHES = ['труба 57', 'лист 09г2с', 'арматура а500с', 'швеллер']
+
+
+def serve(args):
+    """Процесс бота: обработчики проекта, заглушка Bot API, статистика на /_stats."""
+    import logging
+
+    from aiogram import Bot, Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from aiohttp import web
+
+    import database
+    from bench_save import make_catalog
+    from db_gateway import db
+    from handlers import router
+    from webhook import UpdateIngress, create_app
+
+    logging.basicConfig(level=logging.WARNING)
+
+    class StubBot(Bot):
+        """Бот, у которого каждый вызов API занимает api_latency и ничего не отправляет."""
+
+        async def __call__(self, method, request_timeout=None):
+            await asyncio.sleep(args.api_latency)
+            return True
+
+    class MeasuredIngress(UpdateIngress):
+        """Запоминает время обработки каждого обновления и пик одновременных."""
+
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.latencies = []
+            self.peak = 0
+
+        async def _process(self, update, received):
+            self.peak = max(self.peak, self.in_flight)
+            await super()._process(update, received)
+            self.latencies.append(time.perf_counter() - received)
+
+    async def main():
+        tmp = tempfile.mkdtemp()
+        database.DB_FILE = os.path.join(tmp, 'bench.db')
+        database.init_db()
+        database.save_parsed_data(make_catalog(args.categories, 50))
+
+        dispatcher = Dispatcher(storage=MemoryStorage())
+        dispatcher.include_router(router)
+        ingress = MeasuredIngress(dispatcher, StubBot(os.environ['BOT_TOKEN']), max_in_flight=args.max_in_flight)
+        app = create_app(ingress, PATH)
+
+        async def stats(request):
+            return web.json_response({
+                'processed': len(ingress.latencies),
+                'in_flight': ingress.in_flight,
+                'peak_in_flight': ingress.peak,
+                'latencies': ingress.latencies,
+            })
+
+        app.router.add_get('/_stats', stats)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', args.port).start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await db.close()
+
+    asyncio.run(main())
+
+
+def make_update(update_id: int, user_id: int, category_ids: list) -> dict:
+    """Синтетическое обновление: сообщение или нажатие кнопки."""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+    chat = {'id': user_id, 'type': 'private'}
+    message = {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user}
+    kind = random.random()
+    if kind < 0.15:
+        return {'update_id': update_id, 'message': {**message, 'text': '/start'}}
+    if kind < 0.3:
+        return {'update_id': update_id, 'message': {**message, 'text': random.choice(SEARCHES)}}
+    data = 'show_categories' if kind < 0.55 else f"category_{random.choice(category_ids)}"
+    bot_message = {**message, 'from': {'id': 123456, 'is_bot': True, 'first_name': 'bot'}, 'text': 'menu'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id), 'from': user, 'chat_instance': str(user_id),
+            'message': bot_message, 'data': data,
+        },
+    }
+
+
+async def generate(args, url: str) -> dict:
+    """Шлет обновления с постоянной частотой (открытая модель нагрузки)."""
+    import aiohttp
+
+    # ID категорий в синтетическом каталоге идут с 1
+    category_ids = list(range(1, args.categories + 1))
+    acks = []
+    errors = 0
+
+    async def post(session, update):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            async with session.post(url, json=update) as response:
+                if response.status != 200:
+                    errors += 1
+                    return
+        except aiohttp.ClientError:
+            errors += 1
+            return
+        acks.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = []
+        interval = 1 / args.rate
+        started = time.perf_counter()
+        sent = 0
+        while time.perf_counter() - started < args.duration:
+            due = int((time.perf_counter() - started) / interval)
+            for update_id in range(sent, due):
+                update = make_update(update_id + 1, random.randint(1, args.users), category_ids)
+                tasks.append(asyncio.create_task(post(session, update)))
+            sent = max(sent, due)
+            await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+        acked = time.perf_counter() - started
+
+        # Дожидаемся, пока бот обработает все принятые обновления
+        stats_url = url.replace(PATH, '/_stats')
+        while True:
+            async with session.get(stats_url) as response:
+                stats = await response.json()
+            if stats['processed'] >= len(acks) or time.perf_counter() - started > args.duration + 60:
+                break
+            await asyncio.sleep(0.05)
+        processed = time.perf_counter() - started
+
+    return {
+        'sent': len(tasks),
+        'errors': errors,
+        'ack_per_sec': len(acks) / acked,
+        'processed_per_sec': stats['processed'] / processed,
+        'ack_p50': percentile(acks, 0.5) * 1000 if acks else 0.0,
+        'ack_p99': percentile(acks, 0.99) * 1000 if acks else 0.0,
+        'handler_p50': percentile(stats['latencies'], 0.5) * 1000 if stats['latencies'] else 0.0,
+        'handler_p99': percentile(stats['latencies'], 0.99) * 1000 if stats['latencies'] else 0.0,
+        'peak_in_flight': stats['peak_in_flight'],
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rate', type=float, default=500, help='updates per second')
+    arg_parser.add_argument('--duration', type=float, default=5)
+    arg_parser.add_argument('--users', type=int, default=1000)
+    arg_parser.add_argument('--categories', type=int, default=200)
+    arg_parser.add_argument('--api-latency', type=float, default=0.05, help='simulated Bot API call time, seconds')
+    arg_parser.add_argument('--max-in-flight', type=int, default=100)
+    arg_parser.add_argument('--connections', type=int, default=100, help='concurrent HTTP connections (Telegram uses up to 100)')
+    arg_parser.add_argument('--json', help='write results to this file')
+    arg_parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    arg_parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    port = free_port()
+    command = [
+        sys.executable, __file__, '--serve', '--port', str(port),
+        '--categories', str(args.categories), '--api-latency', str(args.api_latency),
+        '--max-in-flight', str(args.max_in_flight),
+    ]
+    server = subprocess.Popen(command)
+    try:
+        url = f"http://127.0.0.1:{port}{PATH}"
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                urllib.request.urlopen(url.replace(PATH, '/_stats'), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Bot process did not start")
+                time.sleep(0.1)
+        result = asyncio.run(generate(args, url))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(
+        f"{result['sent']} updates sent, {result['errors']} errors; "
+        f"acked {result['ack_per_sec']:.0f}/s (p50 {result['ack_p50']:.1f} ms, p99 {result['ack_p99']:.1f} ms), "
+        f"processed {result['processed_per_sec']:.0f}/s "
+        f"(receipt to handler done: p50 {result['handler_p50']:.1f} ms, p99 {result['handler_p99']:.1f} ms), "
+        f"peak {result['peak_in_flight']} in flight"
+    )
+    if args.json:
+        Path(args.json).write_text(json.dumps({'args': vars(args), 'result': result}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
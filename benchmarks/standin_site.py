@@ -0,0 +1,259 @@
+"""
+Локальная замена сайта-источника для офлайн-бенчмарков парсера.
+
+Отдает индекс /price и N страниц категорий с разметкой, которую понимает
+page_parser: синтетические (размер таблицы задается) или записанные заранее
+с настоящего сайта (--fixtures, см. --record). Можно добавить задержку ответа и долю
+ошибок (503 и 429 с Retry-After), ограничить емкость сайта (--max-rps:
+сверх нее - 429), а также отдавать ETag для условных запросов.
+
+    python benchmarks/standin_site.py --port 8765 --categories 200 --rows 100 --latency 0.05
+    python benchmarks/standin_site.py --record fixtures/ --limit 20   # записать страницы с BASE_URL
+"""
+import argparse
+import asyncio
+import hashlib
+import html
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+CITIES = ['Москва', 'Санкт-Петербург', 'Екатеринбург', 'Челябинск', 'Новосибирск']
+# Список записанных категорий в каталоге фикстур
+MANIFEST = 'manifest.json'
+KINDS = [
+    ('Труба электросварная', 'ст3сп', 'Диаметр'),
+    ('Лист горячекатаный', '09Г2С', 'Толщина'),
+    ('Арматура', 'А500С', 'Диаметр'),
+    ('Швеллер', 'ст3пс', 'Номер'),
+    ('Уголок равнополочный', 'ст3сп', 'Полка'),
+]
+
+
+@dataclass
+class SiteSettings:
+    """Параметры стенда."""
+    categories: int = 50
+    rows: int = 100
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    retry_after: int = 1
+    max_rps: float = 0.0
+    etag: bool = True
+    fixtures: Optional[str] = None
+    seed: int = 0
+
+
+def _menu(settings: SiteSettings) -> str:
+    links = ''.join(
+        f'<li><a data-naimenovanie="{i}" href="/price/cat{i}">{KINDS[i % len(KINDS)][0]} {i}</a></li>'
+        for i in range(settings.categories)
+    )
+    return f'<nav id="left-container"><ul class="tabs">{links}</ul></nav>'
+
+
+def index_html(settings: SiteSettings) -> str:
+    """Главная страница каталога со ссылками на все категории."""
+    return f'<html><head><title>Цены на металлопрокат</title></head><body>{_menu(settings)}</body></html>'
+
+
+def category_html(settings: SiteSettings, index: int) -> str:
+    """Страница категории: фильтры и таблица цен из settings.rows строк."""
+    kind, spec, group = KINDS[index % len(KINDS)]
+    rng = random.Random(settings.seed * 100003 + index)
+    sizes = sorted({rng.choice([8, 10, 12, 57, 76, 89, 108, 159]) for _ in range(6)})
+    pane = ''.join(f'<a href="?size={size}">{size}</a>' for size in sizes)
+
+    rows = []
+    for row in range(settings.rows):
+        size = rng.choice(sizes)
+        wall = rng.choice(['3', '3,5', '4', '5'])
+        price = 45000 + rng.randrange(0, 40000, 10)
+        rows.append(
+            f'<tr><td>{kind} {size}x{wall}</td><td>{spec}</td><td>{size}x{wall}</td>'
+            f'<td>{price // 1000}&nbsp;{price % 1000:03d}</td><td>{rng.randint(500, 5000)}</td>'
+            f'<td>{CITIES[row % len(CITIES)]}</td>'
+            f'<td><a class="firm_link" href="/firm/{row}">Поставщик {row % 40}</a>'
+            f'<a class="tel_link">+7 900 {row:03d}-00-00</a></td>'
+            f'<td><span class="firm_dop_opener">+</span></td></tr>'
+        )
+        if row % 10 == 9:
+            rows.append('<tr class="tp-tr-hidden"><td colspan="8">Реклама</td></tr>')
+
+    return (
+        f'<html><head><title>{kind} {index}</title></head><body>{_menu(settings)}'
+        f'<h1 class="price-h1">{kind} {index}</h1>'
+        f'<nav id="center-container"><h2>{group}</h2><div class="pane">{pane}</div></nav>'
+        f'<table id="table-price"><thead><tr><th>Наименование</th></tr></thead>'
+        f'<tbody>{"".join(rows)}</tbody></table></body></html>'
+    )
+
+
+def _fixture_name(path: str) -> str:
+    """Имя файла записанной страницы по пути URL."""
+    slug = path.strip('/').replace('/', '__')
+    return f"{slug or 'index'}.html"
+
+
+def fixtures_index_html(directory: str) -> str:
+    """Индекс только из записанных категорий (по manifest.json, который пишет record)."""
+    categories = json.loads((Path(directory) / MANIFEST).read_text(encoding='utf-8'))
+    links = ''.join(
+        f'<li><a data-naimenovanie="{i}" href="{html.escape(category["url"])}">{html.escape(category["name"])}</a></li>'
+        for i, category in enumerate(categories)
+    )
+    return f'<html><body><nav id="left-container"><ul class="tabs">{links}</ul></nav></body></html>'
+
+
+def make_app(settings: SiteSettings) -> web.Application:
+    """Создает приложение aiohttp со страницами стенда."""
+    rng = random.Random(settings.seed)
+    counters = {'requests': 0, 'errors': 0, 'throttled': 0, 'not_modified': 0}
+    # Емкость сайта: запросы сверх max_rps в секунду получают 429
+    capacity = {'tokens': settings.max_rps, 'updated': time.monotonic()}
+
+    def over_capacity() -> bool:
+        if settings.max_rps <= 0:
+            return False
+        now = time.monotonic()
+        capacity['tokens'] = min(
+            settings.max_rps, capacity['tokens'] + (now - capacity['updated']) * settings.max_rps
+        )
+        capacity['updated'] = now
+        if capacity['tokens'] < 1:
+            return True
+        capacity['tokens'] -= 1
+        return False
+
+    def load(path: str) -> Optional[str]:
+        if settings.fixtures:
+            if path.rstrip('/') == '/price':
+                return fixtures_index_html(settings.fixtures)
+            file = Path(settings.fixtures) / _fixture_name(path)
+            return file.read_text(encoding='utf-8') if file.exists() else None
+        if path.rstrip('/') == '/price':
+            return index_html(settings)
+        name = path.rstrip('/').rsplit('/', 1)[-1]
+        if name.startswith('cat') and name[3:].isdigit() and int(name[3:]) < settings.categories:
+            return category_html(settings, int(name[3:]))
+        return None
+
+    async def handle(request: web.Request) -> web.Response:
+        counters['requests'] += 1
+        if settings.latency or settings.jitter:
+            await asyncio.sleep(max(0.0, settings.latency + rng.uniform(-settings.jitter, settings.jitter)))
+        if over_capacity():
+            counters['throttled'] += 1
+            return web.Response(status=429, headers={'Retry-After': str(settings.retry_after)})
+        if rng.random() < settings.error_rate:
+            counters['errors'] += 1
+            if rng.random() < 0.5:
+                return web.Response(status=429, headers={'Retry-After': str(settings.retry_after)})
+            return web.Response(status=503)
+
+        body = load(request.path)
+        if body is None:
+            raise web.HTTPNotFound()
+        if not settings.etag:
+            return web.Response(text=body, content_type='text/html')
+        tag = '"' + hashlib.md5(body.encode('utf-8')).hexdigest() + '"'
+        if request.headers.get('If-None-Match') == tag:
+            counters['not_modified'] += 1
+            return web.Response(status=304, headers={'ETag': tag})
+        return web.Response(text=body, content_type='text/html', headers={'ETag': tag})
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(counters)
+
+    app = web.Application()
+    app['counters'] = counters
+    app.router.add_get('/_stats', stats)
+    app.router.add_get('/price', handle)
+    app.router.add_get('/price/{tail:.*}', handle)
+    return app
+
+
+async def record(directory: str, limit: int):
+    """Записывает индекс и первые limit страниц категорий с BASE_URL в directory."""
+    import aiohttp
+    import page_parser
+    from config import config
+
+    target = Path(directory)
+    target.mkdir(parents=True, exist_ok=True)
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{config.BASE_URL}/price") as response:
+            index = await response.text()
+        recorded = []
+        for category in page_parser.parse_category_links(index)[:limit]:
+            url = category['url']
+            page_url = f"{config.BASE_URL}{url}" if url.startswith('/') else url
+            async with session.get(page_url) as response:
+                page = await response.text()
+            # Абсолютные ссылки делаем относительными, чтобы парсер ходил на стенд
+            path = url if url.startswith('/') else '/' + url.split('/', 3)[-1]
+            (target / _fixture_name(path)).write_text(page, encoding='utf-8')
+            recorded.append({'name': category['name'], 'url': path})
+            print(f"Recorded {url}")
+    (target / MANIFEST).write_text(json.dumps(recorded, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"{len(recorded)} categories recorded to {target}")
+
+
+def add_site_arguments(arg_parser: argparse.ArgumentParser):
+    """Параметры стенда в командной строке (общие со скриптами бенчмарков)."""
+    arg_parser.add_argument('--categories', type=int, default=50)
+    arg_parser.add_argument('--rows', type=int, default=100, help='price rows per category page')
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='response delay, seconds')
+    arg_parser.add_argument('--jitter', type=float, default=0.0, help='uniform +/- delay, seconds')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0, help='share of 503/429 responses')
+    arg_parser.add_argument('--retry-after', type=int, default=1, help='Retry-After for 429, seconds')
+    arg_parser.add_argument('--max-rps', type=float, default=0, help='site capacity, 429 above it (0 = unlimited)')
+    arg_parser.add_argument('--no-etag', action='store_true', help='do not send ETag')
+    arg_parser.add_argument('--fixtures', help='serve recorded pages from this directory')
+    arg_parser.add_argument('--seed', type=int, default=0)
+
+
+def settings_from_args(args: argparse.Namespace) -> SiteSettings:
+    return SiteSettings(
+        categories=args.categories,
+        rows=args.rows,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        max_rps=args.max_rps,
+        etag=not args.no_etag,
+        fixtures=args.fixtures,
+        seed=args.seed,
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8765)
+    arg_parser.add_argument('--record', metavar='DIR', help='record pages from BASE_URL into DIR and exit')
+    arg_parser.add_argument('--limit', type=int, default=20, help='categories to record')
+    add_site_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    if args.record:
+        asyncio.run(record(args.record, args.limit))
+        return
+    web.run_app(make_app(settings_from_args(args)), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('BOT_TOKEN', 'benchmark')
+    os.environ.setdefault('MANAGER_CHANNEL_ID', '0')
+    main()
@@ -1,16 +1,21 @@
 import asyncio
 import logging
 import sys
-import subprocess
-import signal
 from typing import Optional
 
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 
+import metrics
 from config import config
 from handlers import router
+from catalog_cache import catalog_cache
+from db_gateway import db
+from scheduler import RefreshScheduler
 from database import init_db
+from fsm_storage import SQLiteStorage
+from notifier import notifier
+from webhook import UpdateTaskTracker, drain_tasks, run_webhook
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,87 +28,98 @@ logger = logging.getLogger(__name__)
 # Глобальные переменные для graceful shutdown
 bot: Optional[Bot] = None
 dp: Optional[Dispatcher] = None
+scheduler: Optional[RefreshScheduler] = None
+metrics_runner = None
+# Задачи обработки обновлений: при long polling aiogram не ждет их при остановке
+update_tasks = UpdateTaskTracker()
 
-def run_parser():
-    """Запускает парсер как отдельный процесс."""
-    logger.info("Starting parser...")
-    try:
-        # Запускаем парсер с явным указанием кодировки
-        process = subprocess.run(
-            [sys.executable, 'parser.py'],
-            check=True,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            errors='ignore'
-        )
-        logger.info("Parser finished successfully.")
-        logger.info(f"Parser output:\n{process.stdout}")
-        if process.stderr:
-            logger.error(f"Parser errors:\n{process.stderr}")
-
-    except FileNotFoundError:
-        logger.error("parser.py not found. Make sure the parser script is in the root directory.")
-        sys.exit(1)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Parser script failed with exit code {e.returncode}.")
-        logger.error(f"Parser output:\n{e.stdout}")
-        logger.error(f"Parser errors:\n{e.stderr}")
-        sys.exit(1)
-    except Exception as e:
-        logger.error(f"An unexpected error occurred while running the parser: {e}")
-        sys.exit(1)
+async def on_startup():
+    """Запускает фоновое обновление цен: бот сразу начинает отвечать по текущим данным."""
+    global metrics_runner
+    if config.METRICS_PORT:
+        metrics_runner = await metrics.start_http_server(config.METRICS_HOST, config.METRICS_PORT)
+    # Отправка уведомлений менеджерам, включая не отправленные до перезапуска
+    await notifier.start(bot)
+    if scheduler:
+        scheduler.start()
 
 async def on_shutdown():
-    """Обработчик завершения работы бота."""
+    """Обработчик завершения работы бота: дожидается начатых обработчиков и освобождает ресурсы."""
     logger.info("Shutting down bot...")
+    # В режиме вебхука обработчики уже дождался run_webhook, и множество пусто
+    await drain_tasks(update_tasks.tasks, config.SHUTDOWN_DRAIN_TIMEOUT)
+    # Уведомления, поставленные дожданными обработчиками, уже в спуле
+    await notifier.stop()
+    if scheduler:
+        await scheduler.stop()
+    logger.info(f"Catalog cache stats: {catalog_cache.stats()}")
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    if config.METRICS_FILE:
+        metrics.registry.dump_json(config.METRICS_FILE)
     if bot:
         await bot.session.close()
     if dp:
         await dp.storage.close()
+    await db.close()
 
 async def main():
     """Главная функция для запуска бота."""
-    global bot, dp
+    global bot, dp, scheduler
     
-    # Инициализируем базу данных
-    init_db()
+    # Инициализируем базу данных. При фоновом обновлении - всегда в режиме WAL: иначе публикация
+    # поколения держит эксклюзивную блокировку, и чтения обработчиков ждут ее (до "database is locked")
+    init_db(wal=config.DB_WAL or config.REFRESH_ENABLED)
 
     # Создаем объекты бота и диспетчера
     bot = Bot(token=config.BOT_TOKEN, parse_mode="HTML")
-    storage = MemoryStorage()
+    if config.FSM_STORAGE == 'sqlite':
+        # Незаконченные расчеты заказов переживают перезапуск бота
+        storage = SQLiteStorage(config.FSM_STORAGE_FILE, ttl=config.FSM_TTL, flush_interval=config.FSM_FLUSH_INTERVAL)
+    else:
+        storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
 
     # Включаем роутер
     dp.include_router(router)
+    dp.update.outer_middleware(update_tasks)
 
-    # Регистрируем обработчик завершения
+    # Фоновое обновление цен внутри цикла событий бота
+    if config.REFRESH_ENABLED:
+        scheduler = RefreshScheduler(
+            interval=config.REFRESH_INTERVAL,
+            stale_after=config.REFRESH_STALE_AFTER,
+            batch_limit=config.REFRESH_BATCH_LIMIT or None,
+        )
+
+    # Регистрируем обработчики запуска и завершения
+    dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
-    logger.info("Starting bot...")
-    await bot.delete_webhook(drop_pending_updates=True)
-    
+    # SIGINT/SIGTERM в обоих режимах останавливают прием обновлений,
+    # после чего вызывается on_shutdown
     try:
-        await dp.start_polling(bot)
+        if config.WEBHOOK_URL:
+            logger.info("Starting bot in webhook mode...")
+            await run_webhook(
+                dp, bot,
+                url=config.WEBHOOK_URL,
+                path=config.WEBHOOK_PATH,
+                host=config.WEBHOOK_HOST,
+                port=config.WEBHOOK_PORT,
+                secret_token=config.WEBHOOK_SECRET,
+                max_in_flight=config.WEBHOOK_MAX_IN_FLIGHT,
+                drain_timeout=config.SHUTDOWN_DRAIN_TIMEOUT,
+            )
+        else:
+            logger.info("Starting bot in polling mode...")
+            # Вебхук снимается без сброса очереди: сообщения, пришедшие во время перезапуска, будут обработаны
+            await bot.delete_webhook(drop_pending_updates=False)
+            await dp.start_polling(bot)
     except Exception as e:
-        logger.error(f"Error while polling: {e}")
-        await on_shutdown()
+        logger.error(f"Bot stopped with an error: {e}")
         sys.exit(1)
 
-def handle_signal(signum, frame):
-    """Обработчик сигналов для graceful shutdown."""
-    logger.info(f"Received signal {signum}")
-    if bot and dp:
-        asyncio.create_task(on_shutdown())
-    sys.exit(0)
-
 if __name__ == '__main__':
-    # Регистрируем обработчики сигналов
-    signal.signal(signal.SIGINT, handle_signal)
-    signal.signal(signal.SIGTERM, handle_signal)
-    
-    # Сначала запускаем парсер для обновления данных
-    run_parser()
-    
-    # Затем запускаем бота
+    # Запускаем бота; цены обновляются в фоне планировщиком
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,172 @@
+import logging
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config import config
+from db_gateway import db
+from pricing import QuoteTable
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class CatalogCache:
+    """
+    Кэш каталога в памяти процесса бота: страницы категорий и цен, детали
+    категорий и готовые клавиатуры; страницы попадают в кэш по мере просмотра.
+    Все записи относятся к одному поколению данных; как только парсер
+    публикует новое поколение, кэш сбрасывается.
+    Номер поколения проверяется в БД не чаще раза в check_interval секунд.
+    Ошибки БД из db_gateway пробрасываются и в кэш не попадают.
+    """
+
+    def __init__(
+        self, check_interval: float = 5.0, categories_page_size: int = 20, prices_page_size: int = 10,
+        compare_offers: int = 5,
+    ):
+        self.check_interval = check_interval
+        self.categories_page_size = categories_page_size
+        self.prices_page_size = prices_page_size
+        self.compare_offers = compare_offers
+        self.generation: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._checked_at = 0.0
+        self._pages: Dict[Tuple, Dict[str, Any]] = {}
+        self._details: Dict[int, Any] = {}
+        self._history: Dict[Tuple[int, int], Any] = {}
+        self._quotes: Dict[int, QuoteTable] = {}
+        self._keyboards: Dict[Hashable, Any] = {}
+
+    async def _validate(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        generation = await db.get_current_generation()
+        if generation != self.generation:
+            self.invalidate(generation)
+
+    def invalidate(self, generation: Optional[int] = None):
+        """Сбрасывает кэш. Без номера поколения он будет перечитан из БД при следующем обращении."""
+        if self.generation is not None:
+            logger.info(f"Catalog cache invalidated (generation {self.generation} -> {generation})")
+        self.invalidations += 1
+        self.generation = generation
+        if generation is None:
+            self._checked_at = 0.0
+        self._pages.clear()
+        self._details.clear()
+        self._history.clear()
+        self._quotes.clear()
+        self._keyboards.clear()
+
+    def _count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    async def _get_page(self, key: Tuple, fetch: Callable, *args) -> Dict[str, Any]:
+        await self._validate()
+        page = self._pages.get(key)
+        self._count(page is not None)
+        if page is None:
+            generation = self.generation
+            page = await fetch(*args)
+            if self.generation == generation:
+                self._pages[key] = page
+        return page
+
+    async def get_categories_page(self, cursor_id: Optional[int] = None, backward: bool = False) -> Dict[str, Any]:
+        """Страница списка категорий (см. database.get_categories_page)."""
+        return await self._get_page(
+            ('categories', cursor_id, backward), db.get_categories_page,
+            cursor_id, backward, self.categories_page_size
+        )
+
+    async def get_prices_page(
+        self, category_id: int, cursor_id: Optional[int] = None, backward: bool = False
+    ) -> Dict[str, Any]:
+        """Страница предложений категории (см. database.get_prices_page)."""
+        return await self._get_page(
+            ('prices', category_id, cursor_id, backward), db.get_prices_page,
+            category_id, cursor_id, backward, self.prices_page_size
+        )
+
+    async def get_offer_comparison(self, category_id: int, city_id: int = 0, size: str = '') -> Dict[str, Any]:
+        """Лучшие предложения и поставщики категории (см. database.get_offer_comparison)."""
+        return await self._get_page(
+            ('compare', category_id, city_id, size), db.get_offer_comparison,
+            category_id, city_id, size, self.compare_offers
+        )
+
+    async def get_category_details(self, category_id: int) -> Optional[Dict]:
+        """Детали категории (или None, если категории нет)."""
+        await self._validate()
+        details = self._details.get(category_id, _MISSING)
+        self._count(details is not _MISSING)
+        if details is _MISSING:
+            generation = self.generation
+            details = await db.get_category_details(category_id)
+            if self.generation == generation:
+                self._details[category_id] = details
+        return details
+
+    async def get_price_history(self, category_id: int, days: int) -> Dict[str, Any]:
+        """Изменение цен категории и динамика по поставщикам за days дней."""
+        await self._validate()
+        key = (category_id, days)
+        history = self._history.get(key)
+        self._count(history is not None)
+        if history is None:
+            generation = self.generation
+            history = {
+                'change': await db.get_price_change(category_id, days),
+                'suppliers': await db.get_supplier_trends(category_id, days),
+            }
+            if self.generation == generation:
+                self._history[key] = history
+        return history
+
+    async def get_quote_table(self, category_id: int) -> QuoteTable:
+        """Предложения категории для расчета стоимости заказа (массивы строятся один раз на поколение)."""
+        await self._validate()
+        table = self._quotes.get(category_id)
+        self._count(table is not None)
+        if table is None:
+            generation = self.generation
+            table = QuoteTable(await db.get_quote_rows(category_id))
+            if self.generation == generation:
+                self._quotes[category_id] = table
+        return table
+
+    async def get_keyboard(self, key: Hashable, builder: Callable, *args):
+        """Готовая клавиатура по ключу; builder(*args) вызывается только при промахе."""
+        await self._validate()
+        keyboard = self._keyboards.get(key)
+        self._count(keyboard is not None)
+        if keyboard is None:
+            keyboard = self._keyboards[key] = builder(*args)
+        return keyboard
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов."""
+        total = self.hits + self.misses
+        return {
+            'generation': self.generation,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'invalidations': self.invalidations,
+        }
+
+
+catalog_cache = CatalogCache(
+    check_interval=config.CATALOG_CACHE_CHECK_INTERVAL,
+    categories_page_size=config.CATEGORIES_PAGE_SIZE,
+    prices_page_size=config.PRICES_PAGE_SIZE,
+    compare_offers=config.COMPARE_OFFERS,
+)
@@ -25,11 +25,114 @@ class Config:
         proxy for proxy in os.getenv('PROXIES', '').split(',') if proxy
     ])
 
+    # База данных: WAL-журнал и облегченные fsync (по умолчанию выключено)
+    DB_WAL: bool = os.getenv('DB_WAL', '0') == '1'
+    # Потоки с постоянными read-only соединениями для обработчиков бота
+    DB_READER_THREADS: int = int(os.getenv('DB_READER_THREADS', '2'))
+
+    # Как часто кэш каталога в боте проверяет, не опубликовано ли новое поколение (сек)
+    CATALOG_CACHE_CHECK_INTERVAL: float = float(os.getenv('CATALOG_CACHE_CHECK_INTERVAL', '5'))
+    # Размер страницы списка категорий и списка предложений категории
+    CATEGORIES_PAGE_SIZE: int = int(os.getenv('CATEGORIES_PAGE_SIZE', '20'))
+    PRICES_PAGE_SIZE: int = int(os.getenv('PRICES_PAGE_SIZE', '10'))
+    # Сколько лучших предложений и поставщиков показывать в сравнении (не больше database.TOP_OFFERS)
+    COMPARE_OFFERS: int = int(os.getenv('COMPARE_OFFERS', '5'))
+    # Сколько позиций показывать в результатах поиска
+    SEARCH_RESULTS: int = int(os.getenv('SEARCH_RESULTS', '8'))
+
+    # Фоновое обновление цен в процессе бота: период (сек), возраст, после которого
+    # категория считается устаревшей (сек), и сколько категорий обновлять за проход (0 - все)
+    REFRESH_ENABLED: bool = os.getenv('REFRESH_ENABLED', '1') == '1'
+    REFRESH_INTERVAL: float = float(os.getenv('REFRESH_INTERVAL', '3600'))
+    REFRESH_STALE_AFTER: float = float(os.getenv('REFRESH_STALE_AFTER', os.getenv('REFRESH_INTERVAL', '3600')))
+    REFRESH_BATCH_LIMIT: int = int(os.getenv('REFRESH_BATCH_LIMIT', '0'))
+
+    # Пул HTTP-соединений парсера (на каждый прокси свой коннектор)
+    PARSER_LIMIT: int = int(os.getenv('PARSER_LIMIT', '100'))
+    PARSER_LIMIT_PER_HOST: int = int(os.getenv('PARSER_LIMIT_PER_HOST', '10'))
+    PARSER_KEEPALIVE_TIMEOUT: float = float(os.getenv('PARSER_KEEPALIVE_TIMEOUT', '30'))
+    PARSER_DNS_CACHE_TTL: int = int(os.getenv('PARSER_DNS_CACHE_TTL', '300'))
+
+    # Здоровье прокси: сколько ошибок подряд до карантина и его длительность (сек)
+    PROXY_FAILURE_THRESHOLD: int = int(os.getenv('PROXY_FAILURE_THRESHOLD', '3'))
+    PROXY_QUARANTINE_BASE: float = float(os.getenv('PROXY_QUARANTINE_BASE', '30'))
+    PROXY_QUARANTINE_MAX: float = float(os.getenv('PROXY_QUARANTINE_MAX', '600'))
+
+    # Адаптивное ограничение запросов к сайту (AIMD): начальное окно одновременных
+    # запросов (максимум - число загрузчиков), начальная/минимальная/максимальная
+    # скорость (запросов/сек), лимит на каждый прокси (0 - без лимита), во сколько
+    # раз должна вырасти латентность, чтобы считать сайт перегруженным,
+    # и предельные паузы перед повтором и по Retry-After (сек)
+    RATE_LIMIT_INITIAL_WINDOW: float = float(os.getenv('RATE_LIMIT_INITIAL_WINDOW', '4'))
+    RATE_LIMIT_INITIAL_RPS: float = float(os.getenv('RATE_LIMIT_INITIAL_RPS', '10'))
+    RATE_LIMIT_MIN_RPS: float = float(os.getenv('RATE_LIMIT_MIN_RPS', '0.5'))
+    RATE_LIMIT_MAX_RPS: float = float(os.getenv('RATE_LIMIT_MAX_RPS', '100'))
+    PROXY_RATE_LIMIT: float = float(os.getenv('PROXY_RATE_LIMIT', '0'))
+    RATE_LIMIT_LATENCY_TOLERANCE: float = float(os.getenv('RATE_LIMIT_LATENCY_TOLERANCE', '3'))
+    RETRY_BACKOFF_MAX: float = float(os.getenv('RETRY_BACKOFF_MAX', '60'))
+    RETRY_AFTER_MAX: float = float(os.getenv('RETRY_AFTER_MAX', '300'))
+
+    # Кэш ответов для условных GET (ETag / Last-Modified)
+    HTTP_CACHE_ENABLED: bool = os.getenv('HTTP_CACHE_ENABLED', '1') == '1'
+    HTTP_CACHE_FILE: str = os.getenv('HTTP_CACHE_FILE', 'http_cache.db')
+    HTTP_CACHE_MAX_ENTRIES: int = int(os.getenv('HTTP_CACHE_MAX_ENTRIES', '5000'))
+
+    # Конвейер парсера: размер очередей, число разборщиков и размер пачки записи в БД
+    PIPELINE_QUEUE_SIZE: int = int(os.getenv('PIPELINE_QUEUE_SIZE', '20'))
+    PIPELINE_PARSE_WORKERS: int = int(os.getenv('PIPELINE_PARSE_WORKERS', '1'))
+    PIPELINE_WRITE_BATCH: int = int(os.getenv('PIPELINE_WRITE_BATCH', '10'))
+    # Аренда строящегося поколения (сек): обход продлевает ее каждую треть срока; поколение,
+    # которое не продлевалось дольше, считается брошенным и может быть дообойдено другим процессом
+    CRAWL_LEASE: float = float(os.getenv('CRAWL_LEASE', '300'))
+    # Число процессов для разбора HTML (0 - разбирать в цикле событий)
+    PARSER_PROCESS_WORKERS: int = int(os.getenv('PARSER_PROCESS_WORKERS', '0'))
+    # Движок разбора страниц категорий: 'bs4' или 'lxml' (быстрый, с откатом на bs4)
+    PARSER_ENGINE: str = os.getenv('PARSER_ENGINE', 'bs4')
+
+    # Хранилище состояний диалогов (FSM): 'sqlite' (переживает перезапуск, общее для
+    # нескольких процессов бота) или 'memory'; файл, через сколько секунд без изменений
+    # сессия истекает и как часто сбрасывать накопленные изменения (сек, 0 - сразу)
+    FSM_STORAGE: str = os.getenv('FSM_STORAGE', 'sqlite')
+    FSM_STORAGE_FILE: str = os.getenv('FSM_STORAGE_FILE', 'fsm.db')
+    FSM_TTL: float = float(os.getenv('FSM_TTL', '86400'))
+    FSM_FLUSH_INTERVAL: float = float(os.getenv('FSM_FLUSH_INTERVAL', '0.05'))
+
+    # Уведомления менеджерам: файл спула, не больше NOTIFY_RATE_PER_MINUTE сообщений в минуту
+    # на чат со всплеском до NOTIFY_BURST, до NOTIFY_DIGEST_MAX уведомлений в одном сообщении
+    # и сколько ждать попутных уведомлений перед отправкой (сек, 0 - не ждать)
+    NOTIFY_SPOOL_FILE: str = os.getenv('NOTIFY_SPOOL_FILE', 'notifications.db')
+    NOTIFY_RATE_PER_MINUTE: float = float(os.getenv('NOTIFY_RATE_PER_MINUTE', '20'))
+    NOTIFY_BURST: int = int(os.getenv('NOTIFY_BURST', '3'))
+    NOTIFY_DIGEST_MAX: int = int(os.getenv('NOTIFY_DIGEST_MAX', '10'))
+    NOTIFY_DIGEST_WINDOW: float = float(os.getenv('NOTIFY_DIGEST_WINDOW', '0'))
+
+    # Режим вебхука: публичный адрес сервера (пусто - long polling), путь, адрес и порт,
+    # на которых слушает бот, секрет заголовка X-Telegram-Bot-Api-Secret-Token
+    # и сколько обновлений обрабатывается одновременно
+    WEBHOOK_URL: str = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_PATH: str = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_HOST: str = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT: int = int(os.getenv('WEBHOOK_PORT', '8080'))
+    WEBHOOK_SECRET: str = os.getenv('WEBHOOK_SECRET', '')
+    WEBHOOK_MAX_IN_FLIGHT: int = int(os.getenv('WEBHOOK_MAX_IN_FLIGHT', '100'))
+    # Сколько ждать завершения начатых обработчиков при остановке (сек)
+    SHUTDOWN_DRAIN_TIMEOUT: float = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '30'))
+
+    # Метрики: HTTP-эндпоинт /metrics в процессе бота (0 - выключен)
+    # и JSON-файл со снимком метрик после обхода и при остановке (пусто - не писать)
+    METRICS_HOST: str = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT: int = int(os.getenv('METRICS_PORT', '0'))
+    METRICS_FILE: str = os.getenv('METRICS_FILE', '')
+
     def __post_init__(self):
         if not self.BOT_TOKEN:
             raise ValueError("BOT_TOKEN environment variable is not set")
         if not self.MANAGER_CHANNEL_ID:
             raise ValueError("MANAGER_CHANNEL_ID environment variable is not set")
+        if self.PARSER_ENGINE not in ('bs4', 'lxml'):
+            raise ValueError("PARSER_ENGINE must be 'bs4' or 'lxml'")
+        if self.FSM_STORAGE not in ('sqlite', 'memory'):
+            raise ValueError("FSM_STORAGE must be 'sqlite' or 'memory'")
 
 
 config = Config() 
@@ -1,12 +1,71 @@
 import sqlite3
+import hashlib
 import logging
+import os
+import socket
+import threading
+import time
 import ujson
+from contextlib import closing
+from statistics import median
+from typing import Optional
+
+import metrics
+import pricing
+from normalize import parse_price, search_query, search_text
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
 DB_FILE = 'metal_prices.db'
 
+# Включается через init_db(wal=True): WAL-журнал и облегченные fsync
+_wal_enabled = False
+
+# Потоки-читатели (см. db_gateway) держат постоянное read-only соединение
+_local = threading.local()
+_reader_connections = []
+_reader_lock = threading.Lock()
+
+def open_reader_connection():
+    """
+    Отмечает текущий поток как читателя: execute_query в нем будет
+    использовать одно постоянное read-only соединение вместо нового на каждый запрос.
+    """
+    _local.reader = True
+    _local.conn = None
+
+def _reader_connection() -> sqlite3.Connection:
+    if _local.conn is None:
+        # Соединение используется только своим потоком, но закрывается из close_reader_connections
+        _local.conn = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True, check_same_thread=False)
+        with _reader_lock:
+            _reader_connections.append(_local.conn)
+    return _local.conn
+
+def _drop_reader_connection():
+    conn, _local.conn = _local.conn, None
+    with _reader_lock:
+        if conn in _reader_connections:
+            _reader_connections.remove(conn)
+    conn.close()
+
+def close_reader_connections():
+    """Закрывает постоянные соединения всех потоков-читателей (после их остановки)."""
+    with _reader_lock:
+        connections = list(_reader_connections)
+        _reader_connections.clear()
+    for conn in connections:
+        conn.close()
+
+def get_connection() -> sqlite3.Connection:
+    """Открывает соединение с базой с учетом настроек журнала."""
+    conn = sqlite3.connect(DB_FILE)
+    if _wal_enabled:
+        # В режиме WAL synchronous=NORMAL сохраняет целостность, но не делает fsync на каждый коммит
+        conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
 def execute_query(query: str, params: tuple = (), fetch: str = None):
     """
     Выполняет SQL-запрос к базе данных.
@@ -15,9 +74,27 @@ def execute_query(query: str, params: tuple = (), fetch: str = None):
         query (str): SQL-запрос.
         params (tuple): Параметры для запроса.
         fetch (str): Тип выборки ('one', 'all').
+
+    В потоках-читателях ошибка БД пробрасывается: иначе временный сбой (например,
+    база занята публикацией) выглядел бы как пустой результат и попадал бы в кэш каталога.
     """
+    if getattr(_local, 'reader', False):
+        try:
+            cursor = _reader_connection().execute(query, params)
+            if fetch == 'one':
+                return cursor.fetchone()
+            if fetch == 'all':
+                return cursor.fetchall()
+            return None
+        except sqlite3.Error as e:
+            logger.error(f"Database error: {e}")
+            # Соединение могло стать негодным (например, файл БД пересоздан) - откроем заново
+            if _local.conn is not None:
+                _drop_reader_connection()
+            raise
+
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with closing(get_connection()) as conn:
             cursor = conn.cursor()
             cursor.execute(query, params)
             conn.commit()
@@ -30,16 +107,25 @@ def execute_query(query: str, params: tuple = (), fetch: str = None):
         logger.error(f"Database error: {e}")
         return None
 
-def init_db():
-    """Инициализирует базу данных и создает таблицы, если они не существуют."""
+def init_db(wal: bool = False):
+    """
+    Инициализирует базу данных и создает таблицы, если они не существуют.
+    wal=True переводит базу в режим WAL: читатели не блокируются писателем.
+    """
+    global _wal_enabled
     logger.info("Initializing database...")
+    if wal:
+        execute_query("PRAGMA journal_mode = WAL")
+        _wal_enabled = True
     
     # Таблица для категорий
     execute_query("""
         CREATE TABLE IF NOT EXISTS categories (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL UNIQUE,
-            url TEXT NOT NULL
+            url TEXT NOT NULL,
+            refreshed_at TEXT,
+            fingerprint TEXT
         )
     """)
 
@@ -56,6 +142,10 @@ def init_db():
             supplier TEXT,
             phone TEXT,
             city TEXT,
+            ton_price REAL,
+            item_price REAL,
+            key_hash TEXT,
+            row_hash TEXT,
             FOREIGN KEY (category_id) REFERENCES categories (id)
         )
     """)
@@ -70,76 +160,1034 @@ def init_db():
             FOREIGN KEY (category_id) REFERENCES categories (id)
         )
     """)
+
+    # Поколения данных: парсер пишет новое поколение в staging-таблицы,
+    # а затем одной транзакцией публикует его в основные таблицы
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS generations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'building',
+            started_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            published_at TEXT
+        )
+    """)
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS staging_categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            generation INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            url TEXT NOT NULL,
+            fingerprint TEXT,
+            unchanged INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (generation, name),
+            FOREIGN KEY (generation) REFERENCES generations (id)
+        )
+    """)
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS staging_prices (
+            category_id INTEGER NOT NULL,
+            position TEXT,
+            spec TEXT,
+            dimensions TEXT,
+            price_per_ton TEXT,
+            price_per_item TEXT,
+            supplier TEXT,
+            phone TEXT,
+            city TEXT,
+            ton_price REAL,
+            item_price REAL,
+            key_hash TEXT,
+            row_hash TEXT,
+            FOREIGN KEY (category_id) REFERENCES staging_categories (id)
+        )
+    """)
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS staging_filters (
+            category_id INTEGER NOT NULL,
+            filter_group TEXT,
+            sizes TEXT,
+            FOREIGN KEY (category_id) REFERENCES staging_categories (id)
+        )
+    """)
+    # Время последнего обновления категории (для инкрементального обновления)
+    # и отпечатки содержимого категорий и строк цен (для записи только изменений)
+    _ensure_columns('categories', {'refreshed_at': 'TEXT', 'fingerprint': 'TEXT'})
+    _ensure_columns('staging_categories', {'fingerprint': 'TEXT', 'unchanged': 'INTEGER NOT NULL DEFAULT 0'})
+    for table in ('prices', 'staging_prices'):
+        _ensure_columns(table, {'key_hash': 'TEXT', 'row_hash': 'TEXT'})
+
+    # Очередь обхода (frontier): состояние каждого URL категории в поколении.
+    # Переживает падение парсера: --resume дообходит только оставшиеся URL,
+    # а 'failed' без последующего успеха - список недоставленных (dead letters)
+    _ensure_columns('generations', {'keep_urls': 'TEXT'})
+    # Владелец строящегося поколения (host:pid) и время его последнего продления (unix-время):
+    # чужое поколение дообходится, только если его аренда истекла
+    _ensure_columns('generations', {'owner': 'TEXT', 'heartbeat_at': 'REAL'})
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS crawl_frontier (
+            generation INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            name TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (generation, url)
+        )
+    """)
+    execute_query("CREATE INDEX IF NOT EXISTS idx_crawl_frontier_url ON crawl_frontier (url, generation)")
+
+    # Статистика изменений по каждой публикации
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS run_stats (
+            generation INTEGER PRIMARY KEY,
+            categories_unchanged INTEGER NOT NULL,
+            categories_changed INTEGER NOT NULL,
+            categories_deleted INTEGER NOT NULL,
+            rows_inserted INTEGER NOT NULL,
+            rows_updated INTEGER NOT NULL,
+            rows_deleted INTEGER NOT NULL,
+            rows_unchanged INTEGER NOT NULL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Числовые цены, разобранные при загрузке (для баз, созданных до их появления)
+    for table in ('prices', 'staging_prices'):
+        _ensure_columns(table, {'ton_price': 'REAL', 'item_price': 'REAL'})
+
+    # Масса единицы позиции (кг на погонный метр или на м²) и основной размер
+    # (для отбора лучших предложений), считаются при загрузке (см. pricing)
+    profile_columns = {'unit_weight': 'REAL', 'unit': 'TEXT', 'size': "TEXT NOT NULL DEFAULT ''"}
+    _ensure_columns('staging_prices', profile_columns)
+    profiles_added = _ensure_columns('prices', profile_columns)
+
+    # Агрегаты цен за тонну по категориям, пересчитываются при публикации поколения
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS category_stats (
+            category_id INTEGER PRIMARY KEY,
+            offers INTEGER NOT NULL,
+            avg_price REAL,
+            min_price REAL,
+            max_price REAL,
+            median_price REAL,
+            FOREIGN KEY (category_id) REFERENCES categories (id)
+        )
+    """)
+
+    # Лучшие предложения, пересчитываются при публикации для изменившихся категорий:
+    # top_offers - TOP_OFFERS самых дешевых строк категории целиком (city_id = 0, size = ''),
+    # по каждому городу и по каждому размеру; supplier_ranking - поставщики по их лучшей цене
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS top_offers (
+            category_id INTEGER NOT NULL,
+            city_id INTEGER NOT NULL,
+            size TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            price_id INTEGER NOT NULL,
+            PRIMARY KEY (category_id, city_id, size, rank)
+        ) WITHOUT ROWID
+    """)
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS supplier_ranking (
+            category_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            supplier_id INTEGER NOT NULL,
+            best_price REAL NOT NULL,
+            offers INTEGER NOT NULL,
+            PRIMARY KEY (category_id, rank)
+        ) WITHOUT ROWID
+    """)
+    # Разброс лучших цен поставщиков категории
+    _ensure_columns('category_stats', {
+        'suppliers': 'INTEGER NOT NULL DEFAULT 0', 'supplier_median': 'REAL', 'supplier_max': 'REAL'
+    })
+
+    # История цен: при каждой публикации для изменившихся категорий дописывается
+    # снимок их строк. Позиции, поставщики и города хранятся в справочниках,
+    # цены - целыми копейками, время снимка - unix-время
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS positions (
+            id INTEGER PRIMARY KEY,
+            position TEXT NOT NULL,
+            spec TEXT NOT NULL,
+            dimensions TEXT NOT NULL,
+            UNIQUE (position, spec, dimensions)
+        )
+    """)
+    execute_query("CREATE TABLE IF NOT EXISTS suppliers (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+    execute_query("CREATE TABLE IF NOT EXISTS cities (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS price_history (
+            category_id INTEGER NOT NULL,
+            recorded_at INTEGER NOT NULL,
+            position_id INTEGER NOT NULL,
+            supplier_id INTEGER NOT NULL,
+            city_id INTEGER NOT NULL,
+            ton_kopecks INTEGER,
+            item_kopecks INTEGER
+        )
+    """)
+    # Покрывающий индекс: выборки по категории и периоду не обращаются к самой таблице
+    execute_query("""
+        CREATE INDEX IF NOT EXISTS idx_price_history_category_time
+        ON price_history (category_id, recorded_at, supplier_id, ton_kopecks)
+    """)
+
+    # Полнотекстовый индекс по позициям (rowid = prices.id): нормализованные
+    # название категории, позиция, марка и размеры. Обновляется при публикации
+    # только для изменившихся категорий
+    execute_query("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS price_search
+        USING fts5(body, tokenize = "unicode61 tokenchars '.'")
+    """)
+
+    execute_query("CREATE INDEX IF NOT EXISTS idx_prices_category ON prices (category_id)")
+    # Постраничный список цен категории: по цене за тонну (без цены - в конце)
+    execute_query(f"CREATE INDEX IF NOT EXISTS idx_prices_category_price ON prices (category_id, {PRICE_SORT_KEY}, id)")
+    execute_query("CREATE INDEX IF NOT EXISTS idx_filters_category ON filters (category_id)")
+    execute_query("CREATE INDEX IF NOT EXISTS idx_staging_prices_category ON staging_prices (category_id)")
+
+    # Базы, заполненные до появления числовых цен: разбираем текст и считаем агрегаты один раз
+    if execute_query("SELECT 1 FROM prices WHERE ton_price IS NULL AND price_per_ton != '' LIMIT 1", fetch='one') \
+            and not execute_query("SELECT 1 FROM category_stats LIMIT 1", fetch='one'):
+        _backfill_numeric_prices()
+    execute_query("CREATE INDEX IF NOT EXISTS idx_staging_filters_category ON staging_filters (category_id)")
+    # Лучшие предложения города и размера вместе (см. get_top_offers)
+    execute_query(
+        f"CREATE INDEX IF NOT EXISTS idx_prices_category_city_price ON prices (category_id, city, {PRICE_SORT_KEY}, id)"
+    )
+    # Масса и размеры пересчитываются, если их еще нет или с тех пор изменился разбор размеров
+    # (версия разбора хранится в user_version базы)
+    profiles_version = execute_query("PRAGMA user_version", fetch='one')[0]
+    if (profiles_added or profiles_version < pricing.PROFILES_VERSION) \
+            and execute_query("SELECT 1 FROM prices LIMIT 1", fetch='one'):
+        _backfill_profiles()
+    if profiles_version != pricing.PROFILES_VERSION:
+        execute_query(f"PRAGMA user_version = {pricing.PROFILES_VERSION}")
+    if execute_query("SELECT 1 FROM prices LIMIT 1", fetch='one') \
+            and not execute_query("SELECT 1 FROM price_search LIMIT 1", fetch='one'):
+        with closing(get_connection()) as conn, conn:
+            cursor = conn.cursor()
+            if _search_available(cursor):
+                logger.info("Building search index...")
+                _index_search(cursor, [row[0] for row in cursor.execute("SELECT id FROM categories").fetchall()])
+    # Базы, заполненные до появления истории: первый снимок - текущие цены
+    if execute_query("SELECT 1 FROM prices LIMIT 1", fetch='one') \
+            and not execute_query("SELECT 1 FROM price_history LIMIT 1", fetch='one'):
+        with closing(get_connection()) as conn, conn:
+            _record_history(conn.cursor(), [row[0] for row in conn.execute("SELECT id FROM categories")])
     logger.info("Database initialized.")
 
+def _ensure_columns(table: str, columns: dict) -> list:
+    """Добавляет в таблицу недостающие колонки. Возвращает имена добавленных."""
+    existing = {row[1] for row in execute_query(f"PRAGMA table_info({table})", fetch='all') or []}
+    added = []
+    for name, column_type in columns.items():
+        if name not in existing:
+            execute_query(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+            added.append(name)
+    return added
+
+def _backfill_numeric_prices():
+    logger.info("Backfilling numeric prices...")
+    with closing(get_connection()) as conn, conn:
+        cursor = conn.cursor()
+        rows = cursor.execute("SELECT id, price_per_ton, price_per_item FROM prices").fetchall()
+        cursor.executemany(
+            "UPDATE prices SET ton_price = ?, item_price = ? WHERE id = ?",
+            [(parse_price(per_ton), parse_price(per_item), price_id) for price_id, per_ton, per_item in rows]
+        )
+        _refresh_category_stats(cursor)
+
+def _backfill_profiles():
+    logger.info("Backfilling unit weights and sizes...")
+    with closing(get_connection()) as conn, conn:
+        cursor = conn.cursor()
+        for category_id, name in cursor.execute("SELECT id, name FROM categories").fetchall():
+            rows = [
+                {'id': price_id, 'position': position, 'spec': spec, 'dimensions': dimensions}
+                for price_id, position, spec, dimensions in cursor.execute(
+                    "SELECT id, position, spec, dimensions FROM prices WHERE category_id = ?", (category_id,)
+                ).fetchall()
+            ]
+            cursor.executemany(
+                "UPDATE prices SET unit_weight = ?, unit = ?, size = ? WHERE id = ?",
+                [(*profile, row['id']) for row, profile in zip(rows, pricing.category_profiles(rows, name))]
+            )
+        _refresh_category_stats(cursor)
+
+def _clear_tables(cursor: sqlite3.Cursor):
+    cursor.execute("DELETE FROM prices")
+    cursor.execute("DELETE FROM filters")
+    cursor.execute("DELETE FROM category_stats")
+    cursor.execute("DELETE FROM categories")
+
 def clear_db():
     """Очищает все таблицы в базе данных."""
     logger.info("Clearing database...")
-    execute_query("DELETE FROM prices")
-    execute_query("DELETE FROM filters")
-    execute_query("DELETE FROM categories")
+    with closing(get_connection()) as conn, conn:
+        _clear_tables(conn.cursor())
     logger.info("Database cleared.")
 
-def save_parsed_data(data: list):
+# --- Поколения данных ---
+
+def generation_owner() -> str:
+    """Владелец поколений, которые строит текущий процесс: host:pid."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def begin_generation(keep_urls: Optional[list] = None, lease: Optional[float] = None) -> Optional[int]:
     """
-    Сохраняет спарсенные данные в базу данных.
-    Данные должны быть в формате, который возвращает MetalParser.parse_all.
+    Начинает новое поколение данных от имени текущего процесса и возвращает его номер.
+    keep_urls (инкрементальное обновление) сохраняется, чтобы прерванное
+    поколение можно было дообойти и опубликовать с теми же параметрами.
+    Если задан lease (сек), поколение не начинается (None), пока другой процесс
+    строит поколение и продлевал его не раньше lease секунд назад.
     """
-    logger.info(f"Saving {len(data)} categories to database...")
-    clear_db()
-    
-    for category_data in data:
-        category_name = category_data.get('category_name')
-        category_url = category_data.get('url')
-
-        # Сохраняем категорию и получаем ее ID
-        execute_query(
-            "INSERT INTO categories (name, url) VALUES (?, ?)",
-            (category_name, category_url)
+    now = time.time()
+    with closing(get_connection()) as conn, conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            """
+            INSERT INTO generations (status, keep_urls, owner, heartbeat_at)
+            SELECT 'building', ?, ?, ?
+            WHERE ? IS NULL OR NOT EXISTS (
+                SELECT 1 FROM generations WHERE status = 'building' AND heartbeat_at > ?
+            )
+            """,
+            (None if keep_urls is None else ujson.dumps(keep_urls), generation_owner(), now,
+             lease, now - (lease or 0))
         )
-        category_id_result = execute_query(
-            "SELECT id FROM categories WHERE name = ?",
-            (category_name,),
-            fetch='one'
+        return cursor.lastrowid if cursor.rowcount else None
+
+def renew_generation(generation: int) -> bool:
+    """
+    Продлевает аренду строящегося поколения текущим процессом.
+    False - поколение уже не строится или его перехватил другой процесс.
+    """
+    with closing(get_connection()) as conn, conn:
+        return conn.execute(
+            "UPDATE generations SET heartbeat_at = ? WHERE id = ? AND status = 'building' AND owner = ?",
+            (time.time(), generation, generation_owner())
+        ).rowcount == 1
+
+def release_generation(generation: int):
+    """Снимает аренду поколения текущего процесса (обход остановлен): его можно дообойти сразу."""
+    with closing(get_connection()) as conn, conn:
+        conn.execute(
+            "UPDATE generations SET heartbeat_at = NULL WHERE id = ? AND status = 'building' AND owner = ?",
+            (generation, generation_owner())
         )
-        if not category_id_result:
-            continue
-        category_id = category_id_result[0]
 
-        # Сохраняем фильтры
-        for group, sizes in category_data.get('filters', {}).items():
-            execute_query(
-                "INSERT INTO filters (category_id, filter_group, sizes) VALUES (?, ?, ?)",
-                (category_id, group, ujson.dumps(sizes))
+def get_current_generation() -> int:
+    """Возвращает номер опубликованного поколения (0, если публикаций еще не было)."""
+    result = execute_query("SELECT MAX(id) FROM generations WHERE status = 'published'", fetch='one')
+    return result[0] if result and result[0] is not None else 0
+
+# Колонки строки цены в порядке хранения (кроме category_id и хэшей)
+PRICE_FIELDS = (
+    'position', 'spec', 'dimensions', 'price_per_ton', 'price_per_item',
+    'supplier', 'phone', 'city', 'ton_price', 'item_price', 'unit_weight', 'unit', 'size'
+)
+# Поля, по которым строка считается «той же» позицией поставщика
+PRICE_KEY_FIELDS = ('position', 'spec', 'dimensions', 'supplier', 'city')
+
+def _fingerprint(values) -> str:
+    """Короткий хэш нормализованного кортежа значений."""
+    data = '\x1f'.join('' if value is None else str(value) for value in values)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=8).hexdigest()
+
+def _price_row(price_info: dict) -> dict:
+    """Нормализует строку цены и добавляет числовые цены и отпечатки."""
+    row = {field: (price_info.get(field) or '') for field in PRICE_FIELDS[:8]}
+    row['ton_price'] = parse_price(row['price_per_ton'])
+    row['item_price'] = parse_price(row['price_per_item'])
+    row['key_hash'] = _fingerprint(row[field] for field in PRICE_KEY_FIELDS)
+    row['row_hash'] = _fingerprint(row[field] for field in PRICE_FIELDS[:8])
+    return row
+
+def _stage_prices(cursor: sqlite3.Cursor, staging_id: int, rows: list):
+    cursor.executemany(
+        f"""
+        INSERT INTO staging_prices (category_id, {', '.join(PRICE_FIELDS)}, key_hash, row_hash)
+        VALUES (?, {', '.join('?' * len(PRICE_FIELDS))}, ?, ?)
+        """,
+        [
+            (staging_id, *(row[field] for field in PRICE_FIELDS), row['key_hash'], row['row_hash'])
+            for row in rows
+        ]
+    )
+
+def _stage_category(cursor: sqlite3.Cursor, generation: int, category_data: dict):
+    """
+    Добавляет одну категорию в staging-таблицы поколения. Если отпечаток
+    категории совпадает с опубликованным, сохраняется только отметка
+    «не изменилась» - без строк цен и фильтров.
+    """
+    category_name = category_data.get('category_name')
+    filters = category_data.get('filters', {})
+    rows = [_price_row(price_info) for price_info in category_data.get('prices', [])]
+    # Масса и основной размер считаются сразу для всех строк категории
+    for row, profile in zip(rows, pricing.category_profiles(rows, category_name)):
+        row['unit_weight'], row['unit'], row['size'] = profile
+    fingerprint = _fingerprint([
+        ujson.dumps(filters, sort_keys=True),
+        *sorted(row['row_hash'] for row in rows)
+    ])
+
+    staged = cursor.execute(
+        "SELECT id, unchanged FROM staging_categories WHERE generation = ? AND name = ?",
+        (generation, category_name)
+    ).fetchone()
+    if staged:
+        # Категория с таким именем уже есть в поколении - дописываем данные к ней
+        staging_id, unchanged = staged
+        if unchanged:
+            # Ранее сохранена только отметка - переносим опубликованные данные, чтобы дописать к ним
+            cursor.execute(
+                f"""
+                INSERT INTO staging_prices (category_id, {', '.join(PRICE_FIELDS)}, key_hash, row_hash)
+                SELECT ?, {', '.join(PRICE_FIELDS)}, key_hash, row_hash FROM prices
+                WHERE category_id = (SELECT id FROM categories WHERE name = ?)
+                """,
+                (staging_id, category_name)
             )
+            cursor.execute(
+                """
+                INSERT INTO staging_filters (category_id, filter_group, sizes)
+                SELECT ?, filter_group, sizes FROM filters
+                WHERE category_id = (SELECT id FROM categories WHERE name = ?)
+                """,
+                (staging_id, category_name)
+            )
+        cursor.execute(
+            "UPDATE staging_categories SET fingerprint = NULL, unchanged = 0 WHERE id = ?",
+            (staging_id,)
+        )
+    else:
+        published = cursor.execute(
+            "SELECT fingerprint FROM categories WHERE name = ?", (category_name,)
+        ).fetchone()
+        unchanged = bool(published and published[0] == fingerprint)
+        staging_id = cursor.execute(
+            """
+            INSERT INTO staging_categories (generation, name, url, fingerprint, unchanged)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (generation, category_name, category_data.get('url'), fingerprint, int(unchanged))
+        ).lastrowid
+        if unchanged:
+            return
+
+    cursor.executemany(
+        "INSERT INTO staging_filters (category_id, filter_group, sizes) VALUES (?, ?, ?)",
+        [(staging_id, group, ujson.dumps(sizes)) for group, sizes in filters.items()]
+    )
+    _stage_prices(cursor, staging_id, rows)
+
+@metrics.span('save_categories')
+def save_categories(batch: list, generation: int):
+    """
+    Сохраняет пачку категорий в staging-таблицы поколения одной транзакцией.
+    Читатели их не видят до publish_generation.
+    """
+    with closing(get_connection()) as conn, conn:
+        cursor = conn.cursor()
+        for category_data in batch:
+            _stage_category(cursor, generation, category_data)
+        # В той же транзакции: после падения 'done' гарантирует, что данные категории уже в staging
+        cursor.executemany(
+            """
+            UPDATE crawl_frontier SET state = 'done', last_error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE generation = ? AND url = ?
+            """,
+            [(generation, category_data.get('url')) for category_data in batch]
+        )
+
+def _drop_staging(cursor: sqlite3.Cursor, generations: list):
+    """Удаляет staging-данные указанных поколений."""
+    for generation in generations:
+        staged = "SELECT id FROM staging_categories WHERE generation = ?"
+        cursor.execute(f"DELETE FROM staging_prices WHERE category_id IN ({staged})", (generation,))
+        cursor.execute(f"DELETE FROM staging_filters WHERE category_id IN ({staged})", (generation,))
+        cursor.execute("DELETE FROM staging_categories WHERE generation = ?", (generation,))
+
+@metrics.span('publish_generation')
+def publish_generation(generation: int, keep: int = 5, keep_urls: Optional[list] = None) -> dict:
+    """
+    Атомарно переключает читателей на поколение: изменения в основных
+    таблицах вносятся одной транзакцией, поэтому читатели видят либо старый,
+    либо новый каталог целиком. ID категорий сохраняются (связь по имени).
+
+    Записывается только разница: категории с неизменным отпечатком
+    не трогаются, в остальных строки цен вставляются, обновляются
+    и удаляются по ключу позиции. Статистика изменений сохраняется в run_stats.
+
+    По умолчанию поколение описывает каталог полностью, и категории вне его
+    удаляются. Если передан keep_urls (инкрементальное обновление), остаются
+    также категории, чей URL есть в keep_urls.
+    Затем удаляются старые поколения, кроме последних keep.
+    """
+    logger.info(f"Publishing generation {generation}...")
+    stats = dict.fromkeys((
+        'categories_unchanged', 'categories_changed', 'categories_deleted',
+        'rows_inserted', 'rows_updated', 'rows_deleted', 'rows_unchanged'
+    ), 0)
+    with closing(get_connection()) as conn, conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
 
-        # Сохраняем цены
-        for price_info in category_data.get('prices', []):
-            execute_query(
+        # Публикуется только строящееся поколение этого процесса: опубликованное,
+        # отмененное или перехваченное другим процессом (после истечения аренды) - нет
+        status, owner = cursor.execute(
+            "SELECT status, owner FROM generations WHERE id = ?", (generation,)
+        ).fetchone() or (None, None)
+        if status != 'building' or owner not in (None, generation_owner()):
+            raise ValueError(f"Generation {generation} is not being built by this process ({status}, {owner})")
+
+        # Категории, которых больше нет на сайте
+        staged_names = "SELECT name FROM staging_categories WHERE generation = ?"
+        if keep_urls is None:
+            removed = cursor.execute(
+                f"SELECT id FROM categories WHERE name NOT IN ({staged_names})", (generation,)
+            ).fetchall()
+        else:
+            removed = cursor.execute(
+                f"""
+                SELECT id FROM categories WHERE name NOT IN ({staged_names})
+                AND url NOT IN (SELECT value FROM json_each(?))
+                """,
+                (generation, ujson.dumps(keep_urls))
+            ).fetchall()
+        search = _search_available(cursor)
+        if search:
+            _unindex_search(cursor, [category_id for (category_id,) in removed])
+        cursor.executemany("DELETE FROM prices WHERE category_id = ?", removed)
+        stats['rows_deleted'] = max(cursor.rowcount, 0)
+        for table in ('filters', 'category_stats', 'top_offers', 'supplier_ranking', 'categories'):
+            column = 'id' if table == 'categories' else 'category_id'
+            cursor.executemany(f"DELETE FROM {table} WHERE {column} = ?", removed)
+        stats['categories_deleted'] = len(removed)
+
+        changed_ids = []
+        for staging_id, name, url, fingerprint, unchanged in cursor.execute(
+            "SELECT id, name, url, fingerprint, unchanged FROM staging_categories WHERE generation = ?",
+            (generation,)
+        ).fetchall():
+            cursor.execute(
                 """
-                INSERT INTO prices (
-                    category_id, position, spec, dimensions, price_per_ton,
-                    price_per_item, supplier, phone, city
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO categories (name, url, refreshed_at, fingerprint)
+                VALUES (?, ?, CURRENT_TIMESTAMP, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    url = excluded.url,
+                    refreshed_at = excluded.refreshed_at,
+                    fingerprint = excluded.fingerprint
                 """,
-                (
-                    category_id,
-                    price_info.get('position'),
-                    price_info.get('spec'),
-                    price_info.get('dimensions'),
-                    price_info.get('price_per_ton'),
-                    price_info.get('price_per_item'),
-                    price_info.get('supplier'),
-                    price_info.get('phone'),
-                    price_info.get('city')
-                )
+                (name, url, fingerprint)
             )
+            category_id = cursor.execute("SELECT id FROM categories WHERE name = ?", (name,)).fetchone()[0]
+            if unchanged:
+                stats['categories_unchanged'] += 1
+                continue
+            stats['categories_changed'] += 1
+            changed_ids.append(category_id)
+            if search:
+                _unindex_search(cursor, [category_id])
+            _apply_price_diff(cursor, category_id, staging_id, stats)
+            cursor.execute("DELETE FROM filters WHERE category_id = ?", (category_id,))
+            cursor.execute(
+                """
+                INSERT INTO filters (category_id, filter_group, sizes)
+                SELECT ?, filter_group, sizes FROM staging_filters WHERE category_id = ?
+                """,
+                (category_id, staging_id)
+            )
+
+        _refresh_category_stats(cursor, changed_ids)
+        _record_history(cursor, changed_ids)
+        if search:
+            _index_search(cursor, changed_ids)
+        cursor.execute(
+            "UPDATE generations SET status = 'published', published_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (generation,)
+        )
+        cursor.execute(
+            f"INSERT OR REPLACE INTO run_stats (generation, {', '.join(stats)}) VALUES (?, {', '.join('?' * len(stats))})",
+            (generation, *stats.values())
+        )
+        _drop_staging(cursor, [generation])
+    logger.info(f"Generation {generation} published: {stats}")
+    prune_generations(keep)
+    return stats
+
+def _apply_price_diff(cursor: sqlite3.Cursor, category_id: int, staging_id: int, stats: dict):
+    """Приводит цены опубликованной категории к staging-версии, записывая только разницу."""
+    live = {}
+    for price_id, key_hash, row_hash in cursor.execute(
+        "SELECT id, key_hash, row_hash FROM prices WHERE category_id = ?", (category_id,)
+    ).fetchall():
+        live.setdefault(key_hash, []).append((price_id, row_hash))
+
+    inserts, updates = [], []
+    for row in cursor.execute(
+        f"SELECT {', '.join(PRICE_FIELDS)}, key_hash, row_hash FROM staging_prices WHERE category_id = ?",
+        (staging_id,)
+    ).fetchall():
+        key_hash, row_hash = row[-2], row[-1]
+        matches = live.get(key_hash)
+        if not matches:
+            inserts.append((category_id, *row))
+            continue
+        # Предпочитаем совпадающую целиком строку, иначе обновляем любую с тем же ключом
+        index = next((i for i, (_, live_hash) in enumerate(matches) if live_hash == row_hash), 0)
+        price_id, live_hash = matches.pop(index)
+        if live_hash == row_hash:
+            stats['rows_unchanged'] += 1
+        else:
+            updates.append((*row, price_id))
+
+    deletes = [(price_id,) for matches in live.values() for price_id, _ in matches]
+    cursor.executemany("DELETE FROM prices WHERE id = ?", deletes)
+    cursor.executemany(
+        f"""
+        UPDATE prices SET {', '.join(f'{field} = ?' for field in PRICE_FIELDS)}, key_hash = ?, row_hash = ?
+        WHERE id = ?
+        """,
+        updates
+    )
+    cursor.executemany(
+        f"""
+        INSERT INTO prices (category_id, {', '.join(PRICE_FIELDS)}, key_hash, row_hash)
+        VALUES (?, {', '.join('?' * len(PRICE_FIELDS))}, ?, ?)
+        """,
+        inserts
+    )
+    stats['rows_inserted'] += len(inserts)
+    stats['rows_updated'] += len(updates)
+    stats['rows_deleted'] += len(deletes)
+
+def _refresh_category_stats(cursor: sqlite3.Cursor, category_ids: Optional[list] = None):
+    """
+    Пересчитывает агрегаты цен за тонну (среднее, минимум, максимум, медиана),
+    разброс лучших цен поставщиков и списки лучших предложений
+    для указанных категорий (по умолчанию - для всех).
+    """
+    if category_ids is None:
+        category_ids = [row[0] for row in cursor.execute("SELECT id FROM categories").fetchall()]
+
+    rows = []
+    for category_id in category_ids:
+        prices = cursor.execute(
+            """
+            SELECT ton_price, IFNULL(supplier, '') FROM prices
+            WHERE category_id = ? AND ton_price IS NOT NULL ORDER BY ton_price
+            """,
+            (category_id,)
+        ).fetchall()
+        if prices:
+            values = [price for price, _ in prices]
+            # Строки идут по возрастанию цены: первая строка поставщика - его лучшая цена
+            best = {}
+            for price, supplier in prices:
+                best.setdefault(supplier, price)
+            bests = list(best.values())
+            rows.append((
+                category_id, len(values), sum(values) / len(values), values[0], values[-1], median(values),
+                len(bests), median(bests), bests[-1]
+            ))
+
+    cursor.executemany("DELETE FROM category_stats WHERE category_id = ?", [(i,) for i in category_ids])
+    cursor.executemany(
+        """
+        INSERT INTO category_stats (
+            category_id, offers, avg_price, min_price, max_price, median_price,
+            suppliers, supplier_median, supplier_max
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows
+    )
+    _refresh_rankings(cursor, category_ids)
+
+# Сколько лучших предложений и поставщиков хранится для категории, города и размера
+TOP_OFFERS = 10
+
+def _refresh_rankings(cursor: sqlite3.Cursor, category_ids: list):
+    """
+    Пересчитывает лучшие предложения категорий (по всей категории, по каждому
+    городу и по каждому размеру) и рейтинг поставщиков по их лучшей цене.
+    """
+    if not category_ids:
+        return
+    ids = ujson.dumps(category_ids)
+    selected = "category_id IN (SELECT value FROM json_each(?))"
+    for table in ('top_offers', 'supplier_ranking'):
+        cursor.execute(f"DELETE FROM {table} WHERE {selected}", (ids,))
+    for table, column in (('suppliers', 'supplier'), ('cities', 'city')):
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {table} (name) SELECT DISTINCT IFNULL({column}, '') FROM prices WHERE {selected}",
+            (ids,)
+        )
+    cursor.execute(
+        f"""
+        INSERT INTO top_offers (category_id, city_id, size, rank, price_id)
+        SELECT category_id, city_id, size, rank, id FROM (
+            SELECT p.category_id, 0 AS city_id, '' AS size, p.id,
+                   ROW_NUMBER() OVER (PARTITION BY p.category_id ORDER BY p.ton_price, p.id) AS rank
+            FROM prices p WHERE p.{selected} AND p.ton_price IS NOT NULL
+            UNION ALL
+            SELECT p.category_id, c.id, '', p.id,
+                   ROW_NUMBER() OVER (PARTITION BY p.category_id, c.id ORDER BY p.ton_price, p.id)
+            FROM prices p JOIN cities c ON c.name = p.city
+            WHERE p.{selected} AND p.ton_price IS NOT NULL AND p.city != ''
+            UNION ALL
+            SELECT p.category_id, 0, p.size, p.id,
+                   ROW_NUMBER() OVER (PARTITION BY p.category_id, p.size ORDER BY p.ton_price, p.id)
+            FROM prices p WHERE p.{selected} AND p.ton_price IS NOT NULL AND p.size != ''
+        )
+        WHERE rank <= ?
+        """,
+        (ids, ids, ids, TOP_OFFERS)
+    )
+    cursor.execute(
+        f"""
+        INSERT INTO supplier_ranking (category_id, rank, supplier_id, best_price, offers)
+        SELECT category_id, rank, supplier_id, best_price, offers FROM (
+            SELECT p.category_id, s.id AS supplier_id, MIN(p.ton_price) AS best_price, COUNT(*) AS offers,
+                   ROW_NUMBER() OVER (PARTITION BY p.category_id ORDER BY MIN(p.ton_price), s.id) AS rank
+            FROM prices p JOIN suppliers s ON s.name = IFNULL(p.supplier, '')
+            WHERE p.{selected} AND p.ton_price IS NOT NULL
+            GROUP BY p.category_id, s.id
+        )
+        WHERE rank <= ?
+        """,
+        (ids, TOP_OFFERS)
+    )
+
+def _search_available(cursor: sqlite3.Cursor) -> bool:
+    """Есть ли поисковый индекс (SQLite может быть собран без FTS5)."""
+    return cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'price_search'"
+    ).fetchone() is not None
+
+def _unindex_search(cursor: sqlite3.Cursor, category_ids: list):
+    """Удаляет из поискового индекса текущие строки цен категорий."""
+    cursor.executemany(
+        "DELETE FROM price_search WHERE rowid IN (SELECT id FROM prices WHERE category_id = ?)",
+        [(category_id,) for category_id in category_ids]
+    )
+
+def _index_search(cursor: sqlite3.Cursor, category_ids: list):
+    """Добавляет в поисковый индекс текущие строки цен категорий."""
+    for category_id in category_ids:
+        rows = cursor.execute(
+            """
+            SELECT p.id, c.name, p.position, p.spec, p.dimensions
+            FROM prices p JOIN categories c ON c.id = p.category_id
+            WHERE p.category_id = ?
+            """,
+            (category_id,)
+        ).fetchall()
+        cursor.executemany(
+            "INSERT INTO price_search (rowid, body) VALUES (?, ?)",
+            [(price_id, search_text(*parts)) for price_id, *parts in rows]
+        )
+
+def _record_history(cursor: sqlite3.Cursor, category_ids: list):
+    """
+    Дописывает в историю снимок текущих цен указанных категорий.
+    Неизменившиеся категории не пишутся: их последний снимок остается в силе.
+    """
+    if not category_ids:
+        return
+    recorded_at = int(time.time())
+    ids = ujson.dumps(category_ids)
+    selected = "category_id IN (SELECT value FROM json_each(?))"
+    for table, columns in (
+        ('positions', "IFNULL(position, ''), IFNULL(spec, ''), IFNULL(dimensions, '')"),
+        ('suppliers', "IFNULL(supplier, '')"),
+        ('cities', "IFNULL(city, '')"),
+    ):
+        names = 'position, spec, dimensions' if table == 'positions' else 'name'
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {table} ({names}) SELECT DISTINCT {columns} FROM prices WHERE {selected}",
+            (ids,)
+        )
+    # Повторная публикация в ту же секунду заменяет снимок, а не смешивается с ним
+    cursor.execute(f"DELETE FROM price_history WHERE recorded_at = ? AND {selected}", (recorded_at, ids))
+    cursor.execute(
+        f"""
+        INSERT INTO price_history
+            (category_id, recorded_at, position_id, supplier_id, city_id, ton_kopecks, item_kopecks)
+        SELECT p.category_id, ?, pos.id, s.id, c.id,
+               CAST(ROUND(p.ton_price * 100) AS INTEGER), CAST(ROUND(p.item_price * 100) AS INTEGER)
+        FROM prices p
+        JOIN positions pos ON pos.position = IFNULL(p.position, '') AND pos.spec = IFNULL(p.spec, '')
+            AND pos.dimensions = IFNULL(p.dimensions, '')
+        JOIN suppliers s ON s.name = IFNULL(p.supplier, '')
+        JOIN cities c ON c.name = IFNULL(p.city, '')
+        WHERE p.{selected}
+        """,
+        (recorded_at, ids)
+    )
+
+def abort_generation(generation: int):
+    """Отменяет поколение, которое не будет опубликовано."""
+    with closing(get_connection()) as conn, conn:
+        cursor = conn.cursor()
+        _drop_staging(cursor, [generation])
+        cursor.execute("UPDATE generations SET status = 'aborted' WHERE id = ?", (generation,))
+
+def prune_generations(keep: int = 5):
+    """
+    Удаляет записи старых поколений, оставляя последние keep опубликованных,
+    и staging-данные брошенных поколений старше текущего.
+    """
+    with closing(get_connection()) as conn, conn:
+        cursor = conn.cursor()
+        current = cursor.execute(
+            "SELECT MAX(id) FROM generations WHERE status = 'published'"
+        ).fetchone()[0] or 0
+        abandoned = [
+            row[0] for row in cursor.execute(
+                "SELECT id FROM generations WHERE status != 'published' AND id < ?", (current,)
+            )
+        ]
+        _drop_staging(cursor, abandoned)
+        cursor.execute(
+            """
+            DELETE FROM generations WHERE id < ? AND id NOT IN (
+                SELECT id FROM generations WHERE status = 'published' ORDER BY id DESC LIMIT ?
+            )
+            """,
+            (current, keep)
+        )
+        cursor.execute("DELETE FROM crawl_frontier WHERE generation NOT IN (SELECT id FROM generations)")
+
+def add_to_frontier(generation: int, categories: list):
+    """
+    Заносит категории поколения в очередь обхода в состоянии 'pending'.
+    Поле attempts категории (при повторе недоставленных) продолжает счет попыток.
+    """
+    with closing(get_connection()) as conn, conn:
+        conn.executemany(
+            """
+            INSERT INTO crawl_frontier (generation, url, name, attempts) VALUES (?, ?, ?, ?)
+            ON CONFLICT (generation, url) DO NOTHING
+            """,
+            [(generation, c['url'], c['name'], c.get('attempts', 0)) for c in categories]
+        )
+
+def mark_in_flight(generation: int, url: str):
+    """Отмечает, что URL взят в работу (попытка засчитывается)."""
+    with closing(get_connection()) as conn, conn:
+        conn.execute(
+            """
+            UPDATE crawl_frontier SET state = 'in_flight', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE generation = ? AND url = ?
+            """,
+            (generation, url)
+        )
+
+def mark_failed(generation: int, urls: list, error: str):
+    """Переводит URL в 'failed' с текстом последней ошибки."""
+    with closing(get_connection()) as conn, conn:
+        conn.executemany(
+            """
+            UPDATE crawl_frontier SET state = 'failed', last_error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE generation = ? AND url = ?
+            """,
+            [(error, generation, url) for url in urls]
+        )
+
+def get_unfinished_generation(lease: float) -> Optional[dict]:
+    """
+    Возвращает прерванное поколение, которое можно дообойти: самое новое
+    неопубликованное, начатое после текущего опубликованного и с очередью обхода,
+    и переводит его на текущий процесс. Поколение, которое другой процесс
+    продлевал не раньше lease секунд назад, еще строится и не возвращается.
+    URL, которые были в работе в момент падения, возвращаются в 'pending'.
+    Результат: {'generation', 'keep_urls', 'categories': [оставшиеся {'name', 'url'}], 'states': {состояние: число}}
+    или None.
+    """
+    now = time.time()
+    with closing(get_connection()) as conn, conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        row = cursor.execute(
+            """
+            SELECT id, keep_urls, owner, heartbeat_at FROM generations
+            WHERE status = 'building'
+              AND id > (SELECT IFNULL(MAX(id), 0) FROM generations WHERE status = 'published')
+              AND EXISTS (SELECT 1 FROM crawl_frontier WHERE generation = generations.id)
+            ORDER BY id DESC LIMIT 1
+            """
+        ).fetchone()
+        if row is None:
+            return None
+        generation, keep_urls, owner, heartbeat_at = row
+        if owner != generation_owner() and heartbeat_at is not None and heartbeat_at > now - lease:
+            logger.info(f"Generation {generation} is still being built by {owner}, not resuming it.")
+            return None
+        cursor.execute(
+            "UPDATE generations SET owner = ?, heartbeat_at = ? WHERE id = ?",
+            (generation_owner(), now, generation)
+        )
+        cursor.execute(
+            "UPDATE crawl_frontier SET state = 'pending' WHERE generation = ? AND state = 'in_flight'",
+            (generation,)
+        )
+        categories = [
+            {'name': name, 'url': url} for name, url in cursor.execute(
+                "SELECT name, url FROM crawl_frontier WHERE generation = ? AND state = 'pending' ORDER BY rowid",
+                (generation,)
+            )
+        ]
+        states = dict(cursor.execute(
+            "SELECT state, COUNT(*) FROM crawl_frontier WHERE generation = ? GROUP BY state", (generation,)
+        ).fetchall())
+    return {
+        'generation': generation,
+        'keep_urls': None if keep_urls is None else ujson.loads(keep_urls),
+        'categories': categories,
+        'states': states,
+    }
+
+def get_frontier_states(generation: int) -> dict:
+    """Число URL поколения в каждом состоянии."""
+    rows = execute_query(
+        "SELECT state, COUNT(*) FROM crawl_frontier WHERE generation = ? GROUP BY state", (generation,), fetch='all'
+    )
+    return dict(rows or [])
+
+def get_dead_letters() -> list:
+    """
+    Недоставленные URL: последняя попытка в каком-либо поколении закончилась
+    ошибкой, и ни одно более позднее поколение не обошло их успешно.
+    Возвращает [{'name', 'url', 'attempts', 'last_error', 'generation', 'updated_at'}].
+    """
+    rows = execute_query(
+        """
+        SELECT f.name, f.url, f.attempts, f.last_error, f.generation, f.updated_at
+        FROM crawl_frontier f
+        WHERE f.state = 'failed'
+          AND f.generation = (SELECT MAX(generation) FROM crawl_frontier WHERE url = f.url AND state != 'pending')
+        ORDER BY f.updated_at, f.url
+        """,
+        fetch='all'
+    )
+    return [
+        {'name': name, 'url': url, 'attempts': attempts, 'last_error': error, 'generation': generation, 'updated_at': at}
+        for name, url, attempts, error, generation, at in rows or []
+    ]
+
+@metrics.span('save_parsed_data')
+def save_parsed_data(data: list):
+    """
+    Сохраняет спарсенные данные в базу данных новым поколением
+    и атомарно публикует его.
+    Данные должны быть в формате, который возвращает MetalParser.parse_category_page.
+    """
+    logger.info(f"Saving {len(data)} categories to database...")
+    generation = begin_generation()
+    save_categories(data, generation)
+    publish_generation(generation)
     logger.info("Data saved to database successfully.")
 
+def get_category_ages() -> dict:
+    """Возвращает {url: сколько секунд назад категория обновлялась} для опубликованных категорий."""
+    rows = execute_query(
+        "SELECT url, (julianday('now') - julianday(refreshed_at)) * 86400 FROM categories",
+        fetch='all'
+    ) or []
+    return {url: age if age is not None else float('inf') for url, age in rows}
+
 def get_all_categories():
     """Возвращает все категории из базы данных."""
     return execute_query("SELECT id, name FROM categories ORDER BY name", fetch='all')
 
+# --- Постраничные выборки ---
+
+# Ключ сортировки цен: строки без цены за тонну идут последними
+PRICE_SORT_KEY = 'IFNULL(ton_price, 1e18)'
+
+def _keyset_page(
+    select: str,
+    table: str,
+    sort_column: str,
+    where: str = '1',
+    params: tuple = (),
+    cursor_id: Optional[int] = None,
+    backward: bool = False,
+    limit: int = 20,
+) -> dict:
+    """
+    Страница выборки, упорядоченной по (sort_column, id), без OFFSET:
+    вперед - строки после строки cursor_id, назад - строки перед ней.
+    Стоимость не зависит от номера страницы: выборка начинается с поиска по индексу.
+    Если строки cursor_id уже нет (каталог обновился), возвращается первая страница.
+    """
+    cursor_value = None
+    if cursor_id is not None:
+        cursor_row = execute_query(
+            f"SELECT {sort_column} FROM {table} WHERE id = ? AND {where}", (cursor_id, *params), fetch='one'
+        )
+        if cursor_row:
+            cursor_value = cursor_row[0]
+        else:
+            cursor_id, backward = None, False
+
+    if cursor_id is None:
+        condition, cursor_params = '', ()
+    else:
+        # Условие развернуто вручную: сравнение (a, b) > (?, ?) не использует индекс по выражению
+        operator = '<' if backward else '>'
+        condition = (
+            f"AND {sort_column} {operator}= ? "
+            f"AND ({sort_column} {operator} ? OR id {operator} ?)"
+        )
+        cursor_params = (cursor_value, cursor_value, cursor_id)
+    direction = ' DESC' if backward else ''
+    rows = execute_query(
+        f"""
+        SELECT {select} FROM {table} WHERE {where} {condition}
+        ORDER BY {sort_column}{direction}, id{direction} LIMIT ?
+        """,
+        (*params, *cursor_params, limit + 1),
+        fetch='all'
+    ) or []
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = cursor_id is not None, more
+    return {'items': rows, 'has_prev': has_prev, 'has_next': has_next}
+
+def get_categories_page(cursor_id: Optional[int] = None, backward: bool = False, limit: int = 20) -> dict:
+    """
+    Страница списка категорий по имени: {'items': [(id, name)], 'has_prev', 'has_next'}.
+    Следующая страница начинается после категории cursor_id, предыдущая - перед ней.
+    """
+    return _keyset_page(
+        'id, name', 'categories', 'name',
+        cursor_id=cursor_id, backward=backward, limit=limit
+    )
+
+def get_prices_page(category_id: int, cursor_id: Optional[int] = None, backward: bool = False, limit: int = 10) -> dict:
+    """
+    Страница предложений категории от дешевых к дорогим:
+    {'items': [(id, position, spec, dimensions, supplier, city, ton_price, price_per_ton)], 'has_prev', 'has_next'}.
+    """
+    return _keyset_page(
+        'id, position, spec, dimensions, supplier, city, ton_price, price_per_ton', 'prices',
+        PRICE_SORT_KEY, 'category_id = ?', (category_id,),
+        cursor_id=cursor_id, backward=backward, limit=limit
+    )
+
 def get_category_details(category_id: int):
     """Возвращает детали категории, включая фильтры и средние цены."""
     # Получаем информацию о категории
@@ -150,25 +1198,253 @@ def get_category_details(category_id: int):
     # Получаем фильтры
     filters = execute_query("SELECT filter_group, sizes FROM filters WHERE category_id = ?", (category_id,), fetch='all')
     
-    # Рассчитываем среднюю цену
-    avg_price_result = execute_query(
-        """
-        SELECT AVG(CAST(REPLACE(price_per_ton, ' ', '') AS REAL))
-        FROM prices
-        WHERE category_id = ? AND price_per_ton != ''
-        """,
+    # Агрегаты цен посчитаны заранее при публикации поколения
+    stats = execute_query(
+        "SELECT offers, avg_price, min_price, max_price, median_price FROM category_stats WHERE category_id = ?",
         (category_id,),
         fetch='one'
-    )
-    avg_price = avg_price_result[0] if avg_price_result and avg_price_result[0] is not None else 0
+    ) or (0, 0, 0, 0, 0)
+    offers, avg_price, min_price, max_price, median_price = stats
 
     return {
         'name': category_info[0],
         'url': category_info[1],
         'filters': {group: ujson.loads(sizes) for group, sizes in filters},
-        'average_price': round(avg_price, 2)
+        'average_price': round(avg_price, 2),
+        'min_price': min_price,
+        'max_price': max_price,
+        'median_price': median_price,
+        'offers': offers
     }
 
+def get_quote_rows(category_id: int) -> list:
+    """Предложения категории с известными ценой за тонну и массой единицы (для pricing.QuoteTable)."""
+    return execute_query(
+        """
+        SELECT ton_price, unit_weight, unit, position, dimensions, supplier, city FROM prices
+        WHERE category_id = ? AND ton_price IS NOT NULL AND unit_weight IS NOT NULL
+        """,
+        (category_id,),
+        fetch='all'
+    ) or []
+
+# --- Лучшие предложения ---
+
+OFFER_COLUMNS = 'p.id, p.position, p.spec, p.dimensions, p.supplier, p.city, p.ton_price, p.price_per_ton'
+
+def get_top_offers(category_id: int, city_id: int = 0, size: str = '', limit: int = 5) -> list:
+    """
+    Самые дешевые предложения категории за тонну, при необходимости - в одном городе
+    (city_id из таблицы cities, 0 - все города) и одного размера ('' - все размеры):
+    [(id, position, spec, dimensions, supplier, city, ton_price, price_per_ton)].
+    Отдельно по городу и по размеру списки посчитаны при публикации (top_offers);
+    город и размер вместе - короткий проход по индексу (category_id, city, цена).
+    """
+    if city_id and size:
+        return execute_query(
+            f"""
+            SELECT {OFFER_COLUMNS} FROM prices p
+            WHERE p.category_id = ? AND p.city = (SELECT name FROM cities WHERE id = ?)
+                AND p.size = ? AND p.ton_price IS NOT NULL
+            ORDER BY {PRICE_SORT_KEY}, p.id LIMIT ?
+            """,
+            (category_id, city_id, size, limit),
+            fetch='all'
+        ) or []
+    return execute_query(
+        f"""
+        SELECT {OFFER_COLUMNS} FROM top_offers t
+        JOIN prices p ON p.id = t.price_id
+        WHERE t.category_id = ? AND t.city_id = ? AND t.size = ?
+        ORDER BY t.rank LIMIT ?
+        """,
+        (category_id, city_id, size, limit),
+        fetch='all'
+    ) or []
+
+def get_offer_comparison(category_id: int, city_id: int = 0, size: str = '', limit: int = 5) -> dict:
+    """
+    Сравнение предложений категории: лучшие предложения (см. get_top_offers),
+    поставщики с лучшими ценами [(supplier, best_price, offers)], разброс лучших цен
+    поставщиков и города [(city_id, name)] и размеры, по которым есть списки.
+    """
+    suppliers = execute_query(
+        """
+        SELECT s.name, r.best_price, r.offers FROM supplier_ranking r
+        JOIN suppliers s ON s.id = r.supplier_id
+        WHERE r.category_id = ? ORDER BY r.rank LIMIT ?
+        """,
+        (category_id, limit),
+        fetch='all'
+    ) or []
+    spread = execute_query(
+        "SELECT suppliers, min_price, supplier_median, supplier_max FROM category_stats WHERE category_id = ?",
+        (category_id,),
+        fetch='one'
+    ) or (0, None, None, None)
+    cities = execute_query(
+        """
+        SELECT c.id, c.name FROM top_offers t JOIN cities c ON c.id = t.city_id
+        WHERE t.category_id = ? AND t.size = '' AND t.rank = 1 ORDER BY c.name
+        """,
+        (category_id,),
+        fetch='all'
+    ) or []
+    sizes = execute_query(
+        "SELECT size FROM top_offers WHERE category_id = ? AND city_id = 0 AND size != '' AND rank = 1",
+        (category_id,),
+        fetch='all'
+    ) or []
+    return {
+        'offers': get_top_offers(category_id, city_id, size, limit),
+        'suppliers': suppliers,
+        'spread': dict(zip(('suppliers', 'min_price', 'median_price', 'max_price'), spread)),
+        'cities': cities,
+        'sizes': sorted((size for (size,) in sizes), key=_size_order),
+    }
+
+def _size_order(size: str) -> tuple:
+    """Порядок размеров по числам: 8 < 10 < 40x20."""
+    return tuple(float(part) for part in size.split('x') if part.replace('.', '', 1).isdigit()), size
+
+# --- Поиск ---
+
+def search_prices(text: str, limit: int = 10, scan: int = 200) -> list:
+    """
+    Ищет позиции по названию, марке и размерам во всем каталоге.
+    Строки одной позиции (категория, позиция, марка, размеры) объединяются;
+    для каждой возвращаются самое дешевое предложение за тонну и число предложений.
+    Из индекса берутся scan лучших по релевантности строк.
+    """
+    terms = search_query(text)
+    if not terms:
+        return []
+    rows = execute_query(
+        """
+        SELECT p.category_id, c.name, p.position, p.spec, p.dimensions,
+               p.supplier, p.city, p.ton_price, p.price_per_ton
+        FROM price_search s
+        JOIN prices p ON p.id = s.rowid
+        JOIN categories c ON c.id = p.category_id
+        WHERE price_search MATCH ?
+        ORDER BY s.rank
+        LIMIT ?
+        """,
+        (' '.join(terms), scan),
+        fetch='all'
+    ) or []
+
+    matches = {}
+    for category_id, category, position, spec, dimensions, supplier, city, ton_price, price_text in rows:
+        key = (category_id, position, spec, dimensions)
+        match = matches.get(key)
+        if match is None:
+            if len(matches) == limit:
+                continue
+            match = matches[key] = {
+                'category_id': category_id,
+                'category': category,
+                'position': position,
+                'spec': spec,
+                'dimensions': dimensions,
+                'offers': 0,
+                'price': None,
+            }
+        match['offers'] += 1
+        if ton_price is not None and (match['price'] is None or ton_price < match['price']):
+            match.update(price=ton_price, price_text=price_text, supplier=supplier, city=city)
+    return list(matches.values())
+
+# --- История цен ---
+
+def _history_snapshot(category_id: int, at: int) -> Optional[int]:
+    """Время снимка категории, действовавшего на момент at (None, если снимков раньше нет)."""
+    result = execute_query(
+        "SELECT MAX(recorded_at) FROM price_history WHERE category_id = ? AND recorded_at <= ?",
+        (category_id, at),
+        fetch='one'
+    )
+    return result[0] if result else None
+
+def _snapshot_ton_prices(category_id: int, recorded_at: int) -> list:
+    rows = execute_query(
+        """
+        SELECT ton_kopecks FROM price_history
+        WHERE category_id = ? AND recorded_at = ? AND ton_kopecks IS NOT NULL
+        ORDER BY ton_kopecks
+        """,
+        (category_id, recorded_at),
+        fetch='all'
+    ) or []
+    return [kopecks / 100 for (kopecks,) in rows]
+
+def get_price_change(category_id: int, days: int) -> Optional[dict]:
+    """
+    Изменение цен за тонну в категории за days дней: минимум, медиана
+    и число предложений сейчас и тогда. Если история короче, сравнение
+    идет с самым ранним снимком (его время - в 'since').
+    """
+    now = int(time.time())
+    current = _history_snapshot(category_id, now)
+    if current is None:
+        return None
+    past = _history_snapshot(category_id, now - days * 86400)
+    if past is None:
+        result = execute_query(
+            "SELECT MIN(recorded_at) FROM price_history WHERE category_id = ?", (category_id,), fetch='one'
+        )
+        past = result[0]
+
+    summary = {'days': days, 'since': past}
+    for label, recorded_at in (('then', past), ('now', current)):
+        values = _snapshot_ton_prices(category_id, recorded_at)
+        summary[f'min_{label}'] = values[0] if values else None
+        summary[f'median_{label}'] = median(values) if values else None
+        summary[f'offers_{label}'] = len(values)
+    return summary
+
+def get_supplier_trends(category_id: int, days: int, limit: int = 5) -> list:
+    """
+    Динамика минимальной цены за тонну по поставщикам категории за days дней.
+    Для каждого поставщика из текущего снимка: цена в начале периода,
+    сейчас и ряд (время снимка, цена). Отсортировано по текущей цене.
+    """
+    now = int(time.time())
+    start = _history_snapshot(category_id, now - days * 86400) or now - days * 86400
+    rows = execute_query(
+        """
+        SELECT h.recorded_at, s.name, MIN(h.ton_kopecks)
+        FROM price_history h JOIN suppliers s ON s.id = h.supplier_id
+        WHERE h.category_id = ? AND h.recorded_at >= ? AND h.ton_kopecks IS NOT NULL
+        GROUP BY h.recorded_at, h.supplier_id
+        ORDER BY h.recorded_at
+        """,
+        (category_id, start),
+        fetch='all'
+    ) or []
+    if not rows:
+        return []
+
+    latest = rows[-1][0]
+    series = {}
+    for recorded_at, supplier, kopecks in rows:
+        series.setdefault(supplier, []).append((recorded_at, kopecks / 100))
+    trends = []
+    for supplier, points in series.items():
+        if points[-1][0] != latest:
+            # Поставщика нет в текущем снимке
+            continue
+        first, last = points[0][1], points[-1][1]
+        trends.append({
+            'supplier': supplier,
+            'first_price': first,
+            'last_price': last,
+            'change_pct': (last - first) / first * 100,
+            'series': points,
+        })
+    trends.sort(key=lambda trend: trend['last_price'])
+    return trends[:limit]
+
 if __name__ == '__main__':
     # Пример использования
     init_db()
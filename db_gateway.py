@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import database
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseGateway:
+    """
+    Асинхронный доступ к БД для обработчиков бота.
+    Запросы выполняются в отдельных потоках-читателях, у каждого из которых
+    постоянное read-only соединение, поэтому цикл событий не блокируется.
+    """
+
+    def __init__(self, readers: int = 2):
+        self.readers = readers
+        self.executor = ThreadPoolExecutor(
+            max_workers=readers,
+            thread_name_prefix='db-reader',
+            initializer=database.open_reader_connection,
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет функцию модуля database в потоке-читателе."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def get_all_categories(self):
+        return await self.run(database.get_all_categories)
+
+    async def get_categories_page(self, cursor_id=None, backward: bool = False, limit: int = 20):
+        return await self.run(database.get_categories_page, cursor_id, backward, limit)
+
+    async def get_prices_page(self, category_id: int, cursor_id=None, backward: bool = False, limit: int = 10):
+        return await self.run(database.get_prices_page, category_id, cursor_id, backward, limit)
+
+    async def get_category_details(self, category_id: int):
+        return await self.run(database.get_category_details, category_id)
+
+    async def get_quote_rows(self, category_id: int):
+        return await self.run(database.get_quote_rows, category_id)
+
+    async def get_offer_comparison(self, category_id: int, city_id: int = 0, size: str = '', limit: int = 5):
+        return await self.run(database.get_offer_comparison, category_id, city_id, size, limit)
+
+    async def search_prices(self, text: str, limit: int = 10):
+        return await self.run(database.search_prices, text, limit)
+
+    async def get_price_change(self, category_id: int, days: int):
+        return await self.run(database.get_price_change, category_id, days)
+
+    async def get_supplier_trends(self, category_id: int, days: int, limit: int = 5):
+        return await self.run(database.get_supplier_trends, category_id, days, limit)
+
+    async def get_current_generation(self) -> int:
+        return await self.run(database.get_current_generation)
+
+    async def close(self):
+        """Дожидается текущих запросов, останавливает потоки и закрывает их соединения."""
+        await asyncio.to_thread(self.executor.shutdown)
+        database.close_reader_connections()
+
+
+db = DatabaseGateway(readers=config.DB_READER_THREADS)
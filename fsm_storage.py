@@ -0,0 +1,204 @@
+"""
+Хранилище состояний FSM (диалог расчета заказа) в SQLite.
+
+В отличие от MemoryStorage, состояние переживает перезапуск бота и общее
+для нескольких процессов бота, работающих с одним файлом. Запись отложенная:
+изменения копятся в памяти и сбрасываются одной транзакцией раз в
+flush_interval секунд (или когда набралось max_batch ключей), повторные
+изменения одного ключа схлопываются. Процесс читает свои еще не записанные
+изменения из памяти, другие процессы видят их не позже чем через flush_interval.
+Сессии, которые не менялись дольше ttl секунд (брошенные диалоги), истекают.
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import ujson
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять истекшие сессии (сек)
+PURGE_INTERVAL = 600
+
+# Меняются только переданные поля; поля истекшей, но еще не удаленной сессии не воскрешаются
+_UPSERT = """
+    INSERT INTO fsm_sessions (key, state, data, expires_at) VALUES (:key, :state, :data, :expires_at)
+    ON CONFLICT (key) DO UPDATE SET
+        state = CASE WHEN :has_state THEN excluded.state WHEN fsm_sessions.expires_at > :now THEN fsm_sessions.state END,
+        data = CASE WHEN :has_data THEN excluded.data WHEN fsm_sessions.expires_at > :now THEN fsm_sessions.data END,
+        expires_at = excluded.expires_at
+"""
+
+
+def _key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM aiogram в файле SQLite (WAL). Строка на ключ: состояние
+    и данные в компактном JSON; пустые сессии удаляются.
+    flush_interval <= 0 - запись сразу при каждом изменении.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400, flush_interval: float = 0.05, max_batch: int = 500):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        # Ключ -> {'state': ..., 'data': ...} (только измененные поля), еще не записанные в БД
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        # Пачка, которая пишется прямо сейчас (читается, пока транзакция не завершилась)
+        self._flushing: Dict[str, Dict[str, Any]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._purged_at = 0.0
+        self._writer_lock = threading.Lock()
+
+        # Чтение по первичному ключу в режиме WAL не блокируется писателями и занимает
+        # десятки микросекунд, поэтому идет прямо в цикле событий; запись - в потоке
+        self._reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._reader.execute("PRAGMA journal_mode = WAL")
+        self._reader.execute("PRAGMA busy_timeout = 5000")
+        self._reader.execute("""
+            CREATE TABLE IF NOT EXISTS fsm_sessions (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT,
+                expires_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        self._writer.execute("PRAGMA busy_timeout = 5000")
+        # Потеря последних изменений при отключении питания допустима, порча файла - нет
+        self._writer.execute("PRAGMA synchronous = NORMAL")
+
+    # ---------------- BaseStorage -----------------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._put(_key(key), 'state', _state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        name = _key(key)
+        change = self._pending_change(name, 'state')
+        if change is not None:
+            return change[0]
+        row = self._read(name)
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._put(_key(key), 'data', dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        name = _key(key)
+        change = self._pending_change(name, 'data')
+        if change is not None:
+            return dict(change[0])
+        row = self._read(name)
+        return ujson.loads(row[1]) if row and row[1] else {}
+
+    async def close(self) -> None:
+        """Записывает накопленные изменения и закрывает соединения."""
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        self._reader.close()
+        self._writer.close()
+
+    # ---------------- Запись -----------------
+
+    async def _put(self, name: str, field: str, value: Any):
+        self._pending.setdefault(name, {})[field] = value
+        if self.flush_interval <= 0:
+            await self.flush()
+            return
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop(), name='fsm-flush')
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Изменения остаются в очереди и будут записаны следующим сбросом
+                logger.error(f"FSM storage flush failed: {e}")
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, self._flushing)
+            except BaseException:
+                # Более новые изменения тех же ключей важнее неудачно записанных
+                for name, change in self._flushing.items():
+                    self._pending[name] = {**change, **self._pending.get(name, {})}
+                raise
+            finally:
+                self._flushing = {}
+
+    def _write(self, batch: Dict[str, Dict[str, Any]]):
+        now = time.time()
+        expires_at = now + self.ttl
+        rows = []
+        for name, change in batch.items():
+            data = change.get('data')
+            rows.append({
+                'key': name,
+                'state': change.get('state'),
+                'data': ujson.dumps(data, ensure_ascii=False) if data else None,
+                'expires_at': expires_at,
+                'has_state': 'state' in change,
+                'has_data': 'data' in change,
+                'now': now,
+            })
+        with self._writer_lock, self._writer:
+            self._writer.executemany(_UPSERT, rows)
+            self._writer.executemany(
+                "DELETE FROM fsm_sessions WHERE key = ? AND state IS NULL AND data IS NULL",
+                [(row['key'],) for row in rows]
+            )
+            if now - self._purged_at >= PURGE_INTERVAL:
+                self._purged_at = now
+                purged = self._writer.execute("DELETE FROM fsm_sessions WHERE expires_at <= ?", (now,)).rowcount
+                if purged:
+                    logger.info(f"FSM storage: {purged} expired sessions removed")
+
+    # ---------------- Чтение -----------------
+
+    def _pending_change(self, name: str, field: str) -> Optional[tuple]:
+        """Незаписанное значение поля: (значение,) или None, если поле не менялось."""
+        for changes in (self._pending, self._flushing):
+            change = changes.get(name)
+            if change and field in change:
+                return (change[field],)
+        return None
+
+    def _read(self, name: str) -> Optional[tuple]:
+        return self._reader.execute(
+            "SELECT state, data FROM fsm_sessions WHERE key = ? AND expires_at > ?", (name, time.time())
+        ).fetchone()
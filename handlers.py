@@ -1,18 +1,56 @@
-from aiogram import Bot, Router, types, F
-from aiogram.filters import CommandStart
+from aiogram import BaseMiddleware, Router, types, F
+from aiogram.filters import CommandStart, ExceptionTypeFilter, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import CallbackQuery
+from aiogram.types import CallbackQuery, ErrorEvent
 import logging
+import sqlite3
+from html import escape
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict
 
 import keyboards as kb
-from database import get_all_categories, get_category_details
+import metrics
+from catalog_cache import catalog_cache
 from config import config
+from db_gateway import db
+from notifier import notifier
+from pricing import UNIT_LABELS, UNIT_SQUARE_METER
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Замеряет время каждого обработчика роутера (метрика bot_handler_seconds по имени функции)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        # Внутренний middleware вызывается после фильтров, когда обработчик уже выбран
+        name = data['handler'].callback.__name__
+        with metrics.span(name, metrics.HANDLER_SECONDS, handler=name):
+            return await handler(event, data)
+
+
+router.message.middleware(HandlerMetricsMiddleware())
+router.callback_query.middleware(HandlerMetricsMiddleware())
+
+
+@router.errors(ExceptionTypeFilter(sqlite3.Error))
+async def on_database_error(event: ErrorEvent):
+    """Сбой чтения БД (например, база занята публикацией): отвечаем пользователю, диалог не сбрасываем."""
+    logger.error(f"Database error while handling update {event.update.update_id}: {event.exception}")
+    text = "Сервис временно недоступен. Попробуйте позже."
+    if event.update.callback_query:
+        await event.update.callback_query.answer(text, show_alert=True)
+    elif event.update.message:
+        await event.update.message.answer(text)
+
 # ---------------- FSM States -----------------
 class CalculationStates(StatesGroup):
     waiting_for_meters = State()
@@ -39,38 +77,174 @@ async def cq_main_menu(callback: CallbackQuery):
     await callback.answer()
 
 # Show categories
-@router.callback_query(F.data == "show_categories")
-async def cq_show_categories(callback: CallbackQuery):
-    if not get_all_categories():
+async def show_categories_page(callback: CallbackQuery, cursor_id=None, backward: bool = False):
+    page = await catalog_cache.get_categories_page(cursor_id, backward)
+    if not page['items']:
         await callback.answer("Категории отсутствуют. Попробуйте позже.", show_alert=True)
         return
     text = "<b>Каталог товаров</b>\n\nВыберите категорию:"
-    await callback.message.edit_text(text, reply_markup=kb.get_categories_keyboard())
+    keyboard = await catalog_cache.get_keyboard(
+        ('categories', cursor_id, backward), kb.get_categories_keyboard, page
+    )
+    await callback.message.edit_text(text, reply_markup=keyboard)
     await callback.answer()
 
+@router.callback_query(F.data == "show_categories")
+async def cq_show_categories(callback: CallbackQuery):
+    await show_categories_page(callback)
+
+# Categories pages: categories_{n|p}_{cursor id}
+@router.callback_query(F.data.startswith("categories_"))
+async def cq_categories_page(callback: CallbackQuery):
+    _, direction, cursor_id = callback.data.split("_")
+    await show_categories_page(callback, int(cursor_id), backward=direction == "p")
+
 # Category details
 @router.callback_query(F.data.startswith("category_"))
 async def cq_category_details(callback: CallbackQuery):
     category_id = int(callback.data.split("_")[1])
-    details = get_category_details(category_id)
+    details = await catalog_cache.get_category_details(category_id)
     if not details:
         await callback.answer("Категория не найдена.", show_alert=True)
         return
+    price_range = (
+        f"Цены от {details['min_price']:,.0f} до {details['max_price']:,.0f} руб. "
+        f"({details['offers']} предложений)\n"
+        if details['offers'] else ""
+    )
     text = (
         f"<b>{details['name']}</b>\n\n"
-        f"Средняя цена за тонну: <b>{details['average_price']:,} руб.</b>\n\n"
+        f"Средняя цена за тонну: <b>{details['average_price']:,} руб.</b>\n"
+        f"{price_range}\n"
         "Вы можете рассчитать точную стоимость вашего заказа."
     )
-    await callback.message.edit_text(text, reply_markup=kb.get_category_details_keyboard(category_id))
+    keyboard = await catalog_cache.get_keyboard(('details', category_id), kb.get_category_details_keyboard, category_id)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+# Category offers: prices_{category id}[_{n|p}_{cursor id}]
+@router.callback_query(F.data.startswith("prices_"))
+async def cq_category_prices(callback: CallbackQuery):
+    parts = callback.data.split("_")
+    category_id = int(parts[1])
+    cursor_id = int(parts[3]) if len(parts) == 4 else None
+    backward = len(parts) == 4 and parts[2] == "p"
+
+    details = await catalog_cache.get_category_details(category_id)
+    if not details:
+        await callback.answer("Категория не найдена.", show_alert=True)
+        return
+    page = await catalog_cache.get_prices_page(category_id, cursor_id, backward)
+    if not page['items']:
+        await callback.answer("Предложений по категории пока нет.", show_alert=True)
+        return
+
+    lines = [f"<b>{escape(details['name'])}</b>\nПредложения от дешевых к дорогим:"]
+    for _, position, spec, dimensions, supplier, city, ton_price, price_text in page['items']:
+        title = " ".join(part for part in (position, spec, dimensions) if part)
+        price = f"{ton_price:,.0f} руб./т" if ton_price is not None else (price_text or "цена по запросу")
+        source = ", ".join(part for part in (supplier, city) if part)
+        lines.append(f"• <b>{escape(title)}</b> — {escape(price)}\n  {escape(source)}")
+    keyboard = await catalog_cache.get_keyboard(
+        ('prices', category_id, cursor_id, backward), kb.get_prices_keyboard, category_id, page
+    )
+    await callback.message.edit_text("\n\n".join(lines), reply_markup=keyboard)
+    await callback.answer()
+
+# Best offers and suppliers
+@router.callback_query(F.data.startswith("top_"))
+async def cq_top_offers(callback: CallbackQuery):
+    _, category_id, city_id, size = callback.data.split("_", 3)
+    category_id, city_id = int(category_id), int(city_id)
+    details = await catalog_cache.get_category_details(category_id)
+    if not details:
+        await callback.answer("Категория не найдена.", show_alert=True)
+        return
+    comparison = await catalog_cache.get_offer_comparison(category_id, city_id, size)
+    if not comparison['suppliers']:
+        await callback.answer("Предложений с ценой за тонну по категории пока нет.", show_alert=True)
+        return
+
+    city = dict(comparison['cities']).get(city_id)
+    scope = ", ".join(part for part in (city, f"размер {size}" if size else '') if part)
+    lines = [f"<b>{escape(details['name'])}</b>\nЛучшие предложения за тонну{f' ({escape(scope)})' if scope else ''}:"]
+    if not comparison['offers']:
+        lines.append("Таких предложений нет, выберите другой город или размер.")
+    for _, position, spec, dimensions, supplier, offer_city, ton_price, _ in comparison['offers']:
+        title = " ".join(part for part in (position, spec, dimensions) if part)
+        source = ", ".join(part for part in (supplier, offer_city) if part)
+        lines.append(f"• <b>{escape(title)}</b> — {ton_price:,.0f} руб./т\n  {escape(source)}")
+
+    spread = comparison['spread']
+    supplier_lines = [
+        f"<b>Поставщики по лучшей цене</b> (всего {spread['suppliers']}; "
+        f"лучшие цены от {spread['min_price']:,.0f} до {spread['max_price']:,.0f}, "
+        f"медиана {spread['median_price']:,.0f} руб./т):"
+    ]
+    for number, (supplier, best_price, offers) in enumerate(comparison['suppliers'], 1):
+        supplier_lines.append(f"{number}. {escape(supplier or 'Без названия')}: {best_price:,.0f} руб./т ({offers} предл.)")
+    lines.append("\n".join(supplier_lines))
+    keyboard = await catalog_cache.get_keyboard(
+        ('top', category_id, city_id, size), kb.get_top_offers_keyboard, category_id, comparison, city_id, size
+    )
+    await callback.message.edit_text("\n\n".join(lines), reply_markup=keyboard)
+    await callback.answer()
+
+# Price history
+def _format_change(then, now) -> str:
+    if then is None or now is None:
+        return "нет данных"
+    if not then:
+        return f"{now:,.0f} руб."
+    return f"{then:,.0f} → {now:,.0f} руб. ({(now - then) / then * 100:+.1f}%)"
+
+@router.callback_query(F.data.startswith("history_"))
+async def cq_price_history(callback: CallbackQuery):
+    _, category_id, days = callback.data.split("_")
+    category_id, days = int(category_id), int(days)
+    details = await catalog_cache.get_category_details(category_id)
+    if not details:
+        await callback.answer("Категория не найдена.", show_alert=True)
+        return
+    history = await catalog_cache.get_price_history(category_id, days)
+    change = history['change']
+    if not change:
+        await callback.answer("История цен по категории пока не собрана.", show_alert=True)
+        return
+
+    since = datetime.fromtimestamp(change['since']).strftime('%d.%m.%Y')
+    lines = [
+        f"<b>{details['name']}</b>",
+        f"Динамика цен за тонну с {since}\n",
+        f"Минимальная: {_format_change(change['min_then'], change['min_now'])}",
+        f"Медианная: {_format_change(change['median_then'], change['median_now'])}",
+        f"Предложений: {change['offers_then']} → {change['offers_now']}",
+    ]
+    if history['suppliers']:
+        lines.append("\n<b>Поставщики с лучшей ценой:</b>")
+        for trend in history['suppliers']:
+            lines.append(
+                f"{trend['supplier'] or 'Без названия'}: {trend['last_price']:,.0f} руб. "
+                f"({trend['change_pct']:+.1f}%)"
+            )
+    keyboard = await catalog_cache.get_keyboard(
+        ('history', category_id, days), kb.get_price_history_keyboard, category_id, days
+    )
+    await callback.message.edit_text("\n".join(lines), reply_markup=keyboard)
     await callback.answer()
 
 # Start calculation
 @router.callback_query(F.data.startswith("calculate_"))
 async def cq_start_calculation(callback: CallbackQuery, state: FSMContext):
     category_id = int(callback.data.split("_")[1])
+    quotes = await catalog_cache.get_quote_table(category_id)
     await state.set_state(CalculationStates.waiting_for_meters)
     await state.update_data(category_id=category_id)
-    await callback.message.edit_text("Введите необходимое количество метров:", reply_markup=kb.get_calculator_keyboard())
+    prompt = (
+        "Введите необходимую площадь, м²:" if quotes.unit == UNIT_SQUARE_METER
+        else "Введите необходимое количество метров:"
+    )
+    await callback.message.edit_text(prompt, reply_markup=kb.get_calculator_keyboard())
     await callback.answer()
 
 # Process meters
@@ -85,62 +259,118 @@ async def process_meters(message: types.Message, state: FSMContext):
 
 # Process date and finish
 @router.message(CalculationStates.waiting_for_date)
-async def process_date(message: types.Message, state: FSMContext, bot: Bot):
+async def process_date(message: types.Message, state: FSMContext):
+    if not message.text:
+        # Стикер, фото, голосовое: срок нужен текстом
+        await message.answer("Пожалуйста, напишите срок доставки текстом.")
+        return
     await state.update_data(delivery_date=message.text)
     data = await state.get_data()
-    await state.clear()
 
     category_id = data.get("category_id")
     meters = data.get("meters")
     delivery_date = data.get("delivery_date")
 
-    details = get_category_details(category_id)
+    details = await catalog_cache.get_category_details(category_id)
     if not details:
+        await state.clear()
         await message.answer("Ошибка: не удалось найти выбранную категорию.")
         return
 
-    # Simple weight assumption – this should be replaced with real data
-    weight_per_meter_kg = 10
-    total_weight_ton = meters * weight_per_meter_kg / 1000
-    total_cost = total_weight_ton * details["average_price"]
+    # Стоимость по каждому предложению категории: масса по размерам позиции, цена за тонну поставщика
+    quotes = await catalog_cache.get_quote_table(category_id)
+    quote = quotes.quote(meters)
+    unit = UNIT_LABELS[quotes.unit]
+    if quote:
+        best = quote['best']
+        offer = best['position']
+        if best['dimensions'] not in offer:
+            offer = f"{offer} {best['dimensions']}".strip()
+        source = ", ".join(part for part in (best['supplier'], best['city']) if part)
+        estimate = (
+            f"<b>Примерный вес:</b> {quote['min_weight']:.2f}–{quote['max_weight']:.2f} т\n"
+            f"<b>Примерная стоимость:</b> от {quote['min_cost']:,.2f} руб. "
+            f"(медиана {quote['median_cost']:,.2f} руб., предложений: {quote['offers']})\n"
+            f"<b>Лучшее предложение:</b> {escape(offer)} — {escape(source)}: "
+            f"{best['cost']:,.2f} руб. за {best['weight']:.2f} т\n"
+        )
+    else:
+        estimate = "<b>Примерная стоимость:</b> рассчитает менеджер (нет данных о массе позиций)\n"
 
     # Notify manager
     manager_text = (
         f"<b>Новая заявка</b>\n\n"
         f"<b>Пользователь:</b> @{message.from_user.username} (ID: {message.from_user.id})\n"
         f"<b>Товар:</b> {details['name']}\n"
-        f"<b>Количество:</b> {meters} м\n"
-        f"<b>Примерный вес:</b> {total_weight_ton:.2f} т\n"
-        f"<b>Примерная стоимость:</b> {total_cost:,.2f} руб.\n"
-        f"<b>Срок поставки:</b> {delivery_date}"
+        f"<b>Количество:</b> {meters} {unit}\n"
+        f"{estimate}"
+        f"<b>Срок поставки:</b> {escape(delivery_date)}"
     )
+    # Уходит в канал менеджеров в фоне, с учетом лимитов Telegram
     try:
-        await bot.send_message(config.MANAGER_CHANNEL_ID, manager_text)
+        await notifier.notify(manager_text)
     except Exception as e:
-        logger.error(f"Failed to send message to manager channel: {e}")
+        # Диалог не сбрасывается: заявку можно отправить повторно, прислав срок еще раз
+        logger.error(f"Failed to queue order: {e}")
+        await message.answer("Не удалось отправить заявку. Пришлите срок доставки еще раз чуть позже.")
+        return
+    await state.clear()
 
     # Reply to user
     user_text = (
         f"<b>Ваша заявка принята!</b>\n\n"
         f"<b>Товар:</b> {details['name']}\n"
-        f"<b>Количество:</b> {meters} м\n"
-        f"<b>Примерная стоимость:</b> {total_cost:,.2f} руб.\n\n"
+        f"<b>Количество:</b> {meters} {unit}\n"
+        f"{estimate}\n"
         "Наш менеджер свяжется с вами в ближайшее время."
     )
     await message.answer(user_text, reply_markup=kb.get_main_menu_keyboard())
 
+# Search: any text outside of a dialog is treated as a search query
+@router.message(StateFilter(None), F.text, ~F.text.startswith("/"))
+async def process_search(message: types.Message):
+    query = message.text.strip()
+    if len(query) < 2:
+        await message.answer("Введите хотя бы два символа для поиска, например: <i>труба 57x3.5</i>")
+        return
+    results = await db.search_prices(query, limit=config.SEARCH_RESULTS)
+    if not results:
+        await message.answer(
+            f"По запросу «{escape(query)}» ничего не найдено.",
+            reply_markup=kb.get_main_menu_keyboard()
+        )
+        return
+
+    lines = [f"<b>🔍 Найдено по запросу «{escape(query)}»:</b>"]
+    categories = {}
+    for match in results:
+        title = " ".join(part for part in (match['position'], match['spec'], match['dimensions']) if part)
+        categories.setdefault(match['category_id'], match['category'])
+        if match['price'] is not None:
+            supplier = ", ".join(part for part in (match['supplier'], match['city']) if part)
+            offer = f"от {match['price']:,.0f} руб./т — {escape(supplier or 'поставщик не указан')}"
+        else:
+            offer = "цена по запросу"
+        lines.append(
+            f"<b>{escape(title)}</b> ({escape(match['category'])})\n"
+            f"{offer}, предложений: {match['offers']}"
+        )
+    keyboard = kb.get_search_results_keyboard(list(categories.items()))
+    await message.answer("\n\n".join(lines), reply_markup=keyboard)
+
 # Contact manager
 @router.callback_query(F.data == "contact_manager")
-async def cq_contact_manager(callback: CallbackQuery, bot: Bot):
+async def cq_contact_manager(callback: CallbackQuery):
     user = callback.from_user
     manager_text = (
         f"<b>📞 Запрос на связь</b>\n\n"
         f"Пользователь @{user.username} (ID: {user.id}) просит связаться."
     )
     try:
-        await bot.send_message(config.MANAGER_CHANNEL_ID, manager_text)
-        await callback.answer("Ваш запрос отправлен. Менеджер скоро свяжется с вами.", show_alert=True)
+        await notifier.notify(manager_text)
     except Exception as e:
-        logger.error(f"Failed to send contact request: {e}")
+        logger.error(f"Failed to queue contact request: {e}")
+        await callback.answer("Не удалось отправить запрос. Попробуйте позже.", show_alert=True)
+        return
+    await callback.answer("Ваш запрос отправлен. Менеджер скоро свяжется с вами.", show_alert=True)
 
-        await callback.answer("Не удалось отправить запрос. Попробуйте позже.", show_alert=True) 
@@ -0,0 +1,108 @@
+import sqlite3
+import logging
+import threading
+import time
+import ujson
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = 'http_cache.db'
+
+
+@dataclass
+class CacheEntry:
+    """Закэшированный ответ: валидаторы, хэш тела и уже разобранный результат."""
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body_hash: str
+    parsed: Any
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Заголовки для условного GET."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    Дисковый кэш ответов в SQLite, ключ - URL.
+    Хранит результат разбора страницы, чтобы при 304 или неизменном теле
+    не разбирать HTML повторно. Размер ограничен, вытесняются давно
+    не использованные записи.
+    Методы можно вызывать из разных потоков (парсер вызывает их через asyncio.to_thread).
+    """
+
+    def __init__(self, path: str = CACHE_FILE, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # Потеря кэша безопасна, поэтому не платим за fsync на каждую запись
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT NOT NULL,
+                parsed TEXT NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self.conn.commit()
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        """Возвращает запись кэша для URL или None."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified, body_hash, parsed FROM responses WHERE url = ?",
+                (url,)
+            ).fetchone()
+            if not row:
+                return None
+            etag, last_modified, body_hash, parsed = row
+            return CacheEntry(url, etag, last_modified, body_hash, ujson.loads(parsed))
+
+    def touch(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Отмечает использование записи и обновляет валидаторы, если сервер прислал новые."""
+        with self._lock:
+            self.conn.execute(
+                """
+                UPDATE responses
+                SET accessed_at = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified)
+                WHERE url = ?
+                """,
+                (time.time(), etag, last_modified, url)
+            )
+            self.conn.commit()
+
+    def store(self, url: str, etag: Optional[str], last_modified: Optional[str], body_hash: str, parsed: Any):
+        """Сохраняет результат разбора страницы и вытесняет лишние записи."""
+        with self._lock:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO responses (url, etag, last_modified, body_hash, parsed, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (url, etag, last_modified, body_hash, ujson.dumps(parsed, ensure_ascii=False), time.time())
+            )
+            self.conn.execute(
+                """
+                DELETE FROM responses WHERE url IN (
+                    SELECT url FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
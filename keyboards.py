@@ -1,9 +1,7 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from config import config
-from typing import List
-
-from database import get_all_categories
+from typing import List, Tuple
 
 def get_main_keyboard() -> InlineKeyboardMarkup:
     """
@@ -58,18 +56,34 @@ def get_main_menu_keyboard() -> InlineKeyboardMarkup:
 
 # --- Категории товаров ---
 
-def get_categories_keyboard() -> InlineKeyboardMarkup:
-    """Создает клавиатуру со списком категорий товаров."""
-    categories = get_all_categories()
+def _add_page_navigation(builder: InlineKeyboardBuilder, page: dict, prefix: str) -> int:
+    """
+    Добавляет кнопки «назад/вперед» по страницам. Курсор в callback_data -
+    id первой или последней строки страницы. Возвращает число добавленных кнопок.
+    """
+    items = page['items']
+    buttons = 0
+    if page['has_prev'] and items:
+        builder.button(text="◀️", callback_data=f"{prefix}_p_{items[0][0]}")
+        buttons += 1
+    if page['has_next'] and items:
+        builder.button(text="▶️", callback_data=f"{prefix}_n_{items[-1][0]}")
+        buttons += 1
+    return buttons
+
+def get_categories_keyboard(page: dict) -> InlineKeyboardMarkup:
+    """Создает клавиатуру с одной страницей списка категорий товаров."""
     builder = InlineKeyboardBuilder()
+    categories = page['items']
 
     for category_id, name in categories:
         builder.button(text=name, callback_data=f"category_{category_id}")
-    
+    navigation = _add_page_navigation(builder, page, "categories")
     builder.button(text="« Назад", callback_data="main_menu")
-    
-    # Распределяем кнопки по 2 в ряд, последняя ('Назад') будет в своем ряду
-    builder.adjust(*([2] * (len(categories) // 2)), 1)
+
+    # Категории по 2 в ряд, затем ряд навигации и 'Назад' в своем ряду
+    rows = [2] * (len(categories) // 2) + [1] * (len(categories) % 2)
+    builder.adjust(*rows, *([navigation] if navigation else []), 1)
     return builder.as_markup()
 
 # --- Детали категории ---
@@ -78,11 +92,85 @@ def get_category_details_keyboard(category_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для страницы с деталями категории."""
     builder = InlineKeyboardBuilder()
     builder.button(text="🧮 Посчитать стоимость", callback_data=f"calculate_{category_id}")
+    builder.button(text="📋 Предложения поставщиков", callback_data=f"prices_{category_id}")
+    builder.button(text="🏆 Лучшие предложения", callback_data=f"top_{category_id}_0_")
+    builder.button(text="📈 Динамика цен", callback_data=f"history_{category_id}_30")
     builder.button(text="« Назад к товарам", callback_data="show_categories")
     builder.button(text="📞 Связь с менеджером", callback_data="contact_manager")
     builder.adjust(1)
     return builder.as_markup()
 
+# --- Предложения категории ---
+
+def get_prices_keyboard(category_id: int, page: dict) -> InlineKeyboardMarkup:
+    """Клавиатура страницы предложений категории."""
+    builder = InlineKeyboardBuilder()
+    navigation = _add_page_navigation(builder, page, f"prices_{category_id}")
+    builder.button(text="« Назад к категории", callback_data=f"category_{category_id}")
+    builder.adjust(*([navigation] if navigation else []), 1)
+    return builder.as_markup()
+
+# --- Лучшие предложения ---
+
+# Сколько городов и размеров показывать кнопками (остальные - через список предложений);
+# вместе с остальными кнопками это держит клавиатуру в лимите Telegram (100 кнопок)
+TOP_CITY_BUTTONS = 15
+TOP_SIZE_BUTTONS = 12
+
+def _add_choice_row(builder: InlineKeyboardBuilder, options: List[Tuple], selected, prefix: str, suffix: str = '') -> int:
+    """Кнопки выбора одного значения (выбранное отмечено точками). Возвращает число кнопок."""
+    for value, label in options:
+        text = f"• {label} •" if value == selected else label
+        builder.button(text=text, callback_data=f"{prefix}{value}{suffix}")
+    return len(options)
+
+def _capped(options: List[Tuple], selected, limit: int) -> List[Tuple]:
+    """Первые limit вариантов; выбранный вариант остается, даже если в них не попал."""
+    shown = options[:limit]
+    shown += [option for option in options[limit:] if option[0] == selected]
+    return shown
+
+def get_top_offers_keyboard(category_id: int, comparison: dict, city_id: int, size: str) -> InlineKeyboardMarkup:
+    """Клавиатура лучших предложений: отбор по городу и по размеру."""
+    builder = InlineKeyboardBuilder()
+    widths = []
+    if comparison['cities']:
+        cities = [(0, "Все города"), *_capped(comparison['cities'], city_id, TOP_CITY_BUTTONS)]
+        count = _add_choice_row(builder, cities, city_id, f"top_{category_id}_", f"_{size}")
+        widths += [3] * (count // 3) + [count % 3] * bool(count % 3)
+    if comparison['sizes']:
+        sizes = [('', "Все размеры"), *_capped([(value, value) for value in comparison['sizes']], size, TOP_SIZE_BUTTONS)]
+        count = _add_choice_row(builder, sizes, size, f"top_{category_id}_{city_id}_")
+        widths += [4] * (count // 4) + [count % 4] * bool(count % 4)
+    builder.button(text="« Назад к категории", callback_data=f"category_{category_id}")
+    builder.adjust(*widths, 1)
+    return builder.as_markup()
+
+# --- Поиск ---
+
+def get_search_results_keyboard(categories: List[Tuple[int, str]]) -> InlineKeyboardMarkup:
+    """Клавиатура с категориями, в которых нашлись позиции."""
+    builder = InlineKeyboardBuilder()
+    for category_id, name in categories:
+        builder.button(text=name, callback_data=f"category_{category_id}")
+    builder.button(text="« Главное меню", callback_data="main_menu")
+    builder.adjust(1)
+    return builder.as_markup()
+
+# --- История цен ---
+
+HISTORY_PERIODS = (7, 30, 90)
+
+def get_price_history_keyboard(category_id: int, days: int) -> InlineKeyboardMarkup:
+    """Клавиатура выбора периода истории цен."""
+    builder = InlineKeyboardBuilder()
+    for period in HISTORY_PERIODS:
+        label = f"• {period} дн. •" if period == days else f"{period} дн."
+        builder.button(text=label, callback_data=f"history_{category_id}_{period}")
+    builder.button(text="« Назад к категории", callback_data=f"category_{category_id}")
+    builder.adjust(len(HISTORY_PERIODS), 1)
+    return builder.as_markup()
+
 # --- Калькулятор ---
 
 def get_calculator_keyboard() -> InlineKeyboardMarkup:
@@ -0,0 +1,370 @@
+"""
+Встроенные метрики: счетчики и гистограммы с метками, замеры времени (span)
+и экспорт в текстовом формате Prometheus или в JSON-файл.
+
+    with metrics.span('publish_generation'):
+        ...
+
+    @metrics.span('fetch_page')
+    async def fetch_page(...): ...
+
+Модуль не зависит от конфигурации и безопасен для вызова из потоков
+(запись в БД идет через asyncio.to_thread).
+"""
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм: время (сек), размер ответа (байт), строк в категории
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+DELAY_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+# Цепочка вложенных замеров текущей задачи (для отладочного лога)
+_span_path: ContextVar[Tuple[str, ...]] = ContextVar('span_path', default=())
+
+
+def _label_key(names: Tuple[str, ...], labels: Dict[str, object]) -> Tuple[str, ...]:
+    if set(labels) != set(names):
+        raise ValueError(f"Expected labels {names}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in names)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонно растущий счетчик."""
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self.values.get(_label_key(self.labels, labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self.values.items())
+        if not items and not self.labels:
+            items = [((), 0)]
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            items = sorted(self.values.items())
+        return {
+            'type': self.kind,
+            'help': self.help,
+            'samples': [{'labels': dict(zip(self.labels, key)), 'value': value} for key, value in items],
+        }
+
+
+class Histogram:
+    """Распределение значений по корзинам с суммой и числом наблюдений."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: [счетчики по корзинам (без накопления) + корзина +Inf, сумма, число]
+        self.values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labels, labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self.values.get(_label_key(self.labels, labels))
+        return state[2] if state else 0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Оценка квантиля по корзинам (линейно внутри корзины), None без наблюдений."""
+        state = self.values.get(_label_key(self.labels, labels))
+        return self._quantile(state, q) if state else None
+
+    def _quantile(self, state: list, q: float) -> float:
+        counts, _, total = state
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            if count and seen + count >= rank:
+                if bound == float('inf'):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return lower
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self.values.items())
+        lines = []
+        for key, (counts, total_sum, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {total}")
+        return lines
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self.values.items())
+        samples = []
+        for key, state in items:
+            counts, total_sum, total = state
+            samples.append({
+                'labels': dict(zip(self.labels, key)),
+                'count': total,
+                'sum': total_sum,
+                'mean': total_sum / total if total else 0.0,
+                'p50': self._quantile(state, 0.5),
+                'p95': self._quantile(state, 0.95),
+                'p99': self._quantile(state, 0.99),
+                'buckets': {_format_value(bound): count for bound, count in zip(self.buckets + (float('inf'),), counts)},
+            })
+        return {'type': self.kind, 'help': self.help, 'samples': samples}
+
+
+# Сборщик текущего состояния: возвращает список (имя, описание, {метки}, значение) - gauge
+Collector = Callable[[], List[Tuple[str, str, Dict[str, str], float]]]
+
+
+class Registry:
+    """Набор метрик процесса и сборщиков мгновенных значений (gauge)."""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.collectors: Dict[str, Collector] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labels)
+
+    def histogram(
+        self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = TIME_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labels, buckets)
+
+    def register_collector(self, name: str, collector: Collector):
+        """Регистрирует (или заменяет) сборщик под именем name."""
+        self.collectors[name] = collector
+
+    def unregister_collector(self, name: str, collector: Optional[Collector] = None):
+        """Удаляет сборщик; если передан collector - только если зарегистрирован именно он."""
+        if collector is None or self.collectors.get(name) == collector:
+            self.collectors.pop(name, None)
+
+    def _gauges(self) -> Dict[str, Tuple[str, list]]:
+        gauges: Dict[str, Tuple[str, list]] = {}
+        for source, collector in list(self.collectors.items()):
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector {source} failed: {e}")
+                continue
+            for name, help, labels, value in samples:
+                gauges.setdefault(name, (help, []))[1].append((labels, value))
+        return gauges
+
+    def render_prometheus(self) -> str:
+        """Все метрики в текстовом формате Prometheus (exposition format 0.0.4)."""
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render())
+        for name, (help, samples) in sorted(self._gauges().items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels.keys(), map(str, labels.values()))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def as_dict(self) -> dict:
+        result = {name: metric.as_dict() for name, metric in sorted(self.metrics.items())}
+        for name, (help, samples) in sorted(self._gauges().items()):
+            result[name] = {
+                'type': 'gauge',
+                'help': help,
+                'samples': [{'labels': labels, 'value': value} for labels, value in samples],
+            }
+        return result
+
+    def dump_json(self, path: str):
+        """Записывает снимок всех метрик в JSON-файл (атомарно, через временный файл)."""
+        target = Path(path)
+        tmp = target.with_name(target.name + '.tmp')
+        tmp.write_text(
+            json.dumps({'timestamp': time.time(), 'metrics': self.as_dict()}, ensure_ascii=False, indent=2),
+            encoding='utf-8',
+        )
+        tmp.replace(target)
+
+    def reset(self):
+        """Обнуляет все метрики (для бенчмарков)."""
+        for metric in self.metrics.values():
+            with metric._lock:
+                metric.values.clear()
+
+
+registry = Registry()
+
+# Парсер
+FETCH_SECONDS = registry.histogram(
+    'crawler_fetch_seconds', 'HTTP request latency per attempt', ('status',)
+)
+FETCH_BYTES = registry.counter('crawler_fetch_bytes_total', 'Response body bytes received')
+FETCH_RESPONSE_BYTES = registry.histogram(
+    'crawler_response_bytes', 'Response body size', buckets=SIZE_BUCKETS
+)
+FETCH_RETRIES = registry.counter('crawler_fetch_retries_total', 'Retried fetch attempts', ('reason',))
+FETCH_FAILURES = registry.counter('crawler_fetch_failures_total', 'Pages not fetched after all attempts')
+PARSE_SECONDS = registry.histogram('crawler_parse_seconds', 'Category page parse time', ('engine',))
+CATEGORY_ROWS = registry.histogram(
+    'crawler_category_rows', 'Price rows per parsed category', buckets=COUNT_BUCKETS
+)
+# Бот
+HANDLER_SECONDS = registry.histogram(
+    'bot_handler_seconds', 'Bot handler latency', ('handler', 'outcome')
+)
+WEBHOOK_UPDATES = registry.counter('bot_webhook_updates_total', 'Webhook requests by outcome', ('outcome',))
+UPDATE_SECONDS = registry.histogram('bot_update_seconds', 'Time from webhook receipt to handler completion')
+NOTIFICATIONS = registry.counter('bot_notifications_total', 'Manager notifications by outcome', ('outcome',))
+NOTIFY_DELAY_SECONDS = registry.histogram(
+    'bot_notification_delay_seconds', 'Time from queueing a manager notification to its delivery',
+    buckets=DELAY_BUCKETS
+)
+# Прочие замеры (запись в БД, публикация поколения и т.п.)
+SPAN_SECONDS = registry.histogram('span_seconds', 'Duration of instrumented code spans', ('span', 'outcome'))
+
+
+class span:
+    """
+    Замер времени участка кода: контекстный менеджер или декоратор (синхронных
+    и асинхронных функций). Время попадает в histogram (по умолчанию span_seconds
+    с меткой span=name) с меткой outcome ok/error; labels - остальные метки гистограммы.
+    """
+
+    def __init__(self, name: str, histogram: Optional[Histogram] = None, **labels):
+        self.name = name
+        self._args = (histogram, labels)
+        self.histogram = histogram or SPAN_SECONDS
+        self.labels = labels if histogram else {'span': name, **labels}
+        self._started: List[Tuple[float, object]] = []
+
+    def __enter__(self):
+        token = _span_path.set(_span_path.get() + (self.name,))
+        self._started.append((time.perf_counter(), token))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        started, token = self._started.pop()
+        elapsed = time.perf_counter() - started
+        path = _span_path.get()
+        _span_path.reset(token)
+        self.histogram.observe(elapsed, outcome='error' if exc_type else 'ok', **self.labels)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"span {' > '.join(path)}: {elapsed * 1000:.1f} ms")
+        return False
+
+    def __call__(self, func):
+        histogram, labels = self._args
+        # Каждый вызов - свой экземпляр: вызовы одной функции идут параллельно в разных задачах
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(self.name, histogram, **labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(self.name, histogram, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+async def start_http_server(host: str, port: int):
+    """
+    Запускает HTTP-сервер метрик: /metrics (Prometheus) и /metrics.json.
+    Возвращает web.AppRunner; остановка - await runner.cleanup().
+    """
+    from aiohttp import web
+
+    async def prometheus(request):
+        return web.Response(
+            text=registry.render_prometheus(),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+        )
+
+    async def as_json(request):
+        return web.json_response(registry.as_dict())
+
+    app = web.Application()
+    app.router.add_get('/metrics', prometheus)
+    app.router.add_get('/metrics.json', as_json)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
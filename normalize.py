@@ -0,0 +1,58 @@
+import re
+from typing import List, Optional
+
+# Число с пробелами-разделителями тысяч ("51 000") или без них, с дробной частью через точку или запятую
+_NUMBER = re.compile(r'\d{1,3}(?:\s\d{3})+(?:[.,]\d+)?|\d+(?:[.,]\d+)?')
+
+
+def parse_price(text: Optional[str]) -> Optional[float]:
+    """
+    Приводит цену с сайта к числу.
+    "51 000" -> 51000.0, "1 200,50" -> 1200.5, "50 000 - 55 000" -> 50000.0
+    (для диапазона берется нижняя граница), "договорная" -> None.
+    """
+    if not text:
+        return None
+    match = _NUMBER.search(text.replace('\xa0', ' '))
+    if not match:
+        return None
+    value = float(re.sub(r'\s', '', match.group()).replace(',', '.'))
+    return value if value > 0 else None
+
+
+# Разделитель размеров между числами: "57x3.5", "57 х 3,5" (кириллическая "х"), "57*3.5"
+_DIMENSION_SEPARATOR = re.compile(r'(\d)\s*[xх×*]\s*(?=\d)')
+_DECIMAL_COMMA = re.compile(r'(\d),(?=\d)')
+# Точка, не стоящая внутри числа
+_STRAY_DOT = re.compile(r'(?<!\d)\.|\.(?!\d)')
+_TOKEN = re.compile(r'[\w.]+')
+# Окончания, которые отбрасываются, чтобы "трубы" и "труба" находили друг друга
+_WORD_ENDINGS = 'аеиоуыэюяйь'
+
+
+def search_text(*parts: Optional[str]) -> str:
+    """
+    Нормализует текст для поискового индекса и запросов:
+    нижний регистр, "ё" -> "е", размеры "57х3,5" -> "57 3.5".
+    """
+    text = ' '.join(part for part in parts if part).lower().replace('ё', 'е')
+    text = _DECIMAL_COMMA.sub(r'\1.', text)
+    text = _DIMENSION_SEPARATOR.sub(r'\1 ', text)
+    text = _STRAY_DOT.sub(' ', text)
+    return ' '.join(_TOKEN.findall(text))
+
+
+def search_query(text: str) -> List[str]:
+    """
+    Превращает пользовательский запрос в термы FTS5: числа ищутся точно,
+    слова - как префикс (длинные - по основе, без окончания).
+    """
+    terms = []
+    for token in search_text(text).split():
+        if token.replace('.', '').isdigit():
+            terms.append(f'"{token}"')
+        else:
+            if len(token) > 3:
+                token = token.rstrip(_WORD_ENDINGS) or token
+            terms.append(f'"{token}"*')
+    return terms
@@ -0,0 +1,289 @@
+"""
+Очередь исходящих уведомлений менеджерам (заявки, запросы на связь).
+
+Обработчик только записывает уведомление в спул (таблица SQLite) и сразу
+отвечает пользователю; отправляет фоновая задача - своя на каждый чат,
+не чаще rate_per_minute сообщений в минуту (корзина токенов), с паузой по
+RetryAfter и повторами при сетевых ошибках. Если уведомлений накопилось
+несколько, они уходят одним сообщением-дайджестом (до digest_max штук).
+Строка удаляется из спула только после успешной отправки, поэтому
+неотправленное переживает падение и перезапуск бота (при падении между
+отправкой и удалением уведомление может прийти повторно).
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+import metrics
+from config import config
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Предельная длина текста сообщения Telegram
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n— — —\n\n"
+# Пауза перед повтором после сетевой ошибки или ошибки сервера Telegram (сек, удваивается)
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 300.0
+
+
+class ManagerNotifier:
+    """
+    Спул и отправка уведомлений. notify() можно вызывать до start(): уведомления
+    копятся в спуле и уходят, когда появится бот.
+    digest_window > 0 - сколько секунд ждать попутных уведомлений перед отправкой первого.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        chat_id=None,
+        rate_per_minute: float = 20,
+        burst: int = 3,
+        digest_max: int = 10,
+        digest_window: float = 0.0,
+    ):
+        self.path = path
+        self.chat_id = chat_id
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.digest_max = max(1, digest_max)
+        self.digest_window = digest_window
+        self.bot: Optional[Bot] = None
+        self.sent = 0
+        self.failed = 0
+        # Чат -> число уведомлений в спуле, ожидающих отправки
+        self.queued: Dict[str, int] = {}
+        self._senders: Dict[str, asyncio.Task] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        # Чат -> уведомления из отклоненного дайджеста: пока они не разобраны, отправка идет по одному
+        self._suspects: Dict[str, Set[int]] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        metrics.registry.register_collector('notifier', self.metrics)
+
+    # ---------------- Спул -----------------
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA busy_timeout = 5000")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS notifications (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_notifications_pending ON notifications(chat_id, failed, id)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params=()) -> List[tuple]:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(sql, params).fetchall()
+
+    def _insert(self, chat_id: str, text: str) -> None:
+        self._execute(
+            "INSERT INTO notifications (chat_id, text, created_at) VALUES (?, ?, ?)",
+            (chat_id, text, time.time())
+        )
+
+    def _next_batch(self, chat_id: str, limit: int) -> List[Tuple[int, str, float, int]]:
+        """Самые старые неотправленные уведомления чата, которые помещаются в одно сообщение."""
+        rows = self._execute(
+            "SELECT id, text, created_at, attempts FROM notifications "
+            "WHERE chat_id = ? AND failed = 0 ORDER BY id LIMIT ?",
+            (chat_id, limit)
+        )
+        batch, length = [], len(self._digest_header(len(rows)))
+        for row in rows:
+            length += len(row[1]) + len(DIGEST_SEPARATOR)
+            if batch and length > MESSAGE_LIMIT:
+                break
+            batch.append(row)
+        return batch
+
+    def _delete(self, ids: List[int]) -> None:
+        self._execute(f"DELETE FROM notifications WHERE id IN ({','.join('?' * len(ids))})", ids)
+
+    def _record_error(self, ids: List[int], error: str, failed: bool) -> None:
+        self._execute(
+            f"UPDATE notifications SET attempts = attempts + 1, last_error = ?, failed = ? "
+            f"WHERE id IN ({','.join('?' * len(ids))})",
+            (error, int(failed), *ids)
+        )
+
+    def _pending_counts(self) -> Dict[str, int]:
+        return dict(self._execute("SELECT chat_id, COUNT(*) FROM notifications WHERE failed = 0 GROUP BY chat_id"))
+
+    # ---------------- Публичный интерфейс -----------------
+
+    async def notify(self, text: str, chat_id=None) -> None:
+        """Ставит уведомление в очередь (по умолчанию в чат менеджеров). Возвращается после записи в спул."""
+        chat = str(chat_id if chat_id is not None else self.chat_id)
+        await asyncio.to_thread(self._insert, chat, text)
+        self.queued[chat] = self.queued.get(chat, 0) + 1
+        metrics.NOTIFICATIONS.inc(outcome='queued')
+        if self.bot:
+            self._wake(chat)
+
+    async def start(self, bot: Bot):
+        """Запускает отправку, в том числе уведомлений, оставшихся в спуле с прошлого запуска."""
+        self.bot = bot
+        self.queued = await asyncio.to_thread(self._pending_counts)
+        leftover = sum(self.queued.values())
+        if leftover:
+            logger.info(f"Notification spool: {leftover} unsent notification(s) from the previous run")
+        for chat in self.queued:
+            self._wake(chat)
+
+    async def stop(self, timeout: float = 5.0):
+        """Останавливает отправку: дает отправителям до timeout секунд дослать то, что позволяет лимит; остальное ждет в спуле."""
+        senders = list(self._senders.values())
+        if senders:
+            _, pending = await asyncio.wait(senders, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._senders.clear()
+        self.bot = None
+        left = sum(self.queued.values())
+        if left:
+            logger.info(f"Notification spool: {left} notification(s) left for the next start")
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def metrics(self):
+        return [
+            ('bot_notifications_queued', 'Manager notifications waiting in the spool', {'chat': chat}, count)
+            for chat, count in self.queued.items()
+        ]
+
+    # ---------------- Отправка -----------------
+
+    def _wake(self, chat: str):
+        self._wakeups.setdefault(chat, asyncio.Event()).set()
+        task = self._senders.get(chat)
+        if task is None or task.done():
+            self._senders[chat] = asyncio.create_task(self._send_loop(chat), name=f'notify-{chat}')
+
+    @staticmethod
+    def _digest_header(count: int) -> str:
+        return f"<b>📬 Уведомлений: {count}</b>{DIGEST_SEPARATOR}" if count > 1 else ""
+
+    async def _send_loop(self, chat: str):
+        """Отправляет уведомления чата, пока спул не опустеет; после непредвиденной ошибки - повторяет с паузой."""
+        backoff = RETRY_BACKOFF_BASE
+        while True:
+            try:
+                return await self._send_pending(chat)
+            except Exception:
+                logger.exception(f"Notification sender for {chat} failed, restarting in {backoff:.0f}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+
+    async def _send_pending(self, chat: str):
+        bucket = self._buckets.setdefault(chat, TokenBucket(self.rate_per_minute / 60, capacity=self.burst))
+        wakeup = self._wakeups[chat]
+        suspects = self._suspects.setdefault(chat, set())
+        backoff = RETRY_BACKOFF_BASE
+        while True:
+            limit = 1 if suspects else self.digest_max
+            wakeup.clear()
+            batch = await asyncio.to_thread(self._next_batch, chat, limit)
+            if not batch:
+                if wakeup.is_set():
+                    # Уведомление пришло, пока читали спул
+                    continue
+                # Новые уведомления перезапустят отправителя через _wake
+                return
+            if suspects and batch[0][0] > max(suspects):
+                # Подозрительных уведомлений в спуле уже нет (например, удалены вручную)
+                suspects.clear()
+                continue
+            if self.digest_window > 0 and len(batch) < limit:
+                wait = batch[0][2] + self.digest_window - time.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+            await bucket.acquire()
+            # Пока ждали токен, могли подойти еще уведомления - они уйдут тем же сообщением
+            if wakeup.is_set() and len(batch) < limit:
+                batch = await asyncio.to_thread(self._next_batch, chat, limit)
+
+            ids = [row[0] for row in batch]
+            text = self._digest_header(len(batch)) + DIGEST_SEPARATOR.join(row[1] for row in batch)
+            try:
+                await self.bot.send_message(chat, text)
+            except TelegramRetryAfter as e:
+                logger.warning(f"Notification chat {chat} is flood-limited, retrying in {e.retry_after}s")
+                metrics.NOTIFICATIONS.inc(len(batch), outcome='retry_after')
+                await asyncio.sleep(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.warning(f"Failed to send {len(batch)} notification(s) to {chat}, retrying in {backoff:.0f}s: {e}")
+                metrics.NOTIFICATIONS.inc(len(batch), outcome='retry')
+                await asyncio.to_thread(self._record_error, ids, str(e), False)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+                continue
+            except TelegramAPIError as e:
+                if len(batch) > 1:
+                    # Отклонен дайджест - выясняем, какое уведомление виновато, отправляя по одному
+                    logger.warning(f"Notification digest rejected by {chat}, sending one by one: {e}")
+                    suspects.update(ids)
+                    continue
+                logger.error(f"Notification {ids[0]} to {chat} rejected, kept in the spool as failed: {e}")
+                metrics.NOTIFICATIONS.inc(outcome='failed')
+                await asyncio.to_thread(self._record_error, ids, str(e), True)
+                suspects.difference_update(ids)
+                self.failed += 1
+                self.queued[chat] = max(0, self.queued.get(chat, 0) - 1)
+                continue
+
+            await asyncio.to_thread(self._delete, ids)
+            now = time.time()
+            for row in batch:
+                metrics.NOTIFY_DELAY_SECONDS.observe(now - row[2])
+            metrics.NOTIFICATIONS.inc(len(batch), outcome='sent')
+            self.sent += len(batch)
+            self.queued[chat] = max(0, self.queued.get(chat, 0) - len(batch))
+            suspects.difference_update(ids)
+            backoff = RETRY_BACKOFF_BASE
+
+
+notifier = ManagerNotifier(
+    path=config.NOTIFY_SPOOL_FILE,
+    chat_id=config.MANAGER_CHANNEL_ID,
+    rate_per_minute=config.NOTIFY_RATE_PER_MINUTE,
+    burst=config.NOTIFY_BURST,
+    digest_max=config.NOTIFY_DIGEST_MAX,
+    digest_window=config.NOTIFY_DIGEST_WINDOW,
+)
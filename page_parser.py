@@ -0,0 +1,232 @@
+# Разбор HTML-страниц сайта. Функции модуля не зависят от сессий и настроек
+# парсера и возвращают простые dict, поэтому их можно выполнять в отдельных процессах.
+import logging
+from typing import List, Dict
+
+from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
+
+logger = logging.getLogger(__name__)
+
+
+def parse_category_links(html: str) -> List[Dict[str, str]]:
+    """Парсит ссылки на категории из левого контейнера главной страницы."""
+    soup = BeautifulSoup(html, 'lxml')
+    left_container = soup.find('nav', id='left-container')
+    if not left_container:
+        logger.error("Left container not found on main page.")
+        return []
+
+    categories = []
+    for link in left_container.select('ul.tabs a[data-naimenovanie]'):
+        name = link.text.strip()
+        href = link.get('href')
+        if name and href:
+            categories.append({'name': name, 'url': href})
+    return categories
+
+
+def parse_center_container(soup: BeautifulSoup) -> Dict:
+    """Парсит центральный контейнер для получения фильтров и размеров."""
+    center_container = soup.find('nav', id='center-container')
+    if not center_container:
+        return {}
+
+    data = {}
+    panes = center_container.find_all('div', class_='pane')
+    for pane in panes:
+        group_name = pane.find_previous_sibling('h2')
+        if group_name:
+            group_name = group_name.text.strip()
+        else:
+            group_name = "default"
+
+        sizes = [a.text.strip() for a in pane.find_all('a') if a.text.strip()]
+        data[group_name] = sizes
+    return data
+
+
+def parse_price_table(soup: BeautifulSoup) -> List[Dict]:
+    """Парсит таблицу с ценами из правого контейнера."""
+    price_table = soup.find('table', id='table-price')
+    if not price_table or not price_table.find('tbody'):
+        return []
+
+    prices = []
+    for row in price_table.tbody.find_all('tr'):
+        columns = row.find_all('td')
+        if not columns or 'tp-tr-hidden' in row.get('class', []):
+            continue
+
+        # Структура таблицы может меняться, поэтому парсим более гибко
+        firm_dop_opener = columns[-1].find('span', class_='firm_dop_opener')
+        if firm_dop_opener:
+            supplier_info = columns[-2]
+        else:
+            supplier_info = columns[-1]
+
+
+        supplier = supplier_info.find('a', class_='firm_link')
+        phone = supplier_info.find('a', class_='tel_link')
+
+        price_data = {
+            'position': columns[0].text.strip() if len(columns) > 0 else '',
+            'spec': columns[1].text.strip() if len(columns) > 1 else '',
+            'dimensions': columns[2].text.strip() if len(columns) > 2 else '',
+            'price_per_ton': columns[3].text.strip().replace('\xa0', '') if len(columns) > 3 else '',
+            'price_per_item': columns[4].text.strip().replace('\xa0', '') if len(columns) > 4 else '',
+            'supplier': supplier.text.strip() if supplier else '',
+            'phone': phone.text.strip() if phone else '',
+            'city': columns[-3].text.strip() if len(columns) > 5 else ''
+        }
+        prices.append(price_data)
+    return prices
+
+
+def parse_category_html(html: str, category: Dict[str, str]) -> Dict:
+    """Разбирает HTML страницы категории."""
+    soup = BeautifulSoup(html, 'lxml')
+    h1 = soup.find('h1', class_='price-h1')
+
+    return {
+        'category_name': h1.text.strip() if h1 else category['name'],
+        'url': category['url'],
+        'filters': parse_center_container(soup),
+        'prices': parse_price_table(soup)
+    }
+
+
+# --- Быстрый разбор через lxml ---
+# Дерево строится один раз, все выборки - заранее скомпилированные XPath.
+# Результат полностью совпадает с parse_category_html.
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+_XPATH_H1 = etree.XPath(f"(//h1[{_has_class('price-h1')}])[1]")
+_XPATH_CENTER = etree.XPath("(//nav[@id='center-container'])[1]")
+_XPATH_PANES = etree.XPath(f".//div[{_has_class('pane')}]")
+_XPATH_PANE_TITLE = etree.XPath("preceding-sibling::h2[1]")
+_XPATH_LINKS = etree.XPath(".//a")
+_XPATH_PRICE_TBODY = etree.XPath("(//table[@id='table-price'])[1]//tbody[1]")
+_XPATH_ROWS = etree.XPath(".//tr")
+_XPATH_CELLS = etree.XPath(".//td")
+_XPATH_DOP_OPENER = etree.XPath(f".//span[{_has_class('firm_dop_opener')}]")
+_XPATH_FIRM = etree.XPath(f"(.//a[{_has_class('firm_link')}])[1]")
+_XPATH_PHONE = etree.XPath(f"(.//a[{_has_class('tel_link')}])[1]")
+
+
+def _text(element) -> str:
+    return element.text_content().strip()
+
+
+def _first_text(xpath: etree.XPath, element) -> str:
+    found = xpath(element)
+    return _text(found[0]) if found else ''
+
+
+def _build_tree(html: str):
+    try:
+        return lxml_html.document_fromstring(html)
+    except ValueError:
+        # lxml не принимает str с объявлением кодировки - отдаем байты
+        return lxml_html.document_fromstring(html.encode('utf-8'))
+
+
+def parse_center_container_lxml(tree) -> Dict:
+    """То же, что parse_center_container, но по дереву lxml."""
+    center = _XPATH_CENTER(tree)
+    if not center:
+        return {}
+
+    data = {}
+    for pane in _XPATH_PANES(center[0]):
+        title = _XPATH_PANE_TITLE(pane)
+        group_name = _text(title[0]) if title else "default"
+        sizes = [text for text in (_text(a) for a in _XPATH_LINKS(pane)) if text]
+        data[group_name] = sizes
+    return data
+
+
+def parse_price_table_lxml(tree) -> List[Dict]:
+    """То же, что parse_price_table, но по дереву lxml."""
+    tbody = _XPATH_PRICE_TBODY(tree)
+    if not tbody:
+        return []
+
+    prices = []
+    for row in _XPATH_ROWS(tbody[0]):
+        columns = _XPATH_CELLS(row)
+        if not columns or 'tp-tr-hidden' in row.get('class', '').split():
+            continue
+
+        texts = [_text(column) for column in columns]
+        supplier_info = columns[-2] if _XPATH_DOP_OPENER(columns[-1]) else columns[-1]
+        count = len(texts)
+        prices.append({
+            'position': texts[0],
+            'spec': texts[1] if count > 1 else '',
+            'dimensions': texts[2] if count > 2 else '',
+            'price_per_ton': texts[3].replace('\xa0', '') if count > 3 else '',
+            'price_per_item': texts[4].replace('\xa0', '') if count > 4 else '',
+            'supplier': _first_text(_XPATH_FIRM, supplier_info),
+            'phone': _first_text(_XPATH_PHONE, supplier_info),
+            'city': texts[-3] if count > 5 else ''
+        })
+    return prices
+
+
+def parse_category_html_lxml(html: str, category: Dict[str, str]) -> Dict:
+    """Быстрый разбор страницы категории через lxml; при ошибке - через BeautifulSoup."""
+    try:
+        tree = _build_tree(html)
+        h1 = _XPATH_H1(tree)
+        return {
+            'category_name': _text(h1[0]) if h1 else category['name'],
+            'url': category['url'],
+            'filters': parse_center_container_lxml(tree),
+            'prices': parse_price_table_lxml(tree)
+        }
+    except (etree.LxmlError, ValueError) as e:
+        logger.warning(f"lxml engine failed on {category['url']}: {e}. Falling back to BeautifulSoup.")
+        return parse_category_html(html, category)
+
+
+ENGINES = {
+    'bs4': parse_category_html,
+    'lxml': parse_category_html_lxml,
+}
+
+
+def compare_engines(html: str, category: Dict[str, str]) -> List[str]:
+    """Разбирает страницу обоими движками и возвращает список расхождений (пустой, если их нет)."""
+    expected = parse_category_html(html, category)
+    actual = parse_category_html_lxml(html, category)
+    differences = []
+    for key in ('category_name', 'url', 'filters'):
+        if expected[key] != actual[key]:
+            differences.append(f"{key}: bs4={expected[key]!r} lxml={actual[key]!r}")
+    if len(expected['prices']) != len(actual['prices']):
+        differences.append(f"prices: bs4 has {len(expected['prices'])} rows, lxml has {len(actual['prices'])}")
+    for index, (row_bs4, row_lxml) in enumerate(zip(expected['prices'], actual['prices'])):
+        if row_bs4 != row_lxml:
+            differences.append(f"prices[{index}]: bs4={row_bs4!r} lxml={row_lxml!r}")
+    return differences
+
+
+if __name__ == '__main__':
+    # Проверка совпадения движков на сохраненных страницах:
+    # python page_parser.py page1.html page2.html ...
+    import sys
+
+    failed = False
+    for path in sys.argv[1:]:
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            page = f.read()
+        differences = compare_engines(page, {'name': path, 'url': path})
+        print(f"{path}: {'OK' if not differences else f'{len(differences)} difference(s)'}")
+        for difference in differences:
+            print(f"  {difference}")
+        failed = failed or bool(differences)
+    sys.exit(1 if failed else 0)
@@ -1,32 +1,178 @@
+import argparse
 import asyncio
-import random
+import hashlib
 import logging
+import sqlite3
+import time
 import ujson
-from asyncio import Semaphore
-from typing import List, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Any, List, Dict, Optional
+from urllib.parse import urlsplit
 
 import aiohttp
 from aiohttp_proxy import ProxyConnector
-from bs4 import BeautifulSoup
 
+import metrics
+import page_parser
 from config import config
-from database import init_db, save_parsed_data
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('parser.log', mode='w', encoding='utf-8')
-    ]
+from http_cache import ResponseCache
+from proxy_pool import ProxyPool
+from rate_limiter import RateController
+from database import (
+    init_db, begin_generation, save_categories, publish_generation, abort_generation, get_category_ages,
+    add_to_frontier, mark_in_flight, mark_failed, get_unfinished_generation, get_frontier_states, get_dead_letters,
+    renew_generation, release_generation,
 )
+
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class CrawlStats:
+    """Сводка по сетевой части обхода: запросы, соединения, DNS."""
+    requests: int = 0
+    request_time: float = 0.0
+    connections_created: int = 0
+    connections_reused: int = 0
+    connect_time: float = 0.0
+    dns_cache_hits: int = 0
+    dns_cache_misses: int = 0
+    cache_not_modified: int = 0
+    cache_unchanged: int = 0
+    cache_misses: int = 0
+    parse_cpu_time: float = 0.0
+    # Запись в staging-таблицы и публикация поколения: полное время (с fsync, ожиданием
+    # блокировок и GIL) и CPU потока-писателя
+    db_write_time: float = 0.0
+    db_write_cpu_time: float = 0.0
+    publish_time: float = 0.0
+    publish_cpu_time: float = 0.0
+    started_at: float = field(default_factory=time.monotonic)
+    # Учет одновременной работы загрузки и разбора
+    fetch_busy: float = 0.0
+    parse_busy: float = 0.0
+    overlap: float = 0.0
+    _active: Dict[str, int] = field(default_factory=lambda: {'fetch': 0, 'parse': 0})
+    _marked_at: float = field(default_factory=time.monotonic)
+
+    def _advance(self):
+        now = time.monotonic()
+        elapsed = now - self._marked_at
+        self._marked_at = now
+        if self._active['fetch']:
+            self.fetch_busy += elapsed
+        if self._active['parse']:
+            self.parse_busy += elapsed
+        if self._active['fetch'] and self._active['parse']:
+            self.overlap += elapsed
+
+    @contextmanager
+    def activity(self, kind: str):
+        """Отмечает время, когда идет хотя бы одна загрузка ('fetch') или разбор ('parse')."""
+        self._advance()
+        self._active[kind] += 1
+        try:
+            yield
+        finally:
+            self._advance()
+            self._active[kind] -= 1
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Возвращает TraceConfig, который собирает статистику в этот объект."""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            ctx.request_started = time.monotonic()
+
+        async def on_request_end(session, ctx, params):
+            self.requests += 1
+            self.request_time += time.monotonic() - ctx.request_started
+
+        async def on_connection_create_start(session, ctx, params):
+            ctx.connect_started = time.monotonic()
+
+        async def on_connection_create_end(session, ctx, params):
+            self.connections_created += 1
+            self.connect_time += time.monotonic() - ctx.connect_started
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.connections_reused += 1
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(session, ctx, params):
+            self.dns_cache_misses += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
+
+    def report(self) -> str:
+        """Формирует текстовый отчет по обходу."""
+        elapsed = time.monotonic() - self.started_at
+        avg_connect = self.connect_time / self.connections_created if self.connections_created else 0.0
+        avg_request = self.request_time / self.requests if self.requests else 0.0
+        # Каждое переиспользованное соединение экономит одно установление TCP/TLS
+        saved = self.connections_reused * avg_connect
+        overlap_share = self.overlap / self.parse_busy if self.parse_busy else 0.0
+        return (
+            f"Crawl finished in {elapsed:.2f}s: {self.requests} requests "
+            f"(avg {avg_request * 1000:.1f} ms), "
+            f"{self.connections_created} new connections "
+            f"(avg handshake {avg_connect * 1000:.1f} ms), "
+            f"{self.connections_reused} reused (~{saved:.2f}s of handshakes saved), "
+            f"DNS cache {self.dns_cache_hits} hits / {self.dns_cache_misses} misses, "
+            f"response cache {self.cache_not_modified} not modified / "
+            f"{self.cache_unchanged} unchanged / {self.cache_misses} parsed; "
+            f"fetching {self.fetch_busy:.2f}s, parsing {self.parse_busy:.2f}s "
+            f"(in-loop parse CPU {self.parse_cpu_time:.2f}s), "
+            f"overlapped {self.overlap:.2f}s ({overlap_share:.0%} of parsing); "
+            f"DB writes {self.db_write_time:.2f}s (CPU {self.db_write_cpu_time:.2f}s), "
+            f"publish {self.publish_time:.2f}s (CPU {self.publish_cpu_time:.2f}s)"
+        )
+
+
+def _thread_timed(func, *args, **kwargs):
+    """Вызывает func и возвращает (результат, полное время вызова, CPU-время текущего потока на вызов)."""
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started, time.thread_time() - cpu_started
+
+
+@dataclass
+class FetchResult:
+    """Ответ сервера; cached заполняется, если страница не изменилась с прошлого обхода."""
+    status: int
+    text: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    cached: Any = None
+
+    @cached_property
+    def body_hash(self) -> str:
+        return hashlib.sha1(self.text.encode('utf-8')).hexdigest()
+
+
+def _is_proxy_failure(error: Exception) -> bool:
+    """Ошибки ответа сайта (404 и т.п.) не говорят о плохом прокси, а блокировки и сбои сети - говорят."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status in (403, 407, 429)
+    return True
+
+
 class MetalParser:
 
-    def __init__(self, max_concurrent_requests: int = 5):
+    def __init__(self, max_concurrent_requests: int = 5, parse_off_loop: bool = False):
         self.base_url = config.BASE_URL
         self.proxies = config.PROXIES
         self.headers = {
@@ -34,192 +180,524 @@ class MetalParser:
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
             'Accept-Language': 'en-US,en;q=0.9,ru;q=0.8',
         }
-        self.session: Optional[aiohttp.ClientSession] = None
-        self.semaphore = Semaphore(max_concurrent_requests)
-
-    def _get_connector(self) -> Optional[ProxyConnector]:
-        """Возвращает коннектор для сессии с прокси."""
-        if self.proxies:
-            proxy_url = random.choice(self.proxies)
-            logger.info(f"Using proxy: {proxy_url}")
-            return ProxyConnector.from_url(proxy_url)
-        return None
+        self.stats = CrawlStats()
+        # Одна долгоживущая сессия (и один пул соединений) на каждый прокси
+        self.proxy_pool = ProxyPool(
+            self.proxies,
+            self._create_session,
+            failure_threshold=config.PROXY_FAILURE_THRESHOLD,
+            quarantine_base=config.PROXY_QUARANTINE_BASE,
+            quarantine_max=config.PROXY_QUARANTINE_MAX,
+        )
+        self.max_concurrent_requests = max_concurrent_requests
+        # Скорость и число одновременных запросов подстраиваются под ответы сайта
+        self.rate_limiter = RateController(
+            initial_window=config.RATE_LIMIT_INITIAL_WINDOW,
+            max_window=max_concurrent_requests,
+            initial_rate=config.RATE_LIMIT_INITIAL_RPS,
+            min_rate=config.RATE_LIMIT_MIN_RPS,
+            max_rate=config.RATE_LIMIT_MAX_RPS,
+            proxy_rate=config.PROXY_RATE_LIMIT,
+            latency_tolerance=config.RATE_LIMIT_LATENCY_TOLERANCE,
+            backoff_max=config.RETRY_BACKOFF_MAX,
+            retry_after_max=config.RETRY_AFTER_MAX,
+        )
+        # Состояние ограничителя отдается в метрики, пока идет обход
+        metrics.registry.register_collector('rate_limiter', self.rate_limiter.metrics)
+        self.response_cache = (
+            ResponseCache(config.HTTP_CACHE_FILE, config.HTTP_CACHE_MAX_ENTRIES)
+            if config.HTTP_CACHE_ENABLED else None
+        )
+        self.executor: Optional[ProcessPoolExecutor] = None
+        # Без пула процессов разбирать HTML в отдельном потоке, а не в цикле событий
+        # (когда парсер работает внутри бота, см. scheduler)
+        self.parse_off_loop = parse_off_loop
+        self.engine = config.PARSER_ENGINE
+        self.parse_engine = page_parser.ENGINES[self.engine]
+        # Поколение текущего обхода (для отметок в очереди обхода) и последние ошибки загрузки по URL
+        self.generation: Optional[int] = None
+        self.fetch_errors: Dict[str, str] = {}
+        # Аренду поколения перехватил другой процесс: новые URL не берутся, поколение не публикуется
+        self.lease_lost = False
+
+    def _get_connector(self, proxy_url: Optional[str] = None) -> aiohttp.TCPConnector:
+        """Возвращает коннектор с пулом keep-alive соединений и кэшем DNS."""
+        pool_options = {
+            'limit': config.PARSER_LIMIT,
+            'limit_per_host': config.PARSER_LIMIT_PER_HOST,
+            'keepalive_timeout': config.PARSER_KEEPALIVE_TIMEOUT,
+            'ttl_dns_cache': config.PARSER_DNS_CACHE_TTL,
+        }
+        if proxy_url:
+            return ProxyConnector.from_url(proxy_url, **pool_options)
+        return aiohttp.TCPConnector(**pool_options)
 
-    async def _create_session(self):
-        """Создает сессию aiohttp."""
-        if self.session and not self.session.closed:
-            await self.session.close()
-        
-        connector = self._get_connector()
-        self.session = aiohttp.ClientSession(
+    def _create_session(self, proxy_url: Optional[str]) -> aiohttp.ClientSession:
+        """Создает сессию aiohttp для указанного прокси."""
+        return aiohttp.ClientSession(
             headers=self.headers,
-            connector=connector
+            connector=self._get_connector(proxy_url),
+            trace_configs=[self.stats.trace_config()]
         )
 
-    async def close_session(self):
-        """Закрывает сессию aiohttp."""
-        if self.session and not self.session.closed:
-            await self.session.close()
-            logger.info("Session closed.")
+    def start_session(self):
+        """Открывает сессии пула прокси (по одной на прокси или одну без прокси) и пул процессов разбора."""
+        self.proxy_pool.open()
+        if config.PARSER_PROCESS_WORKERS > 0 and self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=config.PARSER_PROCESS_WORKERS)
 
-    async def fetch_page(self, url: str, retries: int = 3, delay: int = 5) -> Optional[str]:
+    async def close_session(self):
+        """Закрывает все сессии aiohttp и кэш ответов."""
+        closed = await self.proxy_pool.close()
+        if closed:
+            logger.info(f"Closed {closed} session(s).")
+        if self.response_cache:
+            self.response_cache.close()
+            self.response_cache = None
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def fetch_response(
+        self, url: str, headers: Optional[Dict[str, str]] = None, retries: int = 3, delay: float = 5
+    ) -> Optional[FetchResult]:
         """
-        Получает HTML-содержимое страницы с обработкой ошибок и повторными попытками.
+        Получает ответ страницы с обработкой ошибок и повторными попытками.
+        Запросы проходят через адаптивный ограничитель скорости хоста.
+        Каждая повторная попытка идет через другой прокси, если есть здоровый;
+        иначе - после паузы с экспоненциальным ростом и джиттером (delay - ее основа).
         """
-        await self._create_session()
         page_url = f"{self.base_url}{url}" if url.startswith('/') else url
+        host = urlsplit(page_url).netloc
+        tried = set()
+
+        error = None
+        for attempt in range(retries):
+            proxy = self.proxy_pool.acquire(exclude=tried)
+            tried.add(proxy.url)
+            try:
+                limiter = await self.rate_limiter.acquire(host, proxy.url)
+            except BaseException:
+                # Отмена, пока ждали окна или токена: прокси не должен остаться занятым
+                self.proxy_pool.release(proxy)
+                raise
+            started = time.monotonic()
+            status = retry_after = None
+            failed = False
+            pause = 0.0
+            try:
+                logger.info(f"Fetching {page_url} via {proxy.name} (Attempt {attempt + 1}/{retries})")
+                async with proxy.session.get(page_url, headers=headers, timeout=20) as response:
+                    status = response.status
+                    retry_after = response.headers.get('Retry-After')
+                    response.raise_for_status()
+                    body = await response.read()
+                    result = FetchResult(
+                        status=response.status,
+                        text=body.decode('utf-8', errors='ignore'),
+                        etag=response.headers.get('ETag'),
+                        last_modified=response.headers.get('Last-Modified'),
+                    )
+                metrics.FETCH_BYTES.inc(len(body))
+                if body:
+                    metrics.FETCH_RESPONSE_BYTES.observe(len(body))
+                self.proxy_pool.report_success(proxy, time.monotonic() - started)
+                return result
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if status is not None and status < 400:
+                    # Заголовки пришли, а тело - нет (таймаут, обрыв): это сбой, а не успешный ответ
+                    status = None
+                failed = status is None
+                error = f"{type(e).__name__}: {e}"
+                if _is_proxy_failure(e):
+                    self.proxy_pool.report_failure(proxy)
+                else:
+                    self.proxy_pool.report_success(proxy, time.monotonic() - started)
+                if attempt + 1 == retries:
+                    logger.warning(f"Error fetching {page_url}: {e}")
+                    continue
+                metrics.FETCH_RETRIES.inc(reason=status or 'network')
+                if self.proxy_pool.has_available(exclude=tried):
+                    logger.warning(f"Error fetching {page_url} via {proxy.name}: {e}. Switching proxy...")
+                else:
+                    pause = self.rate_limiter.backoff(attempt, delay)
+                    logger.warning(f"Error fetching {page_url}: {e}. Retrying in {pause:.1f}s...")
+            finally:
+                latency = time.monotonic() - started
+                metrics.FETCH_SECONDS.observe(latency, status=status or 'error')
+                self.proxy_pool.release(proxy)
+                await self.rate_limiter.release(limiter, latency, status, retry_after, failed)
+            # Паузу по Retry-After выдерживает ограничитель хоста перед следующим запросом
+            if pause:
+                await asyncio.sleep(pause)
+        logger.error(f"Failed to fetch {page_url} after {retries} attempts.")
+        metrics.FETCH_FAILURES.inc()
+        self.fetch_errors[url] = error
+        return None
 
-        async with self.semaphore:
-            for attempt in range(retries):
-                try:
-                    logger.info(f"Fetching {page_url} (Attempt {attempt + 1}/{retries})")
-                    async with self.session.get(page_url, timeout=20) as response:
-                        response.raise_for_status()
-                        return await response.text(encoding='utf-8', errors='ignore')
-                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-                    logger.warning(f"Error fetching {page_url}: {e}. Retrying in {delay}s...")
-                    await asyncio.sleep(delay * (attempt + 1))
-            logger.error(f"Failed to fetch {page_url} after {retries} attempts.")
-            return None
+    @metrics.span('fetch_page')
+    async def fetch_page(self, url: str, retries: int = 3, delay: int = 5) -> Optional[str]:
+        """Получает HTML-содержимое страницы."""
+        result = await self.fetch_response(url, retries=retries, delay=delay)
+        return result.text if result else None
+
+    async def fetch_cached(self, url: str) -> Optional[FetchResult]:
+        """
+        Получает страницу условным GET через кэш ответов.
+        Если сервер ответил 304 или тело не изменилось, в результате
+        заполнено поле cached - ранее разобранные данные, и разбирать HTML не нужно.
+        """
+        entry = await asyncio.to_thread(self.response_cache.get, url) if self.response_cache else None
+        result = await self.fetch_response(url, headers=entry.conditional_headers() if entry else None)
+        if result is None or entry is None:
+            if result is not None:
+                self.stats.cache_misses += 1
+            return result
+
+        if result.status == 304:
+            self.stats.cache_not_modified += 1
+        elif result.body_hash == entry.body_hash:
+            self.stats.cache_unchanged += 1
+        else:
+            self.stats.cache_misses += 1
+            return result
+
+        await asyncio.to_thread(self.response_cache.touch, url, result.etag, result.last_modified)
+        result.cached = entry.parsed
+        return result
+
+    async def remember(self, url: str, result: FetchResult, parsed):
+        """Сохраняет результат разбора страницы в кэш ответов."""
+        if self.response_cache and result.status != 304:
+            await asyncio.to_thread(
+                self.response_cache.store, url, result.etag, result.last_modified, result.body_hash, parsed
+            )
 
     async def get_category_links(self) -> List[Dict[str, str]]:
         """
         Получает список ссылок на категории товаров из левого контейнера.
         """
         logger.info("Parsing category links...")
-        html = await self.fetch_page("/price")
-        if not html:
+        result = await self.fetch_cached("/price")
+        if not result:
             logger.error("Could not fetch main page to parse categories.")
             return []
-
-        soup = BeautifulSoup(html, 'lxml')
-        left_container = soup.find('nav', id='left-container')
-        if not left_container:
-            logger.error("Left container not found on main page.")
-            return []
-        
-        categories = []
-        for link in left_container.select('ul.tabs a[data-naimenovanie]'):
-            name = link.text.strip()
-            href = link.get('href')
-            if name and href:
-                categories.append({'name': name, 'url': href})
-        
+        if result.cached is not None:
+            logger.info(f"Category list not modified, {len(result.cached)} categories from cache.")
+            return result.cached
+
+        if self.parse_off_loop:
+            categories = await asyncio.to_thread(page_parser.parse_category_links, result.text)
+        else:
+            categories = page_parser.parse_category_links(result.text)
+        if categories:
+            await self.remember("/price", result, categories)
         logger.info(f"Found {len(categories)} categories.")
         return categories
 
-    def parse_center_container(self, soup: BeautifulSoup) -> Dict:
-        """Парсит центральный контейнер для получения фильтров и размеров."""
-        center_container = soup.find('nav', id='center-container')
-        if not center_container:
-            return {}
-        
-        data = {}
-        panes = center_container.find_all('div', class_='pane')
-        for pane in panes:
-            group_name = pane.find_previous_sibling('h2')
-            if group_name:
-                group_name = group_name.text.strip()
-            else:
-                group_name = "default"
-            
-            sizes = [a.text.strip() for a in pane.find_all('a') if a.text.strip()]
-            data[group_name] = sizes
-        return data
-
-
-    def parse_price_table(self, soup: BeautifulSoup) -> List[Dict]:
-        """Парсит таблицу с ценами из правого контейнера."""
-        price_table = soup.find('table', id='table-price')
-        if not price_table or not price_table.find('tbody'):
-            return []
-
-        prices = []
-        for row in price_table.tbody.find_all('tr'):
-            columns = row.find_all('td')
-            if not columns or 'tp-tr-hidden' in row.get('class', []):
-                continue
-            
-            # Структура таблицы может меняться, поэтому парсим более гибко
-            firm_dop_opener = columns[-1].find('span', class_='firm_dop_opener')
-            if firm_dop_opener:
-                supplier_info = columns[-2]
-            else:
-                supplier_info = columns[-1]
-
-
-            supplier = supplier_info.find('a', class_='firm_link')
-            phone = supplier_info.find('a', class_='tel_link')
-
-            price_data = {
-                'position': columns[0].text.strip() if len(columns) > 0 else '',
-                'spec': columns[1].text.strip() if len(columns) > 1 else '',
-                'dimensions': columns[2].text.strip() if len(columns) > 2 else '',
-                'price_per_ton': columns[3].text.strip().replace('\xa0', '') if len(columns) > 3 else '',
-                'price_per_item': columns[4].text.strip().replace('\xa0', '') if len(columns) > 4 else '',
-                'supplier': supplier.text.strip() if supplier else '',
-                'phone': phone.text.strip() if phone else '',
-                'city': columns[-3].text.strip() if len(columns) > 5 else ''
-            }
-            prices.append(price_data)
-        return prices
-
-    async def parse_all(self):
+    async def parse_all(
+        self, stale_after: Optional[float] = None, limit: Optional[int] = None, resume: bool = False
+    ) -> int:
         """
-        Запускает полный процесс парсинга сайта.
-        1. Получает все категории.
-        2. Для каждой категории парсит страницу с ценами.
-        3. Сохраняет результат в базу данных.
+        Запускает процесс парсинга сайта потоковым конвейером:
+        загрузчики -> разборщики -> один писатель в БД.
+        Очереди ограничены, поэтому память не растет с размером каталога,
+        а каждая категория попадает в staging-таблицы нового поколения сразу
+        после разбора. В конце поколение атомарно публикуется для читателей.
+
+        Если задан stale_after (сек), обновление инкрементальное: загружаются
+        только категории, которые обновлялись раньше, чем stale_after секунд назад
+        (самые старые первыми, не больше limit), остальные остаются как есть.
+
+        Состояние каждого URL хранится в очереди обхода (crawl_frontier). При resume
+        прерванное поколение (если есть) дообходится: загружаются только URL, которые
+        не успели сохранить, после чего поколение публикуется как обычно.
+        Возвращает число сохраненных категорий поколения.
         """
-        all_data = []
-        categories = await self.get_category_links()
+        self.start_session()
+        if resume:
+            unfinished = await asyncio.to_thread(get_unfinished_generation, config.CRAWL_LEASE)
+            if unfinished:
+                logger.info(
+                    f"Resuming generation {unfinished['generation']}: "
+                    f"{len(unfinished['categories'])} categories left ({unfinished['states']})"
+                )
+                return await self._crawl(unfinished['generation'], unfinished['categories'], unfinished['keep_urls'])
+            logger.info("No interrupted crawl to resume, starting a new one.")
 
-        tasks = [self.parse_category_page(cat) for cat in categories]
-        results = await asyncio.gather(*tasks)
-
-        for data in results:
-            if data:
-                all_data.append(data)
+        categories = await self.get_category_links()
+        if not categories:
+            logger.error("No categories found, database left untouched.")
+            return 0
+
+        keep_urls = None
+        if stale_after is not None:
+            ages = await asyncio.to_thread(get_category_ages)
+            keep_urls = [category['url'] for category in categories]
+            categories = [c for c in categories if ages.get(c['url'], float('inf')) >= stale_after]
+            categories.sort(key=lambda c: ages.get(c['url'], float('inf')), reverse=True)
+            if limit:
+                categories = categories[:limit]
+            logger.info(f"Incremental refresh: {len(categories)} of {len(keep_urls)} categories are stale.")
+            if not categories:
+                return 0
+
+        generation = await asyncio.to_thread(begin_generation, keep_urls, config.CRAWL_LEASE)
+        if generation is None:
+            logger.warning("Another process is building a generation, skipping this crawl.")
+            return 0
+        await asyncio.to_thread(add_to_frontier, generation, categories)
+        return await self._crawl(generation, categories, keep_urls)
+
+    async def retry_failed(self) -> int:
+        """
+        Повторяет недоставленные URL (dead letters) отдельным инкрементальным
+        поколением: остальные опубликованные категории не трогаются.
+        Счет попыток продолжается. Возвращает число сохраненных категорий.
+        """
+        dead_letters = await asyncio.to_thread(get_dead_letters)
+        if not dead_letters:
+            logger.info("No failed categories to retry.")
+            return 0
+        logger.info(f"Retrying {len(dead_letters)} failed categories...")
+        self.start_session()
+        keep_urls = list(await asyncio.to_thread(get_category_ages))
+        generation = await asyncio.to_thread(begin_generation, keep_urls, config.CRAWL_LEASE)
+        if generation is None:
+            logger.warning("Another process is building a generation, try again later.")
+            return 0
+        await asyncio.to_thread(add_to_frontier, generation, dead_letters)
+        categories = [{'name': entry['name'], 'url': entry['url']} for entry in dead_letters]
+        return await self._crawl(generation, categories, keep_urls)
+
+    async def _crawl(self, generation: int, categories: List[Dict[str, str]], keep_urls: Optional[list]) -> int:
+        """Обходит categories в поколение generation и публикует его, если в нем есть сохраненные категории."""
+        self.generation = generation
+        category_queue = asyncio.Queue()
+        for category in categories:
+            category_queue.put_nowait(category)
+        page_queue = asyncio.Queue(maxsize=config.PIPELINE_QUEUE_SIZE)
+        data_queue = asyncio.Queue(maxsize=config.PIPELINE_QUEUE_SIZE)
+
+        fetchers = [
+            asyncio.create_task(self._fetch_worker(category_queue, page_queue))
+            for _ in range(self.max_concurrent_requests)
+        ]
+        # В режиме пула процессов держим в работе не меньше страниц, чем процессов
+        parse_workers = max(config.PIPELINE_PARSE_WORKERS, config.PARSER_PROCESS_WORKERS)
+        parsers = [
+            asyncio.create_task(self._parse_worker(page_queue, data_queue))
+            for _ in range(parse_workers)
+        ]
+        writer = asyncio.create_task(self._write_worker(data_queue, generation, len(categories)))
+        heartbeat = asyncio.create_task(self._heartbeat(generation))
 
-        logger.info(f"Total categories parsed: {len(all_data)}")
-        
         try:
-            save_parsed_data(all_data)
-            logger.info(f"Data successfully saved to database")
-        except Exception as e:
-            logger.error(f"Error saving data to database: {e}")
+            await asyncio.gather(*fetchers)
+            for _ in parsers:
+                await page_queue.put(None)
+            await asyncio.gather(*parsers)
+            await data_queue.put(None)
+            saved = await writer
+        except BaseException:
+            # Остановка или ошибка: поколение можно дообойти сразу, не дожидаясь истечения аренды
+            try:
+                await asyncio.to_thread(release_generation, generation)
+            except Exception as e:
+                # Аренда истечет сама; исходная ошибка важнее
+                logger.error(f"Failed to release the lease on generation {generation}: {e}")
+            raise
+        finally:
+            for task in (*fetchers, *parsers, writer, heartbeat):
+                task.cancel()
+
+        logger.info(f"Total categories parsed: {saved}")
+        # При дообходе часть категорий сохранена до падения - они тоже публикуются
+        states = await asyncio.to_thread(get_frontier_states, generation)
+        done = states.get('done', 0)
+        if self.lease_lost:
+            logger.error(f"Generation {generation} was taken over by another process, not publishing it.")
+            return 0
+        if done:
+            _, wall_time, cpu_time = await asyncio.to_thread(
+                _thread_timed, publish_generation, generation, keep_urls=keep_urls
+            )
+            self.stats.publish_time += wall_time
+            self.stats.publish_cpu_time += cpu_time
+        else:
+            logger.error("Nothing parsed, generation is not published.")
+            await asyncio.to_thread(abort_generation, generation)
+        logger.info(self.stats.report())
+        logger.info(f"Crawl frontier of generation {generation}: {states}")
+        if states.get('failed'):
+            logger.warning(f"{states['failed']} categories failed, retry them with: python parser.py --retry-failed")
+        logger.info(f"Proxy pool:\n{self.proxy_pool.report()}")
+        logger.info(f"Rate limits:\n{self.rate_limiter.report()}")
+        return done
+
+    async def _heartbeat(self, generation: int):
+        """Продлевает аренду поколения, пока идет обход."""
+        while True:
+            await asyncio.sleep(config.CRAWL_LEASE / 3)
+            try:
+                renewed = await asyncio.to_thread(renew_generation, generation)
+            except sqlite3.Error as e:
+                # Например, база занята записью этого же обхода: аренды хватит до следующей попытки
+                logger.warning(f"Failed to renew the lease on generation {generation}, retrying: {e}")
+                continue
+            if not renewed:
+                logger.error(f"Lost the lease on generation {generation}, stopping the crawl.")
+                self.lease_lost = True
+                return
+
+    async def _fetch_worker(self, category_queue: asyncio.Queue, page_queue: asyncio.Queue):
+        """Загружает страницы категорий, пока очередь не опустеет."""
+        while not category_queue.empty() and not self.lease_lost:
+            category = category_queue.get_nowait()
+            url = category['url']
+            await asyncio.to_thread(mark_in_flight, self.generation, url)
+            with self.stats.activity('fetch'):
+                result = await self.fetch_cached(url)
+            if result:
+                await page_queue.put((category, result))
+            else:
+                await asyncio.to_thread(mark_failed, self.generation, [url], self.fetch_errors.pop(url, None))
+
+    async def _parse_worker(self, page_queue: asyncio.Queue, data_queue: asyncio.Queue):
+        """Разбирает загруженные страницы и передает результат писателю."""
+        while True:
+            item = await page_queue.get()
+            if item is None:
+                return
+            category, result = item
+            if result.cached is not None:
+                await data_queue.put(result.cached)
+                continue
+            try:
+                data = await self.parse_html(result.text, category)
+            except Exception as e:
+                logger.error(f"Error parsing {category['url']}: {e}")
+                await asyncio.to_thread(mark_failed, self.generation, [category['url']], f"parse: {e}")
+                continue
+            await self.remember(category['url'], result, data)
+            await data_queue.put(data)
 
+    async def _write_worker(self, data_queue: asyncio.Queue, generation: int, total: int) -> int:
+        """
+        Единственный писатель в БД: забирает все готовые категории и сохраняет
+        их пачкой в staging-таблицы поколения в отдельном потоке.
+        Возвращает число сохраненных категорий.
+        """
+        saved = 0
+        finished = False
+        while not finished:
+            batch = [await data_queue.get()]
+            while not data_queue.empty() and len(batch) < config.PIPELINE_WRITE_BATCH:
+                batch.append(data_queue.get_nowait())
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+            if not batch or self.lease_lost:
+                continue
+            try:
+                _, wall_time, cpu_time = await asyncio.to_thread(_thread_timed, save_categories, batch, generation)
+                self.stats.db_write_time += wall_time
+                self.stats.db_write_cpu_time += cpu_time
+                saved += len(batch)
+                logger.info(f"Saved {len(batch)} categories ({saved}/{total})")
+            except Exception as e:
+                logger.error(f"Error saving data to database: {e}")
+                await asyncio.to_thread(
+                    mark_failed, generation, [category_data.get('url') for category_data in batch], f"save: {e}"
+                )
+        return saved
+
+    @metrics.span('parse_category_page')
     async def parse_category_page(self, category: Dict[str, str]) -> Optional[Dict]:
         """Парсит отдельную страницу категории."""
         category_url = category['url']
-        html = await self.fetch_page(category_url)
-        if not html:
+        result = await self.fetch_cached(category_url)
+        if not result:
             return None
+        if result.cached is not None:
+            return result.cached
 
-        soup = BeautifulSoup(html, 'lxml')
-        h1 = soup.find('h1', class_='price-h1')
+        data = await self.parse_html(result.text, category)
+        await self.remember(category_url, result, data)
+        return data
 
-        return {
-            'category_name': h1.text.strip() if h1 else category['name'],
-            'url': category_url,
-            'filters': self.parse_center_container(soup),
-            'prices': self.parse_price_table(soup)
-        }
+    async def parse_html(self, html: str, category: Dict[str, str]) -> Dict:
+        """
+        Разбирает страницу категории: в пуле процессов, если он включен,
+        иначе в отдельном потоке (parse_off_loop) или прямо в цикле событий.
+        """
+        started = time.process_time()
+        wall_started = time.perf_counter()
+        with self.stats.activity('parse'):
+            if self.executor:
+                loop = asyncio.get_running_loop()
+                data = await loop.run_in_executor(self.executor, self.parse_engine, html, category)
+            elif self.parse_off_loop:
+                data, _, cpu_time = await asyncio.to_thread(_thread_timed, self.parse_engine, html, category)
+                self.stats.parse_cpu_time += cpu_time
+            else:
+                data = self.parse_engine(html, category)
+                self.stats.parse_cpu_time += time.process_time() - started
+        metrics.PARSE_SECONDS.observe(time.perf_counter() - wall_started, engine=self.engine)
+        metrics.CATEGORY_ROWS.observe(len(data.get('prices', [])))
+        return data
 
+def print_dead_letters():
+    """Выводит недоставленные URL: попытки, последняя ошибка."""
+    dead_letters = get_dead_letters()
+    if not dead_letters:
+        print("No failed categories.")
+        return
+    for entry in dead_letters:
+        print(
+            f"{entry['url']}\t{entry['name']}\tattempts {entry['attempts']}\t"
+            f"generation {entry['generation']}\t{entry['updated_at']}\t{entry['last_error']}"
+        )
 
-async def main():
+async def main(args: argparse.Namespace):
     """Главная функция для запуска парсера."""
-    init_db() # Инициализируем БД перед началом парсинга
+    init_db(wal=config.DB_WAL) # Инициализируем БД перед началом парсинга
+    if args.dead_letters:
+        print_dead_letters()
+        return
     parser = MetalParser(max_concurrent_requests=10)
     try:
-        await parser.parse_all()
+        if args.retry_failed:
+            await parser.retry_failed()
+        else:
+            await parser.parse_all(resume=args.resume)
     finally:
         await parser.close_session()
+        if config.METRICS_FILE:
+            metrics.registry.dump_json(config.METRICS_FILE)
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Парсер цен на металлопрокат")
+    mode = arg_parser.add_mutually_exclusive_group()
+    mode.add_argument('--resume', action='store_true', help='finish an interrupted crawl instead of starting over')
+    mode.add_argument('--retry-failed', action='store_true', help='retry categories that failed in earlier crawls')
+    mode.add_argument('--dead-letters', action='store_true', help='list failed categories and exit')
+    args = arg_parser.parse_args()
+
+    # Настройка логирования (при запуске из бота логи идут в его обработчики)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(),
+            # Лог дописывается: история прошлых обходов нужна для поиска регрессий
+            logging.FileHandler('parser.log', mode='a', encoding='utf-8')
+        ]
+    )
+
     if not config.PROXIES:
         logger.warning("No proxies found in config.py. Running without proxies.")
         logger.warning("The site may block your IP address.")
 
 
-    asyncio.run(main()) 
+    asyncio.run(main(args)) 
@@ -0,0 +1,322 @@
+"""
+Масса проката и расчет стоимости заказа.
+
+При загрузке цен вид проката определяется по названию позиции (или категории),
+размеры разбираются в числовые массивы, и масса погонного метра (для листа -
+квадратного метра) считается сразу для всей категории по геометрии и плотности
+металла; швеллеры и балки - по таблицам ГОСТ. Результат хранится в строке цены
+(unit_weight, unit) вместе с основным размером (size) для отбора лучших предложений.
+
+Бот строит по строкам категории QuoteTable - массивы NumPy с ценой за тонну и
+массой - и считает стоимость заказа сразу по всем предложениям.
+"""
+import math
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Плотность, кг/м³: по умолчанию углеродистая сталь
+STEEL_DENSITY = 7850.0
+DENSITIES = (
+    (('нерж', 'aisi', '12х18н10т', '08х18н10'), 7900.0),
+    (('алюмин', 'дюрал'), 2700.0),
+    (('латун',), 8500.0),
+    (('медн', 'медь'), 8900.0),
+)
+
+# Виды проката
+PIPE, PROFILE, ANGLE, STRIP, ROUND, SQUARE, HEXAGON, SHEET, TABLE = range(9)
+# Единица количества в заказе: погонные метры, для листа - квадратные
+UNIT_METER, UNIT_SQUARE_METER = 'm', 'm2'
+UNIT_LABELS = {UNIT_METER: 'м', UNIT_SQUARE_METER: 'м²'}
+
+# Масса метра, кг: швеллеры ГОСТ 8240 (серии П и У) и двутавры ГОСТ 8239 по номеру профиля
+CHANNEL_WEIGHTS = {
+    5: 4.84, 6.5: 5.9, 8: 7.05, 10: 8.59, 12: 10.4, 14: 12.3, 16: 14.2, 18: 16.3,
+    20: 18.4, 22: 21.0, 24: 24.0, 27: 27.7, 30: 31.8, 33: 36.5, 36: 41.9, 40: 48.3,
+}
+BEAM_WEIGHTS = {
+    10: 9.46, 12: 11.5, 14: 13.7, 16: 15.9, 18: 18.4, 20: 21.0, 22: 24.0, 24: 27.3,
+    27: 31.5, 30: 36.5, 33: 42.2, 36: 48.6, 40: 57.0, 45: 66.5, 50: 78.5, 55: 92.6, 60: 108.0,
+}
+
+# Ключевые слова вида проката; проверяются по порядку («труба квадратная» - профильная труба, а не квадрат)
+_SHAPES = (
+    (('профильн', 'прямоугольн', 'квадратн'), PROFILE),
+    (('труб',), PIPE),
+    (('уголок', 'уголк'), ANGLE),
+    (('швеллер',), 'channel'),
+    (('балк', 'двутавр'), 'beam'),
+    (('лист', 'плит', 'рулон'), SHEET),
+    (('полос',), STRIP),
+    (('арматур', 'круг', 'пруток', 'проволок', 'катанк'), ROUND),
+    (('квадрат',), SQUARE),
+    (('шестигран',), HEXAGON),
+)
+# Размеры: отдельные числа и числа через x/х/×/* ("57x3,5", "40 х 20 х 2", "4мм").
+# Числа, приклеенные к буквам (марки А500С, 09Г2С, ст3сп, ст.20), и номера стандартов размерами не считаются
+_SEPARATOR = re.compile(r'(?<=\d)\s*[xXхХ×*]\s*(?=\d)')
+_UNIT = re.compile(r'(?<=\d)\s*(?:мм|mm)\b', re.IGNORECASE)
+_STANDARD = re.compile(r'\b(?:гост|ту|din|en|iso)\s*[\d.\-]+', re.IGNORECASE)
+_NUMBER = re.compile(r'(?<![\w.,-])\d+(?:[.,]\d+)?(?!\w|[.,]\d)')
+# Номер швеллера или балки может быть с буквой серии: 10П, 12У, 20Б1
+_PROFILE_NUMBER = re.compile(r'(?<![\w.,-])(\d+(?:[.,]\d+)?)(?:[пуэлсбкшд]\d?)?(?!\w)', re.IGNORECASE)
+# Версия разбора размеров: при ее изменении масса и размеры строк в базе пересчитываются (см. database.init_db)
+PROFILES_VERSION = 1
+# Число не меньше этого в конце размеров - длина (57x3,5x6000), а не размер сечения
+LENGTH_MIN = 1000
+
+
+def _keyword_index(groups) -> Tuple[re.Pattern, Dict[str, Tuple[int, object]]]:
+    """Одно регулярное выражение по всем ключевым словам и слово -> (приоритет, значение)."""
+    index = {word: (priority, value) for priority, (words, value) in enumerate(groups) for word in words}
+    # Длинные слова раньше: "квадратн" должно совпасть раньше "квадрат"
+    pattern = re.compile('|'.join(sorted(map(re.escape, index), key=len, reverse=True)))
+    return pattern, index
+
+
+_SHAPE_WORDS, _SHAPE_INDEX = _keyword_index(_SHAPES)
+_DENSITY_WORDS, _DENSITY_INDEX = _keyword_index(DENSITIES)
+
+
+def _numbers(text: str) -> List[float]:
+    text = _UNIT.sub(' ', _SEPARATOR.sub(' ', _STANDARD.sub(' ', text or '')))
+    return [float(number.replace(',', '.')) for number in _NUMBER.findall(text)]
+
+
+def _sizes(text: str) -> List[float]:
+    """Размеры сечения: числа без длины в конце."""
+    numbers = _numbers(text)
+    while len(numbers) > 1 and numbers[-1] >= LENGTH_MIN:
+        numbers.pop()
+    return numbers
+
+
+def _profile_number(text: str) -> Optional[float]:
+    match = _PROFILE_NUMBER.search(_STANDARD.sub(' ', text or ''))
+    return float(match.group(1).replace(',', '.')) if match else None
+
+
+def _shape(text: str):
+    found = _SHAPE_WORDS.findall(text.lower().replace('ё', 'е'))
+    return min(_SHAPE_INDEX[word] for word in found)[1] if found else None
+
+
+def _density(text: str) -> float:
+    found = _DENSITY_WORDS.findall(text.lower())
+    return min(_DENSITY_INDEX[word] for word in found)[1] if found else STEEL_DENSITY
+
+
+@lru_cache(maxsize=65536)
+def parse_profile(position: str, spec: str, dimensions: str, category: str = '') -> Optional[Tuple]:
+    """
+    Вид проката и размеры (мм) строки цены: (вид, плотность, a, b, s) или None,
+    если вид или размеры не распознаны. Для швеллеров и балок a - масса метра из таблицы.
+    """
+    shape = _shape(position or '')
+    if shape is None:
+        shape = _shape(category or '')
+    if shape is None:
+        return None
+    density = _density(f"{position} {spec} {category}")
+    if shape in ('channel', 'beam'):
+        number = _profile_number(dimensions)
+        if number is None:
+            number = _profile_number(position)
+        weight = (CHANNEL_WEIGHTS if shape == 'channel' else BEAM_WEIGHTS).get(number)
+        return (TABLE, density, weight, math.nan, math.nan) if weight else None
+
+    numbers = _sizes(dimensions) or _sizes(position)
+    if not numbers:
+        return None
+    # Труба с тремя размерами (40x20x2) - профильная
+    if shape == PIPE and len(numbers) >= 3:
+        shape = PROFILE
+    if shape == SHEET:
+        # "4x1500x6000" или "1250x2500x4": толщина - наименьший размер
+        thickness = min(numbers)
+        return (SHEET, density, math.nan, math.nan, thickness) if thickness < LENGTH_MIN else None
+    if shape in (ROUND, SQUARE, HEXAGON):
+        return shape, density, numbers[0], math.nan, math.nan
+    if shape == STRIP:
+        if len(numbers) < 2:
+            return None
+        return STRIP, density, max(numbers[:2]), math.nan, min(numbers[:2])
+    if shape == PIPE:
+        if len(numbers) < 2:
+            return None
+        return PIPE, density, numbers[0], math.nan, numbers[1]
+    # Профильная труба и уголок: AxBxs или Axs (равные стороны)
+    if len(numbers) < 2:
+        return None
+    a, b, s = (numbers[0], numbers[1], numbers[2]) if len(numbers) >= 3 else (numbers[0], numbers[0], numbers[1])
+    return shape, density, a, b, s
+
+
+def unit_weights(profiles: Sequence[Optional[Tuple]]) -> np.ndarray:
+    """
+    Масса единицы (кг на погонный метр, для листа - на м²) для массива профилей
+    parse_profile; NaN, где профиль не распознан или размеры невозможны.
+    """
+    parsed = [profile or (-1, STEEL_DENSITY, math.nan, math.nan, math.nan) for profile in profiles]
+    if not parsed:
+        return np.empty(0)
+    shape, density, a, b, s = (np.array(column, dtype=float) for column in zip(*parsed))
+    with np.errstate(invalid='ignore'):
+        # Площадь сечения, мм² (для листа - сечение полосы шириной 1 м)
+        area = np.select(
+            [shape == PIPE, shape == PROFILE, shape == ANGLE, shape == STRIP,
+             shape == ROUND, shape == SQUARE, shape == HEXAGON, shape == SHEET],
+            [np.pi * s * (a - s), 2 * s * (a + b - 2 * s), s * (a + b - s), a * s,
+             np.pi * a * a / 4, a * a, math.sqrt(3) / 2 * a * a, 1000 * s],
+            default=np.nan,
+        )
+        weight = np.where(shape == TABLE, a, area * density * 1e-6)
+        # Стенка не толще половины размера, иначе размеры разобраны неверно
+        thin_wall = np.isin(shape, (PIPE, PROFILE, ANGLE))
+        valid = (weight > 0) & ~(thin_wall & (2 * s >= np.fmin(a, b)))
+    return np.where(valid, weight, np.nan)
+
+
+def size_key(profile: Optional[Tuple], dimensions: str) -> str:
+    """
+    Основной размер позиции для отбора предложений: диаметр трубы и круга,
+    AxB профильной трубы и уголка, толщина листа, номер швеллера и т.п.
+    Если профиль не распознан - первое число размеров ('' - размеров нет).
+    """
+    if profile is None:
+        numbers = _numbers(dimensions)
+        return f"{numbers[0]:g}" if numbers else ''
+    shape, _, a, b, s = profile
+    if shape in (PROFILE, ANGLE):
+        return f"{a:g}x{b:g}"
+    if shape == STRIP:
+        return f"{a:g}x{s:g}"
+    if shape == SHEET:
+        return f"{s:g}"
+    if shape == TABLE:
+        number = _profile_number(dimensions)
+        return f"{number:g}" if number is not None else ''
+    return f"{a:g}"
+
+
+def category_profiles(rows: List[Dict], category: str = '') -> List[Tuple[Optional[float], Optional[str], str]]:
+    """
+    (масса единицы, единица, основной размер) для строк цен одной категории;
+    масса и единица None, если масса неизвестна.
+    """
+    profiles = [
+        parse_profile(row.get('position'), row.get('spec'), row.get('dimensions'), category) for row in rows
+    ]
+    weights = unit_weights(profiles)
+    return [
+        (
+            None if math.isnan(weight) else round(float(weight), 4),
+            None if math.isnan(weight) else UNIT_SQUARE_METER if profile[0] == SHEET else UNIT_METER,
+            size_key(profile, row.get('dimensions') or row.get('position')),
+        )
+        for row, profile, weight in zip(rows, profiles, weights)
+    ]
+
+
+class QuoteTable:
+    """
+    Предложения категории с известными ценой за тонну и массой в виде массивов NumPy.
+    Строится один раз на поколение данных (см. catalog_cache), quote() - векторный расчет.
+    """
+
+    def __init__(self, rows: Sequence[Tuple]):
+        """rows: (ton_price, unit_weight, unit, position, dimensions, supplier, city)."""
+        units = [row[2] for row in rows]
+        # Если в категории смешаны метры и м², считаем в преобладающей единице
+        self.unit = max(set(units), key=units.count) if units else UNIT_METER
+        rows = [row for row in rows if row[2] == self.unit]
+        self.ton_price = np.array([row[0] for row in rows], dtype=float)
+        self.unit_weight = np.array([row[1] for row in rows], dtype=float)
+        self.offers = [row[3:] for row in rows]
+
+    def __len__(self) -> int:
+        return len(self.offers)
+
+    def quote(self, quantity: float) -> Optional[Dict]:
+        """
+        Стоимость quantity единиц по каждому предложению: минимум, медиана,
+        максимум, масса заказа и лучшее предложение. None, если считать не по чему.
+        """
+        if not self.offers:
+            return None
+        tons = quantity * self.unit_weight / 1000
+        costs = tons * self.ton_price
+        best = int(np.argmin(costs))
+        position, dimensions, supplier, city = self.offers[best]
+        return {
+            'unit': self.unit,
+            'offers': len(self.offers),
+            'min_cost': float(costs[best]),
+            'median_cost': float(np.median(costs)),
+            'max_cost': float(costs.max()),
+            'min_weight': float(tons.min()),
+            'max_weight': float(tons.max()),
+            'best': {
+                'position': position,
+                'dimensions': dimensions,
+                'supplier': supplier,
+                'city': city,
+                'ton_price': float(self.ton_price[best]),
+                'weight': float(tons[best]),
+                'cost': float(costs[best]),
+            },
+        }
+
+
+# Строки цен в том виде, в каком они бывают на сайте, и масса единицы по ГОСТ
+# (кг/м, для листа - кг/м²; None - масса не определяется). Расчет по геометрии без
+# скруглений углов отличается от таблиц ГОСТ на несколько процентов
+SAMPLES = (
+    # (позиция, марка, размеры, масса)
+    ('Труба электросварная 57x3,5', 'ст3сп', '57x3,5', 4.62),
+    ('Труба электросварная', 'ст3сп', '57x3.5x6000', 4.62),
+    ('Труба бесшовная 108х4 ГОСТ 8732-78', '20', '', 10.26),
+    ('Труба нержавеющая AISI 304', '', '57x3', 4.0),
+    ('Труба профильная', 'ст3сп', '40x20x2', 1.68),
+    ('Арматура А500С 12', 'А500С', '', 0.888),
+    ('Арматура 12 А500С', '', '', 0.888),
+    ('Арматура', 'А500С', '12', 0.888),
+    ('Круг ст.20 16', 'ст.20', '', 1.58),
+    ('Уголок равнополочный', 'ст3сп', '50x5', 3.77),
+    ('Полоса', 'ст3сп', '40x4', 1.26),
+    ('Квадрат', 'ст3', '10', 0.785),
+    ('Шестигранник', 'ст35', '17', 1.96),
+    ('Лист г/к', '09Г2С', '4x1500x6000', 31.4),
+    ('Лист г/к 4мм', '09Г2С', '', 31.4),
+    ('Лист г/к', 'ст3сп', '1500x6000', None),
+    ('Швеллер 10П', 'ст3пс', '', 8.59),
+    ('Швеллер', 'ст3пс', '12У', 10.4),
+    ('Балка двутавровая 20', 'ст3сп', '', 21.0),
+    ('Арматура А500С', 'А500С', '', None),
+)
+
+
+def check_samples(tolerance: float = 0.06) -> List[str]:
+    """Сверяет массу SAMPLES с ГОСТ; возвращает расхождения (пустой список, если их нет)."""
+    profiles = [parse_profile(position, spec, dimensions) for position, spec, dimensions, _ in SAMPLES]
+    differences = []
+    for (position, spec, dimensions, expected), weight in zip(SAMPLES, unit_weights(profiles)):
+        actual = None if math.isnan(weight) else float(weight)
+        if (actual is None) != (expected is None) or (
+                expected is not None and abs(actual - expected) > expected * tolerance):
+            differences.append(f"{position!r} {spec!r} {dimensions!r}: expected {expected}, got {actual}")
+    return differences
+
+
+if __name__ == '__main__':
+    # Проверка разбора размеров и массы на образцах: python pricing.py
+    import sys
+
+    differences = check_samples()
+    print(f"{len(SAMPLES)} samples: {'OK' if not differences else f'{len(differences)} difference(s)'}")
+    for difference in differences:
+        print(f"  {difference}")
+    sys.exit(1 if differences else 0)
@@ -0,0 +1,149 @@
+import random
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Латентность, которую считаем для прокси без единого замера (сек)
+DEFAULT_LATENCY = 1.0
+# Вес нового замера в скользящих средних
+EWMA_ALPHA = 0.3
+
+
+@dataclass
+class ProxyState:
+    """Состояние одного прокси: своя сессия и показатели здоровья."""
+    url: Optional[str]
+    session: aiohttp.ClientSession
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    quarantines: int = 0
+    quarantined_until: float = 0.0
+    latency: Optional[float] = None
+    error_rate: float = 0.0
+    in_flight: int = 0
+
+    @property
+    def name(self) -> str:
+        return self.url or 'direct'
+
+    def is_available(self, now: float) -> bool:
+        return self.quarantined_until <= now
+
+    def score(self) -> float:
+        """Чем меньше, тем лучше: латентность с поправкой на ошибки и загрузку."""
+        latency = self.latency if self.latency is not None else DEFAULT_LATENCY
+        return latency * (1 + 4 * self.error_rate) * (1 + self.in_flight)
+
+
+class ProxyPool:
+    """
+    Пул прокси с долгоживущей сессией на каждый прокси.
+    Запросы уходят на самые здоровые прокси, сбойные уходят в карантин
+    с экспоненциально растущим сроком.
+    """
+
+    def __init__(
+        self,
+        proxies: Iterable[Optional[str]],
+        session_factory: Callable[[Optional[str]], aiohttp.ClientSession],
+        failure_threshold: int = 3,
+        quarantine_base: float = 30.0,
+        quarantine_max: float = 600.0,
+    ):
+        self.proxies = list(proxies) or [None]
+        self.session_factory = session_factory
+        self.failure_threshold = failure_threshold
+        self.quarantine_base = quarantine_base
+        self.quarantine_max = quarantine_max
+        self.states: Dict[Optional[str], ProxyState] = {}
+
+    def open(self):
+        """Создает по одной сессии на каждый прокси."""
+        if self.states:
+            return
+        for proxy_url in self.proxies:
+            if proxy_url:
+                logger.info(f"Opening session via proxy: {proxy_url}")
+            self.states[proxy_url] = ProxyState(url=proxy_url, session=self.session_factory(proxy_url))
+
+    async def close(self) -> int:
+        """Закрывает все сессии пула. Возвращает число закрытых сессий."""
+        states = [state for state in self.states.values() if not state.session.closed]
+        self.states = {}
+        for state in states:
+            await state.session.close()
+        return len(states)
+
+    def _candidates(self, exclude: Set[Optional[str]]) -> List[ProxyState]:
+        now = time.monotonic()
+        return [
+            state for state in self.states.values()
+            if state.is_available(now) and state.url not in exclude
+        ]
+
+    def has_available(self, exclude: Set[Optional[str]] = frozenset()) -> bool:
+        """Есть ли прокси вне карантина, кроме исключенных."""
+        return bool(self._candidates(exclude))
+
+    def acquire(self, exclude: Set[Optional[str]] = frozenset()) -> ProxyState:
+        """
+        Выбирает прокси для запроса (power of two choices по score).
+        Исключенные прокси берутся, только если других нет; если в карантине
+        все, возвращается тот, чей карантин закончится раньше.
+        """
+        self.open()
+        candidates = self._candidates(exclude) or self._candidates(set())
+        if not candidates:
+            state = min(self.states.values(), key=lambda s: s.quarantined_until)
+        elif len(candidates) == 1:
+            state = candidates[0]
+        else:
+            state = min(random.sample(candidates, 2), key=ProxyState.score)
+        state.in_flight += 1
+        return state
+
+    def release(self, state: ProxyState):
+        state.in_flight -= 1
+
+    def report_success(self, state: ProxyState, latency: float):
+        """Учитывает успешный запрос через прокси."""
+        state.requests += 1
+        state.consecutive_failures = 0
+        state.quarantines = 0
+        state.error_rate *= 1 - EWMA_ALPHA
+        if state.latency is None:
+            state.latency = latency
+        else:
+            state.latency += EWMA_ALPHA * (latency - state.latency)
+
+    def report_failure(self, state: ProxyState):
+        """Учитывает сбой прокси и при необходимости отправляет его в карантин."""
+        state.requests += 1
+        state.failures += 1
+        state.consecutive_failures += 1
+        state.error_rate += EWMA_ALPHA * (1 - state.error_rate)
+        if state.consecutive_failures >= self.failure_threshold:
+            backoff = min(self.quarantine_base * 2 ** state.quarantines, self.quarantine_max)
+            state.quarantines += 1
+            state.quarantined_until = time.monotonic() + backoff
+            logger.warning(
+                f"Proxy {state.name} quarantined for {backoff:.0f}s "
+                f"after {state.consecutive_failures} consecutive failures"
+            )
+
+    def report(self) -> str:
+        """Формирует текстовую сводку по всем прокси пула."""
+        lines = []
+        for state in self.states.values():
+            latency = f"{state.latency * 1000:.0f} ms" if state.latency is not None else "n/a"
+            lines.append(
+                f"{state.name}: {state.requests} requests, {state.failures} failures, "
+                f"latency {latency}, error rate {state.error_rate:.2f}"
+            )
+        return "\n".join(lines)
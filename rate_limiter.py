@@ -0,0 +1,291 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Ответы, которыми сайт просит снизить нагрузку
+THROTTLE_STATUSES = (429, 503)
+# Вес нового замера в скользящем среднем латентности
+EWMA_ALPHA = 0.2
+# Во сколько раз уменьшаются окно и скорость при перегрузке
+DECREASE_FACTOR = 0.7
+# Рост латентности меньше этого (сек) не считается перегрузкой: шум сети и цикла событий
+LATENCY_SLACK = 0.2
+
+
+class TokenBucket:
+    """Корзина токенов: в среднем не больше rate запросов в секунду, всплеск до capacity. rate <= 0 - без ограничения."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate: float):
+        self._refill()
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = min(self.tokens, self.capacity)
+
+    async def acquire(self):
+        """Ждет и забирает один токен."""
+        if self.rate <= 0:
+            return
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class HostLimiter:
+    """
+    Состояние одного хоста: окно одновременных запросов и скорость (запросов/сек),
+    которые подстраиваются по AIMD. Пока ответы успешные и латентность не растет,
+    окно и скорость увеличиваются (сначала экспоненциально за каждое время ответа,
+    после первой перегрузки - линейно); на 429/503, таймауты и рост латентности - уменьшаются
+    в DECREASE_FACTOR раз.
+    """
+    host: str
+    window: float
+    max_window: float
+    bucket: TokenBucket
+    min_rate: float
+    max_rate: float
+    latency_tolerance: float = 3.0
+    in_flight: int = 0
+    slow_start: bool = True
+    paused_until: float = 0.0
+    latency: Optional[float] = None
+    base_latency: Optional[float] = None
+    last_decrease: float = 0.0
+    successes: int = 0
+    throttled: int = 0
+    errors: int = 0
+    decreases: int = 0
+    condition: asyncio.Condition = field(default_factory=asyncio.Condition)
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    async def acquire(self):
+        """Занимает место в окне, дожидается конца паузы (Retry-After) и токена."""
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.window))
+            self.in_flight += 1
+        try:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self.bucket.acquire()
+        except BaseException:
+            # Отмененное ожидание освобождает место в окне
+            await self.release()
+            raise
+
+    async def release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self, latency: float):
+        self.successes += 1
+        self.latency = latency if self.latency is None else self.latency + EWMA_ALPHA * (latency - self.latency)
+        # Базовая латентность - минимум сглаженной, чтобы единичные быстрые ответы (304) ее не занижали
+        self.base_latency = self.latency if self.base_latency is None else min(self.base_latency, self.latency)
+        if self.latency > max(self.base_latency * self.latency_tolerance, self.base_latency + LATENCY_SLACK):
+            # Сайт отвечает заметно медленнее обычного - перегрузка еще до ошибок
+            self._decrease('latency')
+            return
+        if self.slow_start:
+            # За время ответа приходит около window ответов: окно удваивается, скорость растет в ~e раз
+            self.window = min(self.max_window, self.window + 1)
+            self.bucket.set_rate(min(self.max_rate, self.rate * (1 + 1 / self.window)))
+        else:
+            self.window = min(self.max_window, self.window + 1 / self.window)
+            self.bucket.set_rate(min(self.max_rate, self.rate + 1 / self.rate))
+
+    def on_throttle(self, retry_after: Optional[float]):
+        self.throttled += 1
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        self._decrease('throttled')
+
+    def on_error(self):
+        self.errors += 1
+        self._decrease('error')
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        # Ответы, отправленные до прошлого снижения, не снижают еще раз
+        if now - self.last_decrease < max(self.latency or 0.0, 1.0):
+            return
+        self.last_decrease = now
+        self.slow_start = False
+        self.decreases += 1
+        self.window = max(1.0, self.window * DECREASE_FACTOR)
+        self.bucket.set_rate(max(self.min_rate, self.rate * DECREASE_FACTOR))
+        logger.info(
+            f"Rate limit for {self.host} decreased ({reason}): "
+            f"window {self.window:.1f}, {self.rate:.1f} req/s"
+        )
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            'window': self.window,
+            'rate': self.rate,
+            'in_flight': self.in_flight,
+            'latency': self.latency or 0.0,
+            'base_latency': self.base_latency or 0.0,
+            'paused_for': max(0.0, self.paused_until - time.monotonic()),
+            'successes': self.successes,
+            'throttled': self.throttled,
+            'errors': self.errors,
+            'decreases': self.decreases,
+        }
+
+
+def parse_retry_after(value: Optional[str], limit: float) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата), не больше limit секунд."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        seconds = float(value)
+    else:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), limit)
+
+
+class RateController:
+    """
+    Адаптивное ограничение запросов парсера: по одному HostLimiter на хост
+    и фиксированная корзина токенов на каждый прокси. Заменяет постоянный семафор:
+    скорость растет, пока сайт справляется, и падает до появления массовых 429/503.
+    """
+
+    def __init__(
+        self,
+        initial_window: float = 4,
+        max_window: float = 10,
+        initial_rate: float = 10.0,
+        min_rate: float = 0.5,
+        max_rate: float = 100.0,
+        proxy_rate: float = 0.0,
+        latency_tolerance: float = 3.0,
+        backoff_max: float = 60.0,
+        retry_after_max: float = 300.0,
+    ):
+        self.initial_window = initial_window
+        self.max_window = max_window
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.proxy_rate = proxy_rate
+        self.latency_tolerance = latency_tolerance
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.hosts: Dict[str, HostLimiter] = {}
+        self.proxy_buckets: Dict[Optional[str], TokenBucket] = {}
+
+    def host(self, host: str) -> HostLimiter:
+        limiter = self.hosts.get(host)
+        if limiter is None:
+            limiter = self.hosts[host] = HostLimiter(
+                host=host,
+                window=min(self.initial_window, self.max_window),
+                max_window=self.max_window,
+                bucket=TokenBucket(self.initial_rate),
+                min_rate=self.min_rate,
+                max_rate=self.max_rate,
+                latency_tolerance=self.latency_tolerance,
+            )
+        return limiter
+
+    async def acquire(self, host: str, proxy: Optional[str] = None) -> HostLimiter:
+        """Ждет разрешения на запрос к хосту через прокси. После запроса нужен release."""
+        limiter = self.host(host)
+        await limiter.acquire()
+        if self.proxy_rate > 0:
+            bucket = self.proxy_buckets.setdefault(proxy, TokenBucket(self.proxy_rate))
+            try:
+                await bucket.acquire()
+            except BaseException:
+                await limiter.release()
+                raise
+        return limiter
+
+    async def release(
+        self,
+        limiter: HostLimiter,
+        latency: float,
+        status: Optional[int] = None,
+        retry_after: Optional[str] = None,
+        failed: bool = False,
+    ):
+        """
+        Сообщает результат запроса: status - код ответа (None, если ответа нет),
+        failed - таймаут или сетевая ошибка. Остальные 4xx не влияют на скорость.
+        """
+        if status in THROTTLE_STATUSES:
+            limiter.on_throttle(parse_retry_after(retry_after, self.retry_after_max))
+        elif failed or (status is not None and status >= 500):
+            limiter.on_error()
+        elif status is not None and status < 400:
+            limiter.on_success(latency)
+        await limiter.release()
+
+    def backoff(self, attempt: int, base: float) -> float:
+        """Пауза перед повтором: экспоненциальная с полным джиттером."""
+        return random.uniform(0, min(self.backoff_max, base * 2 ** attempt))
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Состояние всех хостов (для метрик)."""
+        return {host: limiter.snapshot() for host, limiter in self.hosts.items()}
+
+    def metrics(self) -> List[Tuple[str, str, Dict[str, str], float]]:
+        """Состояние хостов в виде gauge-метрик (сборщик для metrics.registry)."""
+        gauges = (
+            ('window', 'crawler_rate_limit_window', 'Concurrent request window'),
+            ('rate', 'crawler_rate_limit_rps', 'Allowed requests per second'),
+            ('in_flight', 'crawler_rate_limit_in_flight', 'Requests in flight'),
+            ('latency', 'crawler_rate_limit_latency_seconds', 'Smoothed response latency'),
+            ('base_latency', 'crawler_rate_limit_base_latency_seconds', 'Baseline response latency'),
+            ('paused_for', 'crawler_rate_limit_paused_seconds', 'Remaining Retry-After pause'),
+            ('throttled', 'crawler_rate_limit_throttled', 'Throttled responses in this crawl'),
+            ('decreases', 'crawler_rate_limit_decreases', 'Rate decreases in this crawl'),
+        )
+        return [
+            (name, help, {'host': host}, state[key])
+            for host, state in self.snapshot().items()
+            for key, name, help in gauges
+        ]
+
+    def report(self) -> str:
+        """Формирует текстовую сводку по хостам."""
+        lines = []
+        for host, state in self.snapshot().items():
+            lines.append(
+                f"{host}: window {state['window']:.1f}, {state['rate']:.1f} req/s, "
+                f"latency {state['latency'] * 1000:.0f} ms (base {state['base_latency'] * 1000:.0f} ms), "
+                f"{state['successes']} ok, {state['throttled']} throttled, {state['errors']} errors, "
+                f"{state['decreases']} decreases"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import Optional
+
+import metrics
+from catalog_cache import catalog_cache
+from config import config
+from parser import MetalParser
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshScheduler:
+    """
+    Периодическое обновление цен внутри цикла событий бота.
+    Бот обслуживает пользователей по текущему поколению данных, пока
+    обновление идет в фоне; после публикации кэш каталога сбрасывается.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        stale_after: float,
+        batch_limit: Optional[int] = None,
+        max_concurrent_requests: int = 10,
+    ):
+        self.interval = interval
+        self.stale_after = stale_after
+        self.batch_limit = batch_limit
+        self.max_concurrent_requests = max_concurrent_requests
+        self.task: Optional[asyncio.Task] = None
+        self.runs = 0
+
+    def start(self):
+        """Запускает фоновую задачу обновления (первый проход - сразу)."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run(), name='price-refresh')
+
+    async def stop(self):
+        """Останавливает обновление, прерывая текущий проход."""
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Price refresh failed")
+            await asyncio.sleep(self.interval)
+
+    async def refresh_once(self) -> int:
+        """Один проход обновления устаревших категорий. Возвращает число обновленных категорий."""
+        self.runs += 1
+        logger.info(f"Price refresh #{self.runs} started")
+        # Разбор страниц и обращения к SQLite не должны занимать цикл событий бота
+        parser = MetalParser(max_concurrent_requests=self.max_concurrent_requests, parse_off_loop=True)
+        try:
+            # Если прошлый проход прервался (падение или остановка бота), сначала он дообходится
+            saved = await parser.parse_all(stale_after=self.stale_after, limit=self.batch_limit, resume=True)
+        finally:
+            await parser.close_session()
+        if saved:
+            catalog_cache.invalidate()
+        logger.info(f"Price refresh #{self.runs} finished: {saved} categories updated")
+        if config.METRICS_FILE:
+            await asyncio.to_thread(metrics.registry.dump_json, config.METRICS_FILE)
+        return saved
@@ -0,0 +1,174 @@
+"""
+Прием обновлений Telegram по вебхуку на сервере aiohttp.
+
+Обновление подтверждается (200) сразу после постановки в обработку, сами
+обработчики идут параллельно, но не больше max_in_flight одновременно: когда
+все места заняты, запрос ждет, и Telegram не присылает новых сверх своего
+max_connections. Вебхук при остановке не снимается, поэтому обновления,
+пришедшие за время перезапуска, Telegram доставит после него.
+При остановке сервер перестает принимать соединения и дожидается уже
+принятых обработчиков (не дольше drain_timeout).
+"""
+import asyncio
+import logging
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+import ujson
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiohttp import web
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+async def drain_tasks(tasks: Iterable[asyncio.Task], timeout: float) -> int:
+    """Дожидается задач обработчиков не дольше timeout, оставшиеся отменяет. Возвращает число отмененных."""
+    pending = set(tasks)
+    if not pending:
+        return 0
+    logger.info(f"Waiting for {len(pending)} update handler(s) to finish...")
+    _, pending = await asyncio.wait(pending, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(f"{len(pending)} update handler(s) did not finish in {timeout:.0f}s and were cancelled")
+    return len(pending)
+
+
+class UpdateTaskTracker(BaseMiddleware):
+    """
+    Внешний middleware обновлений: запоминает задачи, в которых идет обработка,
+    чтобы при остановке long polling их можно было дождаться через drain_tasks.
+    """
+
+    def __init__(self):
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self.tasks.discard(task)
+
+
+class UpdateIngress:
+    """Обработчик POST-запросов вебхука с ограничением числа одновременно обрабатываемых обновлений."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_in_flight: int = 100, secret_token: Optional[str] = None):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.max_in_flight = max_in_flight
+        self.secret_token = secret_token
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.tasks: Set[asyncio.Task] = set()
+        self.accepting = True
+        metrics.registry.register_collector('webhook', self.metrics)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            metrics.WEBHOOK_UPDATES.inc(outcome='unauthorized')
+            return web.Response(status=401)
+        if not self.accepting:
+            # Telegram повторит доставку позже - обновление не теряется
+            metrics.WEBHOOK_UPDATES.inc(outcome='rejected')
+            return web.Response(status=503)
+        received = time.perf_counter()
+        try:
+            update = await request.json(loads=ujson.loads)
+        except ValueError:
+            metrics.WEBHOOK_UPDATES.inc(outcome='invalid')
+            return web.Response(status=400)
+
+        await self.slots.acquire()
+        task = asyncio.create_task(self._process(update, received))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        metrics.WEBHOOK_UPDATES.inc(outcome='accepted')
+        return web.Response()
+
+    async def _process(self, update: dict, received: float):
+        try:
+            await self.dispatcher.feed_raw_update(self.bot, update)
+        except Exception:
+            logger.exception(f"Error processing update {update.get('update_id')}")
+        finally:
+            self.slots.release()
+            metrics.UPDATE_SECONDS.observe(time.perf_counter() - received)
+
+    async def drain(self, timeout: float) -> int:
+        """Перестает принимать обновления и дожидается принятых."""
+        self.accepting = False
+        return await drain_tasks(self.tasks, timeout)
+
+    def metrics(self):
+        return [('bot_updates_in_flight', 'Webhook updates being processed', {}, self.in_flight)]
+
+
+def create_app(ingress: UpdateIngress, path: str) -> web.Application:
+    """Приложение aiohttp с маршрутом вебхука."""
+    app = web.Application()
+    app.router.add_post(path, ingress.handle)
+    return app
+
+
+async def run_webhook(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    url: str,
+    path: str = '/webhook',
+    host: str = '0.0.0.0',
+    port: int = 8080,
+    secret_token: Optional[str] = None,
+    max_in_flight: int = 100,
+    drain_timeout: float = 30,
+):
+    """
+    Запускает бота в режиме вебхука и работает до SIGINT/SIGTERM.
+    url - публичный адрес сервера, к которому Telegram добавит path.
+    """
+    ingress = UpdateIngress(dispatcher, bot, max_in_flight=max_in_flight, secret_token=secret_token)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await dispatcher.emit_startup(bot=bot, **dispatcher.workflow_data)
+    runner = web.AppRunner(create_app(ingress, path), access_log=None)
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        # Очередь обновлений не сбрасывается: накопленное за время простоя будет доставлено
+        await bot.set_webhook(
+            url.rstrip('/') + path,
+            secret_token=secret_token or None,
+            max_connections=min(100, max_in_flight),
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            drop_pending_updates=False,
+        )
+        logger.info(f"Webhook server listening on {host}:{port}{path}, up to {max_in_flight} updates in flight")
+        await stop.wait()
+    finally:
+        logger.info("Stopping webhook server...")
+        ingress.accepting = False
+        # Новые соединения больше не принимаются; уже принятые обновления обрабатываются до конца
+        await runner.cleanup()
+        await ingress.drain(drain_timeout)
+        await dispatcher.emit_shutdown(bot=bot, **dispatcher.workflow_data)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)